@@ -0,0 +1,314 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the aggregation of calls into groups, with the number of
+calls, total duration and duration percentiles of each group, e.g. the
+minutes of each line in March, or the calls per contract type per month.
+
+The calls are grouped by any combination of:
+    month       the (month, year) of the call
+    customer    the id of the customer who made the call
+    line        the number of the line that made the call
+    contract    the contract type ("MTM", "TERM" or "PREPAID") of that line
+    number      the number that was called
+
+Aggregator.group computes the groups of any calls in a single pass. Rollup
+keeps per-month totals of each line and each called number up to date as
+calls are processed (see process_event_history), and answers groupings from
+these totals without looking at the calls again. top_k returns the largest
+groups with a heap.
+"""
+import heapq
+from collections import Counter
+from typing import Any, Iterable, Iterator, Optional
+
+from call import Call
+from contract import Contract, MTMContract, TermContract, PrepaidContract
+from customer import Customer
+from numbertable import NUMBERS
+
+# The fields calls can be grouped by
+GROUPS = ('month', 'customer', 'line', 'contract', 'number')
+
+_CONTRACT_TYPES = {MTMContract: 'MTM', TermContract: 'TERM',
+                   PrepaidContract: 'PREPAID'}
+
+
+class Summary:
+    """ The number of calls of a group, and statistics of their durations.
+
+    === Public Attributes ===
+    count:
+        the number of calls
+    total:
+        the sum of the durations of the calls, in seconds
+    """
+    count: int
+    total: int
+    # === Private Attributes ===
+    # _durations:
+    #     the number of calls of each duration, from which percentiles are
+    #     computed exactly without keeping the calls
+    _durations: Counter
+
+    def __init__(self) -> None:
+        """ Create the summary of an empty group.
+        """
+        self.count = 0
+        self.total = 0
+        self._durations = Counter()
+
+    def add(self, duration: int) -> None:
+        """ Add a call lasting <duration> seconds to this group.
+        """
+        self.count += 1
+        self.total += duration
+        self._durations[duration] += 1
+
+    def merge(self, other: 'Summary') -> None:
+        """ Add all of the calls of <other> to this group.
+        """
+        self.count += other.count
+        self.total += other.total
+        self._durations.update(other._durations)
+
+    def mean(self) -> float:
+        """ Return the mean duration of the calls, or 0 if there are none.
+        """
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, p: float) -> int:
+        """ Return the smallest duration such that at least <p> percent of
+        the calls last at most that long, or 0 if there are no calls.
+
+        Precondition: 0 <= p <= 100
+        """
+        if not self.count:
+            return 0
+        rank = max(1, -(-self.count * p // 100))
+        seen = 0
+        for duration in sorted(self._durations):
+            seen += self._durations[duration]
+            if seen >= rank:
+                return duration
+        return max(self._durations)
+
+    def get_summary(self) -> dict[str, float]:
+        """ Return the statistics of this group as a dictionary, with the
+        keys "count", "total", "mean", "p50", "p90" and "p99".
+        """
+        return {'count': self.count, 'total': self.total,
+                'mean': self.mean(), 'p50': self.percentile(50),
+                'p90': self.percentile(90), 'p99': self.percentile(99)}
+
+
+class Aggregator:
+    """ Groups calls by the fields in GROUPS.
+    """
+    # === Private Attributes ===
+    # _owners:
+    #     the customer id and contract type of each line, by the id of its
+    #     number
+    _owners: dict[int, tuple[int, str]]
+
+    def __init__(self, customers: list[Customer]) -> None:
+        """ Create an aggregator of the calls of <customers>.
+        """
+        self._owners = {}
+        for customer in customers:
+            for line in customer.get_phone_lines():
+                self._owners[line.number_id] = (customer.get_id(),
+                                                contract_type(line.contract))
+
+    def key(self, call: Call, by: tuple[str, ...]) -> tuple:
+        """ Return the group of <call> when grouping by the fields <by>.
+        """
+        owner = self._owners.get(call.src_id, (None, None))
+        values = []
+        for field in by:
+            if field == 'month':
+                values.append((call.time.month, call.time.year))
+            elif field == 'customer':
+                values.append(owner[0])
+            elif field == 'line':
+                values.append(call.src_number)
+            elif field == 'contract':
+                values.append(owner[1])
+            else:
+                values.append(call.dst_number)
+        return tuple(values)
+
+    def group(self, calls: Iterable[Call], by: tuple[str, ...]) \
+            -> dict[tuple, Summary]:
+        """ Return the summary of each group of <calls> when grouping by the
+        fields <by>, in a single pass over <calls>.
+
+        Raise ValueError if a field of <by> is not in GROUPS.
+        """
+        _check_fields(by)
+        groups = {}
+        for call in calls:
+            key = self.key(call, by)
+            summary = groups.get(key)
+            if summary is None:
+                summary = groups[key] = Summary()
+            summary.add(call.duration)
+        return groups
+
+
+class Rollup(Aggregator):
+    """ Per-month summaries of the calls made by each line and to each
+    number, updated as calls are processed.
+
+    Register add_call with process_event_history to keep a Rollup up to
+    date while the event history is processed.
+    """
+    # === Private Attributes ===
+    # _lines:
+    #     the summary of the calls made by each line, by (month, year)
+    # _numbers:
+    #     the summary of the calls to each number, by (month, year)
+    _lines: dict[tuple[int, int], dict[str, Summary]]
+    _numbers: dict[tuple[int, int], dict[str, Summary]]
+
+    def __init__(self, customers: list[Customer],
+                 calls: Optional[Iterable[Call]] = None) -> None:
+        """ Create a rollup of the calls of <customers>, starting with
+        <calls> if they are given.
+        """
+        Aggregator.__init__(self, customers)
+        self._lines = {}
+        self._numbers = {}
+        if calls is not None:
+            for call in calls:
+                self.add_call(call)
+
+    def add_call(self, call: Call) -> None:
+        """ Add <call> to the summaries of its month.
+        """
+        month = (call.time.month, call.time.year)
+        for cells, number in ((self._lines, call.src_number),
+                              (self._numbers, call.dst_number)):
+            by_number = cells.get(month)
+            if by_number is None:
+                by_number = cells[month] = {}
+            summary = by_number.get(number)
+            if summary is None:
+                summary = by_number[number] = Summary()
+            summary.add(call.duration)
+
+    def months(self) -> list[tuple[int, int]]:
+        """ Return the (month, year) of every month with calls, in
+        chronological order.
+        """
+        return sorted(self._lines, key=lambda m: (m[1], m[0]))
+
+    def group(self, calls: Optional[Iterable[Call]] = None,
+              by: tuple[str, ...] = ('month',),
+              months: Optional[list[tuple[int, int]]] = None) \
+            -> dict[tuple, Summary]:
+        """ Return the summary of each group of the calls of <months> (all
+        months by default) when grouping by the fields <by>.
+
+        If <calls> is given, they are grouped in a single pass instead, as
+        with Aggregator.group. Otherwise, the groups are merged from the
+        per-month summaries, which is only possible if <by> does not combine
+        "number" with the fields of the calling line. Raise ValueError if
+        that is the case, or if a field of <by> is not in GROUPS.
+        """
+        if calls is not None:
+            return Aggregator.group(self, calls, by)
+        _check_fields(by)
+        if 'number' in by and len(set(by) - {'month', 'number'}) > 0:
+            raise ValueError("cannot group the called numbers by "
+                             "the fields of the calling line")
+        cells = self._numbers if 'number' in by else self._lines
+        groups = {}
+        for month in (months if months is not None else self.months()):
+            for number, summary in cells.get(month, {}).items():
+                key = self._cell_key(month, number, by)
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = Summary()
+                group.merge(summary)
+        return groups
+
+    def _cell_key(self, month: tuple[int, int], number: str,
+                  by: tuple[str, ...]) -> tuple:
+        """ Return the group of the calls of <number> in <month>, when
+        grouping by the fields <by>.
+        """
+        owner = self._owners.get(NUMBERS.lookup(number), (None, None))
+        values = []
+        for field in by:
+            if field == 'month':
+                values.append(month)
+            elif field == 'customer':
+                values.append(owner[0])
+            elif field == 'contract':
+                values.append(owner[1])
+            else:
+                values.append(number)
+        return tuple(values)
+
+
+def contract_type(contract: Contract) -> str:
+    """ Return the type of <contract>, as written on its bills.
+    """
+    return _CONTRACT_TYPES.get(type(contract), type(contract).__name__)
+
+
+def outgoing_calls(customers: list[Customer]) -> Iterator[Call]:
+    """ Yield every call made by <customers>, without copying the histories
+    of the customers.
+    """
+    for customer in customers:
+        for line in customer.get_phone_lines():
+            for calls in line.get_call_history().outgoing_calls.values():
+                yield from calls
+
+
+def top_k(groups: dict[tuple, Summary], k: int, statistic: str = 'total') \
+        -> list[tuple[tuple, Summary]]:
+    """ Return the <k> groups with the largest <statistic> ("count",
+    "total" or "mean"), largest first, as (group, summary) pairs.
+    """
+    def value(item: tuple[tuple, Summary]) -> Any:
+        """ Return the statistic of a (group, summary) pair.
+        """
+        if statistic == 'mean':
+            return item[1].mean()
+        return getattr(item[1], statistic)
+
+    return heapq.nlargest(k, groups.items(), key=value)
+
+
+def _check_fields(by: tuple[str, ...]) -> None:
+    """ Raise ValueError if one of the fields <by> is not in GROUPS.
+    """
+    for field in by:
+        if field not in GROUPS:
+            raise ValueError("cannot group calls by " + repr(field))
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'heapq', 'collections', 'call',
+            'contract', 'customer', 'numbertable'
+        ],
+        'generated-members': 'pygame.*'
+    })
@@ -12,54 +12,61 @@ All of the files in this directory and all subdirectories are:
 Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
 """
 import datetime
-import json
+import os
+import time
+from typing import Callable, Iterable, Iterator, Optional, Sequence
 
-from contract import MTMContract
-from contract import TermContract
-from contract import PrepaidContract
+from contract import create_contract
 from customer import Customer
 from phoneline import PhoneLine
-from visualizer import Visualizer
 from call import Call
+from datafile import open_dataset
+from decoder import Decoder, EventColumns, get_decoder, parse_time
+from numbertable import NUMBERS
+from reorder import ReorderBuffer, reorder
+from sms import SMSStore
+import cancel
+import metrics
+import tracing
 
 
-def import_data() -> dict[str, list[dict]]:
-    """ Open the file <dataset.json> which stores the json data, and return
-    a dictionary that stores this data in a format as described in the A1
-    handout.
+def import_data(path: str = "dataset.json",
+                decoder: Optional[Decoder] = None) -> dict[str, list[dict]]:
+    """ Open the file <path> (by default, <dataset.json>) which stores the
+    json data, and return a dictionary that stores this data in a format as
+    described in the A1 handout. The file may be compressed with gzip, bz2
+    or xz.
+
+    The data is read by <decoder>, or by default by decoder.get_decoder():
+    the events may then be an EventColumns instead of a list.
 
     Precondition: the dataset file must be in the json format.
     """
-    with open("dataset.json") as o:
-        log = json.load(o)
+    if decoder is None:
+        decoder = get_decoder()
+    with open_dataset(path) as o:
+        log = decoder.load(o)
         return log
 
 
-def create_customers(log: dict[str, list[dict]]) -> list[Customer]:
+def create_customers(log: dict[str, list[dict]],
+                     release: bool = False) -> list[Customer]:
     """ Returns a list of Customer instances for each customer from the input
     dataset from the dictionary <log>.
 
+    If <release> is True, the customer records are removed from <log> as
+    they are read, so that they can be freed.
+
     Precondition:
     - The <log> dictionary contains the input data in the correct format,
     matching the expected input format described in the handout.
     """
     customer_list = []
-    for cust in log['customers']:
+    for cust in _consume(log['customers']) if release else log['customers']:
         customer = Customer(cust['id'])
         for line in cust['lines']:
-            # contract = Contract(datetime.datetime.now())
-            # contract.new_month = lambda *args: None
-            # contract.bill_call = lambda *args: Noney
-            contract = None
-            if line['contract'] == 'prepaid':
-                # start with $100 credit on the account
-                contract = PrepaidContract(datetime.date(2017, 12, 25), 100)
-            elif line['contract'] == 'mtm':
-                contract = MTMContract(datetime.date(2017, 12, 25))
-            elif line['contract'] == 'term':
-                contract = TermContract(datetime.date(2017, 12, 25),
-                                        datetime.date(2019, 6, 25))
-            else:
+            contract = create_contract(line['contract'])
+            if contract is None:
                 print("ERROR: unknown contract type")
 
             line = PhoneLine(line['number'], contract)
@@ -89,13 +96,224 @@ def new_month(customer_list: list[Customer], month: int, year: int) -> None:
         cust.new_month(month, year)
 
 
+def event_fields(event_data: dict) -> tuple:
+    """ Return the fields of the event <event_data>, in the format of the
+    events of the input dataset, in the order of the arguments of
+    EventProcessor.process_fields.
+
+    Raise ValueError if the time of <event_data> is not valid.
+    """
+    event_type = event_data["type"]
+    billing_date = parse_time(event_data['time'])
+    if event_type not in ("call", "sms"):
+        return event_type, "", "", billing_date, 0, (0.0, 0.0), (0.0, 0.0)
+    return (event_type, event_data["src_number"], event_data["dst_number"],
+            billing_date,
+            event_data["duration"] if event_type == "call" else 0,
+            event_data["src_loc"], event_data["dst_loc"])
+
+
+class EventProcessor:
+    """ Processes the events of an event history one at a time, billing
+    each call to the customers who made and received it.
+
+    process_event_history uses an EventProcessor for a whole log; keeping
+    one lets more events be processed later, e.g. from a live feed.
+
+    === Public Attributes ===
+    customers:
+        all customers, extended with the customer records that are processed
+    call_listeners:
+        functions called with each Call once it is billed
+    current_month:
+        the month of the last event processed, or None before the first
+    event_counts:
+        the number of events processed of each type
+    messages:
+        where SMS messages are kept, or None to only count them in the call
+        histories of the lines
+    partial:
+        whether <customers> are only some of the customers (e.g. in a worker
+        process of parallel.py), so that the numbers of other customers are
+        skipped instead of looked for
+    """
+    customers: list[Customer]
+    call_listeners: list[Callable[[Call], None]]
+    current_month: Optional[int]
+    event_counts: dict[str, int]
+    messages: Optional[SMSStore]
+    partial: bool
+    # === Private Attributes ===
+    # _owners:
+    #     the customer owning each number, by the id of the number; filled
+    #     as numbers are seen, as customers may be added meanwhile (or all
+    #     at once, if <partial>)
+    _owners: dict[int, Customer]
+
+    def __init__(self, customers: list[Customer],
+                 call_listeners: Optional[
+                     list[Callable[[Call], None]]] = None,
+                 messages: Optional[SMSStore] = None,
+                 partial: bool = False) -> None:
+        """ Create a processor for the events of <customers>, which calls
+        each of <call_listeners> with each new Call, and adds SMS messages to
+        <messages> if it is given.
+
+        If <partial> is True, the events may also involve numbers of other
+        customers, which are skipped.
+        """
+        self.customers = customers
+        self.call_listeners = call_listeners if call_listeners else []
+        self.current_month = None
+        self.event_counts = {}
+        self.messages = messages
+        self.partial = partial
+        self._owners = {}
+        if partial:
+            for customer in customers:
+                for line in customer.get_phone_lines():
+                    self._owners[line.number_id] = customer
+
+    def process(self, event_data: dict) -> Optional[Call]:
+        """ Process the event <event_data>, in the format of the events of
+        the input dataset, and return the new Call if it is a call.
+
+        A customer record ({"type": "customer", "id": ..., "lines": [...]},
+        as written by generator.py) adds the customer, unless a customer with
+        the same id exists.
+
+        Precondition: events are processed in chronological order.
+        """
+        event_type = event_data["type"]
+        if event_type == "customer":
+            if metrics.ENABLED:
+                self.event_counts[event_type] = \
+                    self.event_counts.get(event_type, 0) + 1
+            if all(c.get_id() != event_data["id"] for c in self.customers):
+                self.customers.extend(create_customers(
+                    {'customers': [event_data]}))
+            return None
+        return self.process_fields(*event_fields(event_data))
+
+    def process_fields(self, event_type: str, src_number: str,
+                       dst_number: str, billing_date: datetime.datetime,
+                       duration: int, src_loc: Sequence[float],
+                       dst_loc: Sequence[float]) -> Optional[Call]:
+        """ Process the event of type <event_type> from <src_number> at
+        <src_loc> to <dst_number> at <dst_loc>, at the time <billing_date>,
+        lasting <duration> seconds if it is a call, and return the new Call
+        if it is a call.
+
+        This is process() for the fields of an event that are already
+        parsed, e.g. from a decoder.EventColumns.
+
+        Precondition: events are processed in chronological order.
+        """
+        if metrics.ENABLED:
+            self.event_counts[event_type] = \
+                self.event_counts.get(event_type, 0) + 1
+
+        # Update contract for new month, before the event is billed
+        if self.current_month != billing_date.month:
+            self.advance_month(billing_date.month, billing_date.year)
+
+        if event_type == "sms":
+            self._process_sms(src_number, dst_number, billing_date,
+                              src_loc, dst_loc)
+            return None
+
+        # Call Object -> Customer Class
+        if event_type != "call":
+            return None
+        new_call = Call(src_number, dst_number, billing_date, duration,
+                        src_loc, dst_loc)
+
+        src_owner = self._owner(new_call.src_id)
+        if src_owner is not None:
+            src_owner.make_call(new_call)
+        dst_owner = self._owner(new_call.dst_id)
+        if dst_owner is not None:
+            dst_owner.receive_call(new_call)
+        for listener in self.call_listeners:
+            listener(new_call)
+        return new_call
+
+    def advance_month(self, month: int, year: int) -> None:
+        """ Advance all customers to the month <month> of <year>, as when
+        the first event of a month is processed.
+        """
+        rollover_start = time.perf_counter()
+        with tracing.span('new_month', month=month, year=year):
+            new_month(self.customers, month, year)
+        self.current_month = month
+        if metrics.ENABLED:
+            metrics.REGISTRY.histogram(
+                'month_rollover_seconds',
+                "Time to advance every customer to a new month") \
+                .observe(time.perf_counter() - rollover_start)
+
+    def _process_sms(self, src_number: str, dst_number: str,
+                     sent: datetime.datetime, src_loc: Sequence[float],
+                     dst_loc: Sequence[float]) -> None:
+        """ Count the SMS message from <src_number> at <src_loc> to
+        <dst_number> at <dst_loc>, sent at <sent>, in the call histories of
+        its lines, and keep it in <messages>.
+        """
+        src_owner = self._owner(NUMBERS.intern(src_number))
+        if src_owner is not None:
+            src_owner.send_sms(src_number, sent.month, sent.year)
+        dst_owner = self._owner(NUMBERS.intern(dst_number))
+        if dst_owner is not None:
+            dst_owner.receive_sms(dst_number, sent.month, sent.year)
+        if self.messages is not None:
+            self.messages.add(src_number, dst_number, sent, src_loc, dst_loc)
+
+    def _owner(self, number_id: int) -> Optional[Customer]:
+        """ Return the customer owning the number with the id <number_id>,
+        or None if no customer owns it.
+        """
+        owner = self._owners.get(number_id)
+        if owner is None and not self.partial:
+            owner = find_customer_by_number(NUMBERS.number(number_id),
+                                            self.customers)
+            if owner is not None:
+                self._owners[number_id] = owner
+        return owner
+
+
+@tracing.traced
 def process_event_history(log: dict[str, list[dict]],
-                          customer_list: list[Customer]) -> None:
+                          customer_list: list[Customer],
+                          call_listeners: Optional[
+                              list[Callable[[Call], None]]] = None,
+                          messages: Optional[SMSStore] = None,
+                          release: bool = False,
+                          reorder_buffer: Optional[ReorderBuffer] = None) \
+        -> None:
     """ Process the calls from the <log> dictionary. The <customer_list>
     list contains all the customers that exist in the <log> dictionary.
 
     Construct Call objects from <log> and register the Call into the
-    corresponding customer's call history.
+    corresponding customer's call history. Each function of <call_listeners>
+    is then called with the Call, e.g. to keep a Rollup up to date.
+
+    SMS messages are counted in the call histories, and added to <messages>
+    if it is given.
+
+    If <release> is True, the events are removed from <log> as they are
+    processed, so that each one is freed once it has become a Call: the raw
+    log and the objects made from it are then never all in memory at once.
+    The caller should not keep <log> afterwards.
+
+    The events of <log> may also be a decoder.EventColumns, whose rows are
+    billed without making a dictionary for each event (and, if <release> is
+    True, are removed once they are processed), or an iterator, e.g. merging
+    the events of several files as they are read (see shards.py), which is
+    consumed.
+
+    If <reorder_buffer> is given, the events go through it, so they may be
+    out of order by up to its lateness: the events that are later than that
+    are not processed, and are left in reorder_buffer.late.
 
     Hint: You must advance all customers to a new month using the new_month()
     function, everytime a new month is detected for the current event you are
@@ -103,46 +321,183 @@ def process_event_history(log: dict[str, list[dict]],
 
     Preconditions:
     - All calls are ordered chronologically (based on the call's date and time),
-    when retrieved from the dictionary <log>, as specified in the handout.
+    when retrieved from the dictionary <log>, as specified in the handout
+    (or within the lateness of <reorder_buffer>, if it is given).
     - The <log> argument guarantees that there is no "gap" month with zero
     activity for ALL customers, as specified in the handout.
     - The <log> dictionary is in the correct format, as defined in the
     handout.
     - The <customer_list> already contains all the customers from the <log>.
+
+    Raise cancel.Cancelled if the active cancel token stops the processing;
+    the events before it are processed and billed (and, if <release> is
+    True, the other events are left in <log>, except those waiting in
+    <reorder_buffer>).
     """
-    current_month = ""
-    for event_data in log['events']:
-        billing_date = datetime.datetime.strptime(event_data['time'],
-                                                  "%Y-%m-%d %H:%M:%S")
-        # Call Object -> Customer Class
-        if event_data["type"] == "call":
-            new_call = Call(event_data["src_number"], event_data["dst_number"],
-                            billing_date, event_data["duration"],
-                            event_data["src_loc"], event_data["dst_loc"])
+    started = time.perf_counter()
+    processor = EventProcessor(customer_list, call_listeners, messages)
+    token = cancel.current()
+    events = log['events']
+    if isinstance(events, EventColumns) and reorder_buffer is None:
+        processed = 0
+        try:
+            for fields in events.rows():
+                cancel.check(token, processed)
+                processor.process_fields(*fields)
+                processed += 1
+        finally:
+            if release:
+                # The columns are compact, so they are released at the end
+                events.remove_first(processed)
+    else:
+        for i, event_data in enumerate(
+                iter_events(log, release, reorder_buffer)):
+            cancel.check(token, i)
+            processor.process(event_data)
 
-            cust1 = find_customer_by_number(event_data["src_number"],
-                                            customer_list)
-            cust2 = find_customer_by_number(event_data["dst_number"],
-                                            customer_list)
-            cust1.make_call(new_call)
-            cust2.receive_call(new_call)
+    if metrics.ENABLED:
+        record_ingestion(processor.event_counts,
+                         time.perf_counter() - started)
 
-        # Update contract for new month
-        billing_month = billing_date.month
-        if current_month != billing_month:
-            new_month(customer_list, billing_month, billing_date.year)
-            current_month = billing_month
+
+def iter_events(log: dict[str, list[dict]], release: bool = False,
+                reorder_buffer: Optional[ReorderBuffer] = None) -> Iterable:
+    """ Return the events of <log> to process, as dictionaries in the format
+    of the events of the input dataset: removed from <log> as they are
+    used if <release> is True, and going through <reorder_buffer> if it is
+    given, as for process_event_history.
+    """
+    events = log['events']
+    if release and isinstance(events, list):
+        events = _consume(events)
+    if reorder_buffer is not None:
+        events = reorder(events, reorder_buffer)
+    return events
+
+
+def _consume(items: list) -> Iterator:
+    """ Yield the items of <items> in order, removing each one from <items>
+    once the next one is asked for. If the iteration stops early, <items> is
+    left with the items that were not used, in order.
+    """
+    # Popping from the end of the list is fast, and frees its memory
+    items.reverse()
+    try:
+        while items:
+            yield items[-1]
+            items.pop()
+    finally:
+        items.reverse()
+
+
+def generate_bills(customer_list: list[Customer], month: int, year: int) \
+        -> list[tuple[int, float, list[dict]]]:
+    """ Return the bill of every customer of <customer_list> for <month> and
+    <year>, as returned by Customer.generate_bill.
+
+    If the active cancel token stops the billing, return a
+    cancel.PartialResult with the bills generated so far.
+    """
+    token = cancel.current()
+    bills = []
+    for customer in customer_list:
+        # bills are slower than filtering a call, so check every time
+        if token is not None and token.is_stopped():
+            return cancel.PartialResult(bills, token.reason(), len(bills),
+                                        len(customer_list))
+        bills.append(customer.generate_bill(month, year))
+    return bills
+
+
+def record_ingestion(event_counts: dict[str, int], elapsed: float) -> None:
+    """ Record the number of events of each type in <event_counts> that were
+    processed in <elapsed> seconds.
+    """
+    events = metrics.REGISTRY.counter('ingested_events_total',
+                                      "Events processed, by event type")
+    for event_type, count in event_counts.items():
+        events.inc(count, type=event_type)
+    metrics.REGISTRY.histogram('ingestion_seconds',
+                               "Time to process an event history") \
+        .observe(elapsed)
+    if elapsed > 0:
+        metrics.REGISTRY.gauge('ingestion_events_per_second',
+                               "Throughput of the last event history") \
+            .set(sum(event_counts.values()) / elapsed)
 
 
 if __name__ == '__main__':
+    # Only import the GUI when the application is actually run
+    from visualizer import Visualizer
+
+    if os.environ.get('MEWBILE_METRICS_PORT'):
+        metrics.enable()
+        metrics.REGISTRY.serve(int(os.environ['MEWBILE_METRICS_PORT']))
+
+    # Report the memory of each stage, if asked to
+    import memreport
+
+    memory = None
+    if memreport.ENABLED:
+        import tracemalloc
+
+        tracemalloc.start()
+        memory = memreport.MemoryReport()
     v = Visualizer()
     print("Toronto map coordinates:")
     print("  Lower-left corner: -79.697878, 43.576959")
     print("  Upper-right corner: -79.196382, 43.799568")
 
-    input_dictionary = import_data()
-    customers = create_customers(input_dictionary)
-    process_event_history(input_dictionary, customers)
+    import storage
+
+    store = None
+    messages = SMSStore()
+    if storage.FILTER_BACKEND == 'sqlite':
+        store = storage.CallStore(os.environ.get('MEWBILE_DB', 'mewbile.db'))
+        customers = store.load(messages)
+    # Events may be out of order by this many seconds, if it is given
+    lateness = float(os.environ['MEWBILE_LATENESS']) \
+        if os.environ.get('MEWBILE_LATENESS') else None
+    if not store or not customers:
+        if os.environ.get('MEWBILE_SHARDS'):
+            # A dataset split into several files, merged as it is read
+            import shards
+
+            input_dictionary = shards.import_shards(
+                os.environ['MEWBILE_SHARDS'].split(os.pathsep),
+                os.environ.get('MEWBILE_CUSTOMERS'), lateness is None)
+        else:
+            input_dictionary = import_data()
+        if memory:
+            memory.sample('import', input_dictionary)
+        customers = create_customers(input_dictionary, release=True)
+        if memory:
+            memory.sample('customers', input_dictionary)
+        # The log is emptied as its events become calls, so that it is not
+        # kept in memory along with them
+        buffer = None if lateness is None else ReorderBuffer(lateness)
+        if os.environ.get('MEWBILE_WORKERS'):
+            # The calls are billed in this many worker processes
+            import parallel
+
+            parallel.process_event_history(
+                input_dictionary, customers, None, messages, release=True,
+                reorder_buffer=buffer,
+                workers=int(os.environ['MEWBILE_WORKERS']))
+        else:
+            process_event_history(input_dictionary, customers, None,
+                                  messages, release=True,
+                                  reorder_buffer=buffer)
+        input_dictionary = None
+        if buffer is not None and buffer.late_count:
+            print("Events too late to be billed in order:",
+                  buffer.late_count)
+        if memory:
+            memory.sample('events')
+        if store:
+            store.save(customers, messages)
+    v.store = store
+    v.messages = messages
 
     # ----------------------------------------------------------------------
     # NOTE: You do not need to understand any of the implementation below,
@@ -159,6 +514,32 @@ if __name__ == '__main__':
         all_calls.extend(hist[0])
     print("\n-----------------------------------------")
     print("Total Calls in the dataset:", len(all_calls))
+    print("Total SMS messages in the dataset:", len(messages))
+
+    # Keep the filtered calls up to date if more calls are processed
+    from standing import StandingQuery
+    v.standing = StandingQuery(customers, all_calls)
+
+    # Follow a growing JSON Lines file of new events, if one is given
+    tail = None
+    if os.environ.get('MEWBILE_LIVE'):
+        from livetail import LiveTail
+
+        def on_calls(calls: list[Call]) -> None:
+            """ Add the new <calls> to the store, if there is one, so that
+            the SQL filters select them, and then to the calls on screen.
+            """
+            v.standing.extend(store.add(calls) if store else calls)
+
+        tail = LiveTail(os.environ['MEWBILE_LIVE'],
+                        EventProcessor(customers, None, messages),
+                        on_calls,
+                        int(os.environ.get('MEWBILE_LIVE_BATCH', 500)),
+                        int(os.environ.get('MEWBILE_LIVE_PENDING', 8)),
+                        os.environ.get('MEWBILE_LIVE_FROM_START') == '1',
+                        None if lateness is None
+                        else ReorderBuffer(lateness), v.lock)
+        tail.start()
 
     # Main loop for the application.
     # 1) Wait for user interaction with the system and processes everything
@@ -170,22 +551,37 @@ if __name__ == '__main__':
     while not v.has_quit():
         events = v.handle_window_events(customers, events)
 
-        connections = []
-        drawables = []
-        for event in events:
-            connections.append(event.get_connection())
-            drawables.extend(event.get_drawables())
+        with tracing.span('build drawables', calls=len(events)):
+            connections = []
+            drawables = []
+            for event in events:
+                connections.append(event.get_connection())
+                drawables.extend(event.get_drawables())
 
-        # Put the connections on top of the other sprites
-        drawables.extend(connections)
+            # Put the connections on top of the other sprites
+            drawables.extend(connections)
         v.render_drawables(drawables)
 
+    if tail is not None:
+        tail.stop()
+        print("Live feed:", tail.stats())
+    if memory:
+        memory.sample('exit')
+        memory.write(os.environ['MEWBILE_MEMORY'])
+    if os.environ.get('MEWBILE_METRICS_FILE'):
+        metrics.REGISTRY.dump(os.environ['MEWBILE_METRICS_FILE'])
+    if tracing.ENABLED and os.environ.get('MEWBILE_TRACE'):
+        tracing.write()
+
     import python_ta
 
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'json', 'datetime',
-            'visualizer', 'customer', 'call', 'contract', 'phoneline'
+            'python_ta', 'typing', 'datetime', 'os', 'time', 'cancel',
+            'visualizer', 'customer', 'call', 'contract', 'phoneline',
+            'metrics', 'tracing', 'storage', 'standing', 'livetail', 'sms',
+            'numbertable', 'memreport', 'tracemalloc', 'shards', 'reorder',
+            'datafile', 'decoder', 'parallel'
         ],
         'allowed-io': [
             'create_customers', 'import_data'
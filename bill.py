@@ -47,6 +47,7 @@ class Bill:
     -   min_rate >= 0
     -   type: "" | "MTM" | "TERM" | "PREPAID"
     """
+    __slots__ = ('billed_min', 'free_min', 'min_rate', 'fixed_cost', 'type')
     billed_min: int
     free_min: int
     min_rate: float
@@ -11,16 +11,27 @@ any changes, are expressly prohibited.
 All of the files in this directory and all subdirectories are:
 Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
 """
+from __future__ import annotations
+
 import datetime
 import os
 from typing import Optional
-import pygame
+
+from lazy import LazyModule
+from numbertable import NUMBERS
+
+# pygame is only imported once a sprite is actually needed
+pygame = LazyModule('pygame')
 
 
 # Sprite files to display the start and end of a call
 START_CALL_SPRITE = 'data/call-start-2.png'
 END_CALL_SPRITE = 'data/call-end-2.png'
 
+# Sprites that were already loaded, by file name; they are shared by all of
+# the drawables, since they are never modified
+_SPRITES = {}
+
 
 # ----------------------------------------------------------------------------
 # NOTE: You do not need to understand the implementation of the Drawable class
@@ -40,7 +51,12 @@ class Drawable:
         If none, then must have sprite
     loc: location (longitude/latitude pair)
     """
-    sprite: Optional[pygame.Surface]
+    # === Private Attributes ===
+    # _sprite_file:
+    #     file of the image for this drawable, which is only loaded when the
+    #     sprite is first used, or None if this drawable is a line
+    __slots__ = ('_sprite_file', 'linelimits', 'loc')
+    _sprite_file: Optional[str]
     linelimits: Optional[tuple[float, float]]
     loc: Optional[tuple[float, float]]
 
@@ -53,17 +69,28 @@ class Drawable:
         and <linelimits>.
         """
         self.linelimits = None
-        self.sprite = None
+        self._sprite_file = None
         self.loc = None
 
         if sprite_file is not None and location is not None:
-            self.sprite = pygame.transform.smoothscale(
-                pygame.image.load(os.path.join(os.path.dirname(__file__),
-                                               sprite_file)), (13, 13))
+            self._sprite_file = sprite_file
             self.loc = location
         else:
             self.linelimits = linelimits
 
+    @property
+    def sprite(self) -> Optional[pygame.Surface]:
+        """Return the image object for this drawable, or None if this drawable
+        is a line.
+        """
+        if self._sprite_file is None:
+            return None
+        if self._sprite_file not in _SPRITES:
+            _SPRITES[self._sprite_file] = pygame.transform.smoothscale(
+                pygame.image.load(os.path.join(os.path.dirname(__file__),
+                                               self._sprite_file)), (13, 13))
+        return _SPRITES[self._sprite_file]
+
     def get_position(self) -> tuple[float, float]:
         """Return the (long, lat) position of this object at the given time.
         """
@@ -84,6 +111,10 @@ class Call:
          source number for this Call
     dst_number:
          destination number for this Call
+    src_id:
+         id of the source number in numbertable.NUMBERS
+    dst_id:
+         id of the destination number in numbertable.NUMBERS
     time:
          date and time of this Call
     duration:
@@ -95,22 +126,35 @@ class Call:
          location of the destination of this Call; a Tuple containing the
          longitude and latitude coordinates
     drawables:
-         sprites for drawing the source and destination of this Call
+         sprites for drawing the source and destination of this Call, made
+         the first time they are used
     connection:
          connecting line between the two sprites representing the source and
-         destination of this Call
+         destination of this Call, made the first time it is used
 
     === Representation Invariants ===
     -   duration >= 0
     """
+    # === Private Attributes ===
+    # _drawables:
+    #     the sprites of this Call, or None until they are first used
+    # _connection:
+    #     the line of this Call, or None until it is first used
+    # Calls are the most numerous objects of the application, so they have
+    # no __dict__
+    __slots__ = ('src_number', 'dst_number', 'src_id', 'dst_id', 'time',
+                 'duration', 'src_loc', 'dst_loc', '_drawables',
+                 '_connection')
     src_number: str
     dst_number: str
+    src_id: int
+    dst_id: int
     time: datetime.datetime
     duration: int
     src_loc: tuple[float, float]
     dst_loc: tuple[float, float]
-    drawables: list[Drawable]
-    connection: Drawable
+    _drawables: Optional[list[Drawable]]
+    _connection: Optional[Drawable]
 
     def __init__(self, src_nr: str, dst_nr: str,
                  calltime: datetime.datetime, duration: int,
@@ -118,18 +162,40 @@ class Call:
             -> None:
         """ Create a new Call object with the given parameters.
         """
-        self.src_number = src_nr
-        self.dst_number = dst_nr
+        self.src_id = NUMBERS.intern(src_nr)
+        self.dst_id = NUMBERS.intern(dst_nr)
+        # share the number strings of the table
+        self.src_number = NUMBERS.number(self.src_id)
+        self.dst_number = NUMBERS.number(self.dst_id)
         self.time = calltime
         self.duration = duration
-        self.src_loc = src_loc
-        self.dst_loc = dst_loc
-        self.drawables = [Drawable(sprite_file=START_CALL_SPRITE,
-                                   location=src_loc),
-                          Drawable(sprite_file=END_CALL_SPRITE,
-                                   location=dst_loc)]
-
-        self.connection = Drawable(linelimits=(src_loc, dst_loc))
+        # the locations may be lists, as read from the dataset
+        self.src_loc = (src_loc[0], src_loc[1])
+        self.dst_loc = (dst_loc[0], dst_loc[1])
+        self._drawables = None
+        self._connection = None
+
+    @property
+    def drawables(self) -> list[Drawable]:
+        """ Return the sprites for drawing the source and destination of this
+        Call.
+        """
+        if self._drawables is None:
+            self._drawables = [Drawable(sprite_file=START_CALL_SPRITE,
+                                        location=self.src_loc),
+                               Drawable(sprite_file=END_CALL_SPRITE,
+                                        location=self.dst_loc)]
+        return self._drawables
+
+    @property
+    def connection(self) -> Drawable:
+        """ Return the line connecting the source and destination of this
+        Call.
+        """
+        if self._connection is None:
+            self._connection = Drawable(linelimits=(self.src_loc,
+                                                    self.dst_loc))
+        return self._connection
 
     def get_bill_date(self) -> tuple[int, int]:
         """ Return the billing date for this Call, as a tuple containing the
@@ -160,11 +226,18 @@ class Call:
             + str(self.src_loc) + "dstloc" + str(self.dst_loc)
 
 
+def loaded_sprites() -> list[pygame.Surface]:
+    """ Return the sprites loaded so far, one per image file.
+    """
+    return list(_SPRITES.values())
+
+
 if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'datetime', 'os', 'pygame'
+            'python_ta', 'typing', 'datetime', 'os', 'pygame', 'lazy',
+            'numbertable'
         ],
         'disable': ['R0902', 'R0913'],
         'generated-members': 'pygame.*'
@@ -24,15 +24,26 @@ class CallHistory:
     outgoing_calls:
          Dictionary of outgoing calls. Keys are tuples containing a month and a
          year, values are a List of Call objects for that month and year.
+    incoming_sms:
+         Dictionary of the number of SMS messages received. Keys are tuples
+         containing a month and a year, as for <incoming_calls>.
+    outgoing_sms:
+         Dictionary of the number of SMS messages sent, by month and year.
     """
+    __slots__ = ('incoming_calls', 'outgoing_calls', 'incoming_sms',
+                 'outgoing_sms')
     incoming_calls: dict[tuple[int, int], list[Call]]
     outgoing_calls: dict[tuple[int, int], list[Call]]
+    incoming_sms: dict[tuple[int, int], int]
+    outgoing_sms: dict[tuple[int, int], int]
 
     def __init__(self) -> None:
         """ Create an empty CallHistory.
         """
         self.outgoing_calls = {}
         self.incoming_calls = {}
+        self.outgoing_sms = {}
+        self.incoming_sms = {}
 
     def register_outgoing_call(self, call: Call) -> None:
         """ Register a Call <call> into this outgoing call history
@@ -50,6 +61,18 @@ class CallHistory:
             self.incoming_calls[time_tuple].append(call)
         else: self.incoming_calls[time_tuple] = [call]
 
+    def register_outgoing_sms(self, month: int, year: int) -> None:
+        """ Count an SMS message sent in <month> and <year>
+        """
+        self.outgoing_sms[(month, year)] = \
+            self.outgoing_sms.get((month, year), 0) + 1
+
+    def register_incoming_sms(self, month: int, year: int) -> None:
+        """ Count an SMS message received in <month> and <year>
+        """
+        self.incoming_sms[(month, year)] = \
+            self.incoming_sms.get((month, year), 0) + 1
+
     # ----------------------------------------------------------
     # NOTE: You do not need to understand the implementation of
     # the following methods, to be able to solve this assignment
@@ -80,14 +103,27 @@ class CallHistory:
                 for call in self.incoming_calls[(month, year)]:
                     monthly_history[1].append(call)
         else:
-            for entry in self.outgoing_calls:
-                for call in self.outgoing_calls[entry]:
-                    monthly_history[0].append(call)
-            for entry in self.incoming_calls:
-                for call in self.incoming_calls[entry]:
-                    monthly_history[1].append(call)
+            # The months are copied first, as new calls (e.g. from the live
+            # feed) may add a month while the history is read
+            for calls in list(self.outgoing_calls.values()):
+                monthly_history[0].extend(calls)
+            for calls in list(self.incoming_calls.values()):
+                monthly_history[1].extend(calls)
         return monthly_history
 
+    def get_monthly_sms(self, month: int = None, year: int = None) -> \
+            tuple[int, int]:
+        """ Return the number of SMS messages sent and received in <month>
+        and <year>, as a Tuple (sent, received).
+
+        If <month> and <year> are both None, then count all messages from
+        this call history.
+        """
+        if month is not None and year is not None:
+            return (self.outgoing_sms.get((month, year), 0),
+                    self.incoming_sms.get((month, year), 0))
+        return sum(self.outgoing_sms.values()), sum(self.incoming_sms.values())
+
 
 if __name__ == '__main__':
     import python_ta
@@ -0,0 +1,205 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains cancellation tokens, which stop long filters, billing and
+ingestion early, either on request or when a time budget runs out.
+
+A token is made active for the current thread with activate(); code that
+loops over many calls or events asks stopped() every CHECK_INTERVAL items,
+so the signatures of Filter.apply and friends do not change, and there is
+no cost when no token is active. A filter that stops early returns a
+PartialResult: either the calls selected so far, or the original data,
+depending on the token, flagged as incomplete. Loops that cannot return a
+partial result (e.g. processing an event history) raise Cancelled instead.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from call import Call
+
+# Number of items processed between checks of the active token
+CHECK_INTERVAL = 1024
+
+# What a filter returns when it is stopped early
+PARTIAL = 'partial'
+ORIGINAL = 'original'
+
+_local = threading.local()
+
+
+class Cancelled(Exception):
+    """ Raised when a job that has no partial result is stopped early.
+
+    === Public Attributes ===
+    reason:
+        "cancelled" or "budget"
+    processed:
+        the number of items processed before stopping
+    """
+    reason: str
+    processed: int
+
+    def __init__(self, reason: str, processed: int) -> None:
+        """ Create a new exception for a job stopped for <reason> after
+        <processed> items.
+        """
+        Exception.__init__(self, reason + " after " + str(processed))
+        self.reason = reason
+        self.processed = processed
+
+
+class CancelToken:
+    """ Tells long jobs to stop, when cancelled or when their time budget
+    runs out.
+
+    === Public Attributes ===
+    budget:
+        the number of seconds the job may run, or None for no limit
+    on_stop:
+        PARTIAL to return the calls selected so far when a filter is
+        stopped, or ORIGINAL to return its data unchanged
+    """
+    budget: Optional[float]
+    on_stop: str
+    # === Private Attributes ===
+    # _deadline:
+    #     the time.monotonic() at which the budget runs out, or None
+    # _cancelled:
+    #     set when cancel() is called
+    _deadline: Optional[float]
+    _cancelled: threading.Event
+
+    def __init__(self, budget: Optional[float] = None,
+                 on_stop: str = PARTIAL) -> None:
+        """ Create a token for a job that may run for <budget> seconds from
+        now (no limit if None), and whose filters return <on_stop> results
+        when they are stopped.
+        """
+        self.budget = budget
+        self.on_stop = on_stop
+        self._deadline = None if budget is None \
+            else time.monotonic() + budget
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """ Ask the jobs using this token to stop.
+        """
+        self._cancelled.set()
+
+    def reason(self) -> Optional[str]:
+        """ Return "cancelled" if this token was cancelled, "budget" if the
+        budget ran out, or None if the job may go on.
+        """
+        if self._cancelled.is_set():
+            return 'cancelled'
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            return 'budget'
+        return None
+
+    def is_stopped(self) -> bool:
+        """ Return whether the jobs using this token must stop.
+        """
+        return self.reason() is not None
+
+
+class PartialResult(list):
+    """ The calls returned by a filter (or the bills returned by a billing
+    job) that was stopped early.
+
+    === Public Attributes ===
+    reason:
+        "cancelled" or "budget"
+    scanned:
+        the number of items looked at before stopping
+    total:
+        the number of items to look at, e.g. all of the data of a filter
+    """
+    reason: str
+    scanned: int
+    total: int
+
+    def __init__(self, items: list, reason: str, scanned: int,
+                 total: int) -> None:
+        """ Create a partial result holding <items>.
+        """
+        list.__init__(self, items)
+        self.reason = reason
+        self.scanned = scanned
+        self.total = total
+
+
+def current() -> Optional[CancelToken]:
+    """ Return the token active in this thread, or None.
+    """
+    return getattr(_local, 'token', None)
+
+
+@contextmanager
+def activate(token: Optional[CancelToken]) -> Iterator[None]:
+    """ Make <token> the active token of this thread in the with block.
+    """
+    previous = current()
+    _local.token = token
+    try:
+        yield
+    finally:
+        _local.token = previous
+
+
+def stopped(token: Optional[CancelToken], count: int) -> bool:
+    """ Return whether a loop that has processed <count> items must stop
+    because of <token>. The token is only checked every CHECK_INTERVAL
+    items.
+    """
+    return token is not None and count % CHECK_INTERVAL == 0 \
+        and count > 0 and token.is_stopped()
+
+
+def check(token: Optional[CancelToken], count: int) -> None:
+    """ Raise Cancelled if a loop that has processed <count> items must stop
+    because of <token>.
+    """
+    if stopped(token, count):
+        raise Cancelled(token.reason(), count)
+
+
+def partial(token: CancelToken, selected: list[Call], data: list[Call],
+            scanned: int, total: Optional[int] = None) -> PartialResult:
+    """ Return the result of a filter stopped by <token> after looking at
+    <scanned> of the <total> calls to look at (by default, all of <data>)
+    and selecting <selected>.
+    """
+    calls = selected if token.on_stop == PARTIAL else data
+    return PartialResult(calls, token.reason() or 'cancelled', scanned,
+                         len(data) if total is None else total)
+
+
+def is_complete(items: list) -> bool:
+    """ Return whether <items> is the complete result of a filter or a
+    billing job.
+    """
+    return not isinstance(items, PartialResult)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'threading', 'time', 'contextlib', 'call'
+        ],
+        'generated-members': 'pygame.*'
+    })
@@ -48,6 +48,7 @@ class Contract:
          bill for this contract for the last month of call records loaded from
          the input dataset
     """
+    __slots__ = ('start', 'bill')
     start: datetime.date
     bill: Optional[Bill]
 
@@ -107,6 +108,7 @@ class MTMContract(Contract):
     year:
         the current year of the bill
     """
+    __slots__ = ('month', 'year')
     month: int
     year: int
 
@@ -150,6 +152,7 @@ class TermContract(Contract):
     year:
         the current year of the bill
     """
+    __slots__ = ('end', 'month', 'year')
     end: datetime.date
     month: int
     year: int
@@ -240,6 +243,7 @@ class PrepaidContract(Contract):
         The credit (prepaid amount) of the customer. It also represents
         the amount owed by the customer
     """
+    __slots__ = ('month', 'year', 'balance')
     month: int
     year: int
     balance: float
@@ -287,6 +291,26 @@ class PrepaidContract(Contract):
         return 0
 
 
+def create_contract(contract_type: str) -> Optional[Contract]:
+    """ Return a new contract of type <contract_type> ("prepaid", "mtm" or
+    "term"), as used for the customers of the input dataset.
+    Return None if <contract_type> is unknown.
+    """
+    # contract = Contract(datetime.datetime.now())
+    # contract.new_month = lambda *args: None
+    # contract.bill_call = lambda *args: Noney
+    contract = None
+    if contract_type == 'prepaid':
+        # start with $100 credit on the account
+        contract = PrepaidContract(datetime.date(2017, 12, 25), 100)
+    elif contract_type == 'mtm':
+        contract = MTMContract(datetime.date(2017, 12, 25))
+    elif contract_type == 'term':
+        contract = TermContract(datetime.date(2017, 12, 25),
+                                datetime.date(2019, 6, 25))
+    return contract
+
+
 if __name__ == '__main__':
     import python_ta
 
@@ -11,7 +11,10 @@ any changes, are expressly prohibited.
 All of the files in this directory and all subdirectories are:
 Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
 """
+import time
 from typing import Union
+import metrics
+from numbertable import NUMBERS
 from phoneline import PhoneLine
 from call import Call
 from callhistory import CallHistory
@@ -26,14 +29,18 @@ class Customer:
     #     this customer's 4 digit Customer id
     # _phone_lines:
     #     this customer's phone lines
+    # _lines_by_id:
+    #     this customer's phone lines, by the id of their number
     _id: int
     _phone_lines: list[PhoneLine]
+    _lines_by_id: dict[int, PhoneLine]
 
     def __init__(self, cid: int) -> None:
         """ Create a new Customer with the <cid> id
         """
         self._id = cid
         self._phone_lines = []
+        self._lines_by_id = {}
 
     def new_month(self, month: int, year: int) -> None:
         """ Advance to a new month (specified by <month> and <year>) in the
@@ -51,9 +58,9 @@ class Customer:
         Precondition: The phone line associated with the source phone number of
         <call>, is owned by this customer
         """
-        for phone_line in self._phone_lines:
-            if phone_line.number == call.src_number:
-                phone_line.make_call(call)
+        phone_line = self._lines_by_id.get(call.src_id)
+        if phone_line is not None:
+            phone_line.make_call(call)
 
     def receive_call(self, call: Call) -> None:
         """ Record that a call was made to the destination phone number of
@@ -62,21 +69,40 @@ class Customer:
         Precondition: The phone line associated with the destination phone
         number of <call>, is owned by this customer
         """
-        for phone_line in self._phone_lines:
-            if phone_line.number == call.dst_number:
-                phone_line.receive_call(call)
+        phone_line = self._lines_by_id.get(call.dst_id)
+        if phone_line is not None:
+            phone_line.receive_call(call)
+
+    def send_sms(self, number: str, month: int, year: int) -> None:
+        """ Record that an SMS message was sent from the phone number
+        <number> in <month> and <year>.
+
+        Precondition: The phone line with <number> is owned by this customer
+        """
+        phone_line = self._lines_by_id.get(NUMBERS.lookup(number))
+        if phone_line is not None:
+            phone_line.callhistory.register_outgoing_sms(month, year)
+
+    def receive_sms(self, number: str, month: int, year: int) -> None:
+        """ Record that an SMS message was received by the phone number
+        <number> in <month> and <year>.
+
+        Precondition: The phone line with <number> is owned by this customer
+        """
+        phone_line = self._lines_by_id.get(NUMBERS.lookup(number))
+        if phone_line is not None:
+            phone_line.callhistory.register_incoming_sms(month, year)
 
     def cancel_phone_line(self, number: str) -> Union[float, None]:
         """ Remove PhoneLine with number <number> from this customer and return
         the amount still owed by this customer.
         Return None if <number> is not owned by this customer.
         """
-        fee = None
-        for pl in self._phone_lines:
-            if pl.get_number() == number:
-                self._phone_lines.remove(pl)
-                fee = pl.cancel_line()
-        return fee
+        pl = self._lines_by_id.pop(NUMBERS.lookup(number), None)
+        if pl is None:
+            return None
+        self._phone_lines.remove(pl)
+        return pl.cancel_line()
 
     # ----------------------------------------------------------
     # NOTE: You do not need to understand the implementation of
@@ -88,6 +114,12 @@ class Customer:
         """ Add a new PhoneLine to this customer.
         """
         self._phone_lines.append(pline)
+        self._lines_by_id[pline.number_id] = pline
+
+    def get_phone_lines(self) -> list[PhoneLine]:
+        """ Return a list of all of the phone lines this customer owns
+        """
+        return list(self._phone_lines)
 
     def get_phone_numbers(self) -> list[str]:
         """ Return a list of all of the numbers this customer owns
@@ -105,11 +137,7 @@ class Customer:
     def __contains__(self, item: str) -> bool:
         """ Check if this customer owns the phone number <item>
         """
-        contains = False
-        for line in self._phone_lines:
-            if line.get_number() == item:
-                contains = True
-        return contains
+        return NUMBERS.lookup(item) in self._lines_by_id
 
     def generate_bill(self, month: int, year: int) \
             -> tuple[int, float, list[dict]]:
@@ -117,6 +145,7 @@ class Customer:
         as a Tuple containing the customer id, total cost for all phone lines,
         and a List of bill summaries generated for each phone line.
         """
+        start = time.perf_counter()
         bills = []
         total = 0
         for line in self._phone_lines:
@@ -124,6 +153,12 @@ class Customer:
             if line_bill is not None:
                 bills.append(line_bill)
                 total += line_bill['total']
+        if metrics.ENABLED:
+            metrics.REGISTRY.histogram('bill_seconds',
+                                       "Time to generate a customer's bill") \
+                .observe(time.perf_counter() - start)
+            metrics.REGISTRY.counter('bills_generated_total',
+                                     "Customer bills generated").inc()
         return self._id, total, bills
 
     def print_bill(self, month: int, year: int) -> None:
@@ -176,7 +211,8 @@ if __name__ == '__main__':
     import python_ta
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'phoneline', 'call', 'callhistory'
+            'python_ta', 'typing', 'time', 'phoneline', 'call',
+            'callhistory', 'metrics', 'numbertable'
         ],
         'allowed-io': ['print_bill'],
         'disable': ['R0902', 'R0913'],
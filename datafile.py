@@ -0,0 +1,130 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains open_dataset(), which opens a dataset file for reading as
+text whether it is plain or compressed with gzip, bz2 or xz (lzma), so that
+archived datasets are read without decompressing them to disk first.
+
+The compression is recognized by the first bytes of the file, or else by
+its extension. Compressed files are decompressed as they are read, through
+a READ_BUFFER_SIZE buffer, so that the parsers (json.load, or the JSON Lines
+readers of shards.py) ask the decompressor for large blocks at a time.
+
+Run this file on datasets to compare how fast they are read and parsed:
+
+    python datafile.py big.json big.json.gz big.jsonl.xz
+"""
+import bz2
+import gzip
+import io
+import lzma
+import os
+import time
+from typing import Optional, TextIO
+
+# Bytes read from a compressed file at a time, once decompressed
+READ_BUFFER_SIZE = 1 << 20
+
+# The first bytes of the files of each compression
+MAGIC = {'gzip': b'\x1f\x8b',
+         'bz2': b'BZh',
+         'xz': b'\xfd7zXZ\x00'}
+
+# The extensions of the files of each compression
+EXTENSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.lzma': 'xz'}
+
+# The function opening the files of each compression for reading
+_OPENERS = {'gzip': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+
+def compression(path: str) -> Optional[str]:
+    """ Return the compression of the file <path> ("gzip", "bz2" or "xz"),
+    or None if it is not compressed.
+    """
+    with open(path, 'rb') as f:
+        start = f.read(max(len(magic) for magic in MAGIC.values()))
+    for kind, magic in MAGIC.items():
+        if start.startswith(magic):
+            return kind
+    if start.lstrip()[:1] in (b'{', b'['):
+        # Plain JSON, whatever its extension
+        return None
+    return EXTENSIONS.get(os.path.splitext(path)[1])
+
+
+def strip_extension(path: str) -> str:
+    """ Return <path> without its compression extension, if it has one
+    (e.g. "events.jsonl" for "events.jsonl.gz").
+    """
+    root, extension = os.path.splitext(path)
+    return root if extension in EXTENSIONS else path
+
+
+def open_dataset(path: str) -> TextIO:
+    """ Open the dataset file <path> for reading as text, decompressing it
+    as it is read if it is compressed.
+    """
+    kind = compression(path)
+    if kind is None:
+        return open(path, encoding='utf-8')
+    stream = io.BufferedReader(_OPENERS[kind](path, 'rb'), READ_BUFFER_SIZE)
+    return io.TextIOWrapper(stream, encoding='utf-8')
+
+
+def measure(path: str) -> dict[str, float]:
+    """ Read and parse the events of the dataset file <path>, and return the
+    size of the file ("file_bytes"), the size of its text ("text_bytes"),
+    the number of events ("events"), and the time taken ("seconds").
+    """
+    # Imported here, as shards.py reads its files with open_dataset
+    from shards import read_events
+
+    start = time.perf_counter()
+    events = sum(1 for _ in read_events(path, ordered=False))
+    seconds = time.perf_counter() - start
+    text_bytes = 0
+    with open_dataset(path) as f:
+        block = f.read(READ_BUFFER_SIZE)
+        while block:
+            text_bytes += len(block.encode('utf-8'))
+            block = f.read(READ_BUFFER_SIZE)
+    return {'file_bytes': os.path.getsize(path), 'text_bytes': text_bytes,
+            'events': events, 'seconds': seconds}
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """ Print how fast the dataset files given on the command line <argv>
+    are read and parsed.
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Measure how fast dataset files are read and parsed")
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args(argv)
+
+    print('{:<30} {:>10} {:>10} {:>8} {:>12} {:>12}'.format(
+        'file', 'file MB', 'text MB', 'seconds', 'text MB/s', 'events/s'))
+    for path in args.files:
+        result = measure(path)
+        seconds = result['seconds'] or 1e-9
+        print('{:<30} {:>10.1f} {:>10.1f} {:>8.2f} {:>12.1f} {:>12.0f}'.format(
+            path, result['file_bytes'] / 1e6, result['text_bytes'] / 1e6,
+            result['seconds'], result['text_bytes'] / 1e6 / seconds,
+            result['events'] / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the decoders that turn the text of a dataset into the
+dictionary returned by application.import_data, and the EventColumns class
+in which the fast decoder keeps the events.
+
+There are three decoders:
+- "json" uses the json module of the standard library, and makes a
+  dictionary for each event.
+- "fast" reads the events of the fixed shape written by generator.py (type,
+  src_number, dst_number, time, duration for calls, src_loc and dst_loc)
+  with a single regular expression, and writes their fields straight into
+  the typed columns of an EventColumns, with their times already parsed.
+  process_event_history bills the columns without making a dictionary for
+  each event. The other values of the dataset (the customers) are read by
+  the json module. If an event does not have the fixed shape (e.g. its keys
+  are in another order, or a string has escapes), the whole dataset is read
+  by the json module instead, so the result is always the same.
+- "orjson" uses the orjson package, if it is installed.
+
+get_decoder() returns the decoder named by MEWBILE_DECODER, or else the
+fastest one available: "orjson" if it is installed, and "fast" otherwise.
+All of them give the same customers, calls, bills and messages once the
+dataset is processed.
+"""
+import datetime
+import json
+import os
+import re
+from array import array
+from typing import Any, Iterator, Optional, TextIO
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# The format of the times of the dataset
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# A time in TIME_FORMAT, with all of its digits, which
+# datetime.fromisoformat reads much faster than datetime.strptime
+_TIME = re.compile(r'\d{4}-\d\d-\d\d \d\d:\d\d:\d\d')
+
+# A JSON number, as written by the json module
+_NUMBER = r'-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?'
+
+# An event of the fixed shape, as written by generator.py
+_EVENT = re.compile(
+    r'\{"type": "(call|sms)", '
+    r'"src_number": "([^"\\]*)", "dst_number": "([^"\\]*)", '
+    r'"time": "(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)", '
+    r'(?:"duration": (\d+), )?'
+    r'"src_loc": \[(' + _NUMBER + r'), (' + _NUMBER + r')\], '
+    r'"dst_loc": \[(' + _NUMBER + r'), (' + _NUMBER + r')\]\}')
+
+# The types of events, so that the events share the strings of their types
+_EVENT_TYPES = {'call': 'call', 'sms': 'sms'}
+
+# Whitespace between JSON values
+_SPACE = re.compile(r'[ \t\n\r]*')
+
+
+def parse_time(text: str) -> datetime.datetime:
+    """ Return the time <text>, in TIME_FORMAT.
+
+    Raise ValueError if <text> is not a valid time in TIME_FORMAT.
+    """
+    if _TIME.fullmatch(text):
+        return datetime.datetime.fromisoformat(text)
+    # e.g. "2018-1-5 9:00:00", which strptime accepts too
+    return datetime.datetime.strptime(text, TIME_FORMAT)
+
+
+class EventColumns:
+    """ The call and SMS events of a dataset, kept by field rather than as a
+    dictionary per event, in the order of the dataset.
+
+    Iterating over the columns yields each event in the format of the
+    events of the input dataset, e.g. for a reorder.ReorderBuffer;
+    process_event_history bills the rows instead.
+    """
+    # === Private Attributes ===
+    # _types:
+    #     the type of each event, e.g. "call" or "sms"
+    # _src:
+    #     the source number of each event
+    # _dst:
+    #     the destination number of each event
+    # _times:
+    #     the time of each event
+    # _durations:
+    #     the duration of each call, in seconds, and 0 for each message
+    # _locations:
+    #     the source longitude and latitude, then the destination longitude
+    #     and latitude of each event, 4 entries per event
+    # _numbers:
+    #     each distinct number, so that the events share its string
+    _types: list[str]
+    _src: list[str]
+    _dst: list[str]
+    _times: list[datetime.datetime]
+    _durations: array
+    _locations: array
+    _numbers: dict[str, str]
+
+    def __init__(self) -> None:
+        """ Create empty columns.
+        """
+        self._types = []
+        self._src = []
+        self._dst = []
+        self._times = []
+        self._durations = array('q')
+        self._locations = array('d')
+        self._numbers = {}
+
+    def __len__(self) -> int:
+        """ Return the number of events in these columns.
+        """
+        return len(self._times)
+
+    def append(self, event_type: str, src_number: str, dst_number: str,
+               when: datetime.datetime, duration: int,
+               src_loc: tuple[float, float],
+               dst_loc: tuple[float, float]) -> None:
+        """ Add the event of type <event_type> (e.g. "call" or "sms") from
+        <src_number> at <src_loc> to <dst_number> at <dst_loc>, at the time
+        <when>, lasting <duration> seconds (0 for a message).
+        """
+        numbers = self._numbers
+        self._types.append(_EVENT_TYPES.get(event_type, event_type))
+        self._src.append(numbers.setdefault(src_number, src_number))
+        self._dst.append(numbers.setdefault(dst_number, dst_number))
+        self._times.append(when)
+        self._durations.append(duration)
+        self._locations.extend((src_loc[0], src_loc[1],
+                                dst_loc[0], dst_loc[1]))
+
+    def take(self, start: int, stop: int) -> 'EventColumns':
+        """ Return new columns with the events from position <start> up to
+        <stop>, excluded.
+        """
+        columns = EventColumns()
+        columns._types = self._types[start:stop]
+        columns._src = self._src[start:stop]
+        columns._dst = self._dst[start:stop]
+        columns._times = self._times[start:stop]
+        columns._durations = self._durations[start:stop]
+        columns._locations = self._locations[4 * start:4 * stop]
+        return columns
+
+    def select(self, positions: list[int]) -> 'EventColumns':
+        """ Return new columns with the events at <positions>, in that
+        order.
+        """
+        columns = EventColumns()
+        columns._types = [self._types[i] for i in positions]
+        columns._src = [self._src[i] for i in positions]
+        columns._dst = [self._dst[i] for i in positions]
+        columns._times = [self._times[i] for i in positions]
+        columns._durations = array('q', [self._durations[i]
+                                         for i in positions])
+        locations = self._locations
+        columns._locations = array('d', [locations[j] for i in positions
+                                         for j in range(4 * i, 4 * i + 4)])
+        return columns
+
+    def remove_first(self, count: int) -> None:
+        """ Remove the first <count> events, e.g. once they are processed.
+        """
+        del self._types[:count]
+        del self._src[:count]
+        del self._dst[:count]
+        del self._times[:count]
+        del self._durations[:count]
+        del self._locations[:4 * count]
+
+    def rows(self) -> Iterator[tuple]:
+        """ Yield the fields of each event, in the order of the arguments of
+        EventProcessor.process_fields: its type, source number, destination
+        number, time, duration, source location and destination location.
+        """
+        locations = self._locations
+        for i in range(len(self._times)):
+            j = 4 * i
+            yield (self._types[i], self._src[i], self._dst[i],
+                   self._times[i], self._durations[i],
+                   (locations[j], locations[j + 1]),
+                   (locations[j + 2], locations[j + 3]))
+
+    def __iter__(self) -> Iterator[dict]:
+        """ Yield each event, in the format of the events of the input
+        dataset.
+        """
+        for event_type, src, dst, when, duration, src_loc, dst_loc \
+                in self.rows():
+            event = {'type': event_type, 'src_number': src,
+                     'dst_number': dst, 'time': when.isoformat(' ')}
+            if event_type == 'call':
+                event['duration'] = duration
+            event['src_loc'] = list(src_loc)
+            event['dst_loc'] = list(dst_loc)
+            yield event
+
+
+class Decoder:
+    """ Reads the text of a dataset.
+
+    This is an abstract class. Only subclasses should be instantiated.
+
+    === Public Attributes ===
+    name:
+        the name of this decoder, for MEWBILE_DECODER
+    """
+    name: str
+
+    def load(self, f: TextIO) -> dict[str, Any]:
+        """ Return the dataset of the file <f>, in the format returned by
+        application.import_data.
+
+        Raise ValueError if <f> is not valid JSON.
+        """
+        return self.loads(f.read())
+
+    def loads(self, text: str) -> Any:
+        """ Return the JSON value <text>, e.g. a dataset or a line of a JSON
+        Lines file.
+
+        Raise ValueError if <text> is not valid JSON.
+        """
+        raise NotImplementedError
+
+
+class JSONDecoder(Decoder):
+    """ Reads datasets with the json module of the standard library.
+    """
+    name = 'json'
+
+    def load(self, f: TextIO) -> dict[str, Any]:
+        """ Return the dataset of the file <f>, in the format returned by
+        application.import_data.
+
+        Raise ValueError if <f> is not valid JSON.
+        """
+        return json.load(f)
+
+    def loads(self, text: str) -> Any:
+        """ Return the JSON value <text>.
+
+        Raise ValueError if <text> is not valid JSON.
+        """
+        return json.loads(text)
+
+
+class FastDecoder(Decoder):
+    """ Reads the events of datasets into EventColumns.
+    """
+    name = 'fast'
+
+    def loads(self, text: str) -> Any:
+        """ Return the JSON value <text>. If it is a dataset, its events are
+        an EventColumns.
+
+        A single event (e.g. a line of a JSON Lines file) is returned as a
+        dictionary, as json.loads already reads it quickly.
+
+        Raise ValueError if <text> is not valid JSON.
+        """
+        start = _SPACE.match(text).end()
+        # The events of JSON Lines files start with their type
+        if not text.startswith('{', start) or text.startswith(
+                '"type"', _SPACE.match(text, start + 1).end()):
+            return json.loads(text)
+        try:
+            return self._dataset(text, start)
+        except (ValueError, IndexError):
+            # Not of the fixed shape, or not valid: the json module reads
+            # it, or says what is wrong with it
+            return json.loads(text)
+
+    def _dataset(self, text: str, start: int) -> dict[str, Any]:
+        """ Return the JSON object of <text> starting at <start>, reading
+        its "events" into an EventColumns.
+
+        Raise ValueError or IndexError if <text> is not a JSON object, or if
+        an event is not of the fixed shape.
+        """
+        scanner = json.JSONDecoder()
+        dataset = {}
+        position = _SPACE.match(text, start + 1).end()
+        while text[position] != '}':
+            key, position = scanner.raw_decode(text, position)
+            position = _SPACE.match(text, position).end()
+            if text[position] != ':':
+                raise ValueError("expected ':'")
+            position = _SPACE.match(text, position + 1).end()
+            if key == 'events' and text[position] == '[':
+                value, position = _read_events(text, position)
+            else:
+                value, position = scanner.raw_decode(text, position)
+            dataset[key] = value
+            position = _SPACE.match(text, position).end()
+            if text[position] == ',':
+                position = _SPACE.match(text, position + 1).end()
+            elif text[position] != '}':
+                raise ValueError("expected ',' or '}'")
+        if text[position + 1:].strip():
+            raise ValueError("extra data")
+        return dataset
+
+
+class OrjsonDecoder(Decoder):
+    """ Reads datasets with the orjson package.
+    """
+    name = 'orjson'
+
+    def loads(self, text: str) -> Any:
+        """ Return the JSON value <text>.
+
+        Raise ValueError if <text> is not valid JSON.
+        """
+        return orjson.loads(text)
+
+
+# The decoders, by name
+DECODERS = {decoder.name: decoder
+            for decoder in (JSONDecoder, FastDecoder, OrjsonDecoder)}
+
+
+def available_decoders() -> list[str]:
+    """ Return the names of the decoders that can be used here.
+    """
+    return [name for name in DECODERS if name != 'orjson' or orjson]
+
+
+def get_decoder(name: Optional[str] = None) -> Decoder:
+    """ Return the decoder called <name>, or by default the one named by
+    MEWBILE_DECODER, or else the fastest decoder available.
+
+    Raise ValueError if there is no decoder called <name>, or if it is not
+    available.
+    """
+    name = name or os.environ.get('MEWBILE_DECODER') or \
+        ('orjson' if orjson else 'fast')
+    if name not in available_decoders():
+        raise ValueError("unknown or unavailable decoder: " + name +
+                         " (available: " + ", ".join(available_decoders()) +
+                         ")")
+    return DECODERS[name]()
+
+
+def _read_events(text: str, start: int) -> tuple[EventColumns, int]:
+    """ Return the events of the JSON array of <text> starting at <start>,
+    and the position after the array.
+
+    Raise ValueError or IndexError if an event is not of the fixed shape.
+    """
+    columns = EventColumns()
+    position = _SPACE.match(text, start + 1).end()
+    if text[position] == ']':
+        return columns, position + 1
+    match = _EVENT.match
+    space = _SPACE.match
+    while True:
+        event = match(text, position)
+        if event is None:
+            raise ValueError("event not of the fixed shape")
+        (event_type, src, dst, when, duration,
+         src_long, src_lat, dst_long, dst_lat) = event.groups()
+        if event_type == 'call' and duration is None:
+            raise ValueError("call without a duration")
+        columns.append(event_type, src, dst,
+                       datetime.datetime.fromisoformat(when),
+                       int(duration) if duration else 0,
+                       (float(src_long), float(src_lat)),
+                       (float(dst_long), float(dst_lat)))
+        position = space(text, event.end()).end()
+        if text[position] == ']':
+            return columns, position + 1
+        if text[position] != ',':
+            raise ValueError("expected ',' or ']'")
+        position = space(text, position + 1).end()
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'datetime', 'json', 'os', 're', 'array',
+            'orjson'
+        ],
+        'generated-members': 'pygame.*'
+    })
@@ -13,8 +13,16 @@ Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
 """
 import time
 import datetime
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Callable, Optional, Sequence
+import cancel
 from call import Call
 from customer import Customer
+from metrics import observe_filter
+from numbertable import NUMBERS
+from sms import SMSStore
+from tracing import traced
 
 
 class Filter:
@@ -42,12 +50,48 @@ class Filter:
         no effect or the <filter_string> is invalid then return the same calls
         from the <data> input.
 
+        Filters that scan <data> stop early if the active cancel token (see
+        cancel.py) tells them to, and return a cancel.PartialResult.
+
         Precondition:
         - <customers> contains the list of all customers from the input dataset
         - all calls included in <data> are valid calls from the input dataset
         """
         raise NotImplementedError
 
+    def matcher(self, customers: list[Customer], filter_string: str) \
+            -> Optional[Callable[[Call], bool]]:
+        """ Return a function telling whether a single call is kept when this
+        filter is applied with <filter_string>, or None if this filter can
+        only be applied to a list of calls.
+
+        This is used to test new calls against a filter that was already
+        applied, without applying it again to all of the calls.
+        """
+        return None
+
+    def scans_calls(self) -> bool:
+        """ Return whether this filter selects calls by looking at each call
+        of <data> in turn, so that it can be applied to a list one part at a
+        time (see jobs.py).
+
+        Filters answered by an index of the whole list, or by a database,
+        return False: they are applied to the whole list at once.
+        """
+        return True
+
+    def apply_sms(self, customers: list[Customer], messages: SMSStore,
+                  positions: Sequence[int], filter_string: str) \
+            -> Sequence[int]:
+        """ Return the positions from <positions> of the SMS messages of
+        <messages> which match the filter specified in <filter_string>, in
+        increasing order.
+
+        Filters that do not apply to messages, and invalid filter strings,
+        return <positions>.
+        """
+        return positions
+
     def __str__(self) -> str:
         """ Return a description of this filter to be displayed in the UI menu
         """
@@ -59,6 +103,8 @@ class ResetFilter(Filter):
     A class for resetting all previously applied filters, if any.
     """
 
+    @observe_filter
+    @traced
     def apply(self, customers: list[Customer],
               data: list[Call],
               filter_string: str) \
@@ -78,6 +124,11 @@ class ResetFilter(Filter):
             filtered_calls.extend(customer_history[0])
         return filtered_calls
 
+    def scans_calls(self) -> bool:
+        """ Return False: the calls are not looked at.
+        """
+        return False
+
     def __str__(self) -> str:
         """ Return a description of this filter to be displayed in the UI menu
         """
@@ -89,6 +140,8 @@ class CustomerFilter(Filter):
     A class for selecting only the calls from a given customer.
     """
 
+    @observe_filter
+    @traced
     def apply(self, customers: list[Customer],
               data: list[Call],
               filter_string: str) \
@@ -122,7 +175,12 @@ class CustomerFilter(Filter):
                     possible_calls.extend(customer_history[1])
 
             # Ensure call valid/expected outcomes
-            for call in possible_calls:
+            token = cancel.current()
+            for i, call in enumerate(possible_calls):
+                # each check scans <data>, so the token is checked every time
+                if token is not None and token.is_stopped():
+                    return cancel.partial(token, filtered_calls, data, i,
+                                          len(possible_calls))
                 if call in data and call not in filtered_calls:
                     filtered_calls.append(call)
 
@@ -132,6 +190,37 @@ class CustomerFilter(Filter):
         except ValueError:
             return data
 
+    def matcher(self, customers: list[Customer], filter_string: str) \
+            -> Optional[Callable[[Call], bool]]:
+        """ Return a function telling whether a call was made or received by
+        the customer in <filter_string>, or None if it is invalid.
+        """
+        try:
+            cust_id = int(filter_string)
+        except ValueError:
+            return None
+        for c in customers:
+            if c.get_id() == cust_id:
+                ids = {line.number_id for line in c.get_phone_lines()}
+                return lambda call: call.src_id in ids or call.dst_id in ids
+        return None
+
+    def apply_sms(self, customers: list[Customer], messages: SMSStore,
+                  positions: Sequence[int], filter_string: str) \
+            -> Sequence[int]:
+        """ Return the positions from <positions> of the messages sent or
+        received by the customer in <filter_string>.
+        """
+        try:
+            cust_id = int(filter_string)
+        except ValueError:
+            return positions
+        for c in customers:
+            if c.get_id() == cust_id:
+                return messages.select_numbers(c.get_phone_numbers(),
+                                               positions)
+        return positions
+
     def __str__(self) -> str:
         """ Return a description of this filter to be displayed in the UI menu
         """
@@ -144,6 +233,8 @@ class DurationFilter(Filter):
     specified duration.
     """
 
+    @observe_filter
+    @traced
     def apply(self, customers: list[Customer],
               data: list[Call],
               filter_string: str) \
@@ -162,23 +253,47 @@ class DurationFilter(Filter):
 
         Do not mutate any of the function arguments!
         """
+        condition = self._parse(filter_string)
+        if condition is None:
+            return data
+
+        # Filter Calls Appropriately
+        token = cancel.current()
+        filtered_calls = []
+        for i, d in enumerate(data):
+            if cancel.stopped(token, i):
+                return cancel.partial(token, filtered_calls, data, i)
+            if condition[0] == "L" and d.duration < condition[1]:
+                filtered_calls.append(d)
+            elif condition[0] == "G" and d.duration > condition[1]:
+                filtered_calls.append(d)
+        return filtered_calls
+
+    def matcher(self, customers: list[Customer], filter_string: str) \
+            -> Optional[Callable[[Call], bool]]:
+        """ Return a function telling whether a call has the duration in
+        <filter_string>, or None if it is invalid.
+        """
+        condition = self._parse(filter_string)
+        if condition is None:
+            return None
+        if condition[0] == "L":
+            return lambda call: call.duration < condition[1]
+        return lambda call: call.duration > condition[1]
+
+    def _parse(self, filter_string: str) -> Optional[tuple[str, int]]:
+        """ Return the comparison ("L" or "G") and the duration in seconds
+        specified by <filter_string>, or None if <filter_string> is invalid.
+        """
         try:
             # Input Quality Test
             call_dur = int(filter_string[1:4])
-            if filter_string[0] not in "LG" or len(filter_string) > 4 or \
-                    call_dur < 0:
-                return data
-
-            # Filter Calls Appropriately
-            filtered_calls = []
-            for d in data:
-                if filter_string[0] == "L" and d.duration < call_dur:
-                    filtered_calls.append(d)
-                elif filter_string[0] == "G" and d.duration > call_dur:
-                    filtered_calls.append(d)
-            return filtered_calls
         except ValueError:
-            return data
+            return None
+        if filter_string[0] not in "LG" or len(filter_string) > 4 or \
+                call_dur < 0:
+            return None
+        return filter_string[0], call_dur
 
     def __str__(self) -> str:
         """ Return a description of this filter to be displayed in the UI menu
@@ -192,6 +307,8 @@ class LocationFilter(Filter):
     A class for selecting only the calls that took place within a specific area
     """
 
+    @observe_filter
+    @traced
     def apply(self, customers: list[Customer],
               data: list[Call],
               filter_string: str) \
@@ -218,40 +335,80 @@ class LocationFilter(Filter):
 
         Do not mutate any of the function argumennts!
         """
+        coordinates = self._parse(filter_string)
+        if coordinates is None:
+            return data
+        return self._select(data, coordinates)
+
+    def _select(self, data: list[Call], coordinates: list[float]) \
+            -> list[Call]:
+        """ Return the calls from <data> whose source or destination is in the
+        rectangle given by the lowerLong, lowerLat, upperLong, upperLat
+        <coordinates>.
+        """
+        # Actual Filter Code
+        token = cancel.current()
+        filtered_calls = []
+        for i, d in enumerate(data):
+            if cancel.stopped(token, i):
+                return cancel.partial(token, filtered_calls, data, i)
+            # Check if src/dst inside coordinate area
+            src_long = coordinates[0] <= d.src_loc[0] <= coordinates[2]
+            src_lat = coordinates[1] <= d.src_loc[1] <= coordinates[3]
+            dst_long = coordinates[0] <= d.dst_loc[0] <= coordinates[2]
+            dst_lat = coordinates[1] <= d.dst_loc[1] <= coordinates[3]
+            if ((src_long and src_lat) or (dst_long and dst_lat)) and \
+                    d not in filtered_calls:
+                filtered_calls.append(d)
+        return filtered_calls
+
+    def matcher(self, customers: list[Customer], filter_string: str) \
+            -> Optional[Callable[[Call], bool]]:
+        """ Return a function telling whether a call took place in the area
+        in <filter_string>, or None if it is invalid.
+        """
+        coordinates = self._parse(filter_string)
+        if coordinates is None:
+            return None
+        return lambda call: bool(self._select([call], coordinates))
+
+    def apply_sms(self, customers: list[Customer], messages: SMSStore,
+                  positions: Sequence[int], filter_string: str) \
+            -> Sequence[int]:
+        """ Return the positions from <positions> of the messages sent or
+        received in the area in <filter_string>.
+        """
+        coordinates = self._parse(filter_string)
+        if coordinates is None:
+            return positions
+        return messages.select_location(coordinates, positions)
+
+    def _parse(self, filter_string: str) -> Optional[list[float]]:
+        """ Return the lowerLong, lowerLat, upperLong, upperLat coordinates
+        specified by <filter_string>, or None if <filter_string> is invalid.
+        """
         try:
             # Input Quality Check
             coordinates = filter_string.split(", ")
             if len(coordinates) != 4:
-                return data
+                return None
             # Coordinates inside map
             if not (-79.697878 <= float(coordinates[0]) <= -79.196382
                     and -79.697878 <= float(coordinates[2]) <= -79.196382):
-                return data
+                return None
             if not (43.576959 <= float(coordinates[1]) <= 43.799568
                     and 43.576959 <= float(coordinates[3]) <= 43.799568):
-                return data
+                return None
 
             coordinates = [float(coordinates[0]), float(coordinates[1]),
                            float(coordinates[2]), float(coordinates[3])]
-            # Upper Coordinates > Lower Coordinates
-            if not (coordinates[2] > coordinates[0]
-                    and coordinates[3] > coordinates[1]):
-                return data
-
-            # Actual Filter Code
-            filtered_calls = []
-            for d in data:
-                # Check if src/dst inside coordinate area
-                src_long = coordinates[0] <= d.src_loc[0] <= coordinates[2]
-                src_lat = coordinates[1] <= d.src_loc[1] <= coordinates[3]
-                dst_long = coordinates[0] <= d.dst_loc[0] <= coordinates[2]
-                dst_lat = coordinates[1] <= d.dst_loc[1] <= coordinates[3]
-                if ((src_long and src_lat) or (dst_long and dst_lat)) and \
-                        d not in filtered_calls:
-                    filtered_calls.append(d)
-            return filtered_calls
         except ValueError:
-            return data
+            return None
+        # Upper Coordinates > Lower Coordinates
+        if not (coordinates[2] > coordinates[0]
+                and coordinates[3] > coordinates[1]):
+            return None
+        return coordinates
 
     def __str__(self) -> str:
         """ Return a description of this filter to be displayed in the UI menu
@@ -261,12 +418,575 @@ class LocationFilter(Filter):
                "upperLong, upperLat\" (e.g., -79.6, 43.6, -79.3, 43.7)"
 
 
+class CallListIndex:
+    """ An index of a list of calls.
+
+    One index of each kind is kept for the tracked calls (see track), e.g.
+    StandingQuery.calls, which are only ever appended to: it is made the
+    first time it is needed, and extended with the calls appended since.
+    It answers the filters applied to any part of the tracked calls, whose
+    results are intersected with the calls being filtered. Other lists get
+    an index of their own each time.
+
+    This is an abstract class. Only subclasses should be instantiated.
+    """
+    # The tracked calls, the ids of the first <_known> of them, and the
+    # index of them made by each subclass, guarded by <_lock>
+    _tracked: Optional[list[Call]] = None
+    _tracked_ids: set[int] = set()
+    _known: int = 0
+    _indexes: dict[type, 'CallListIndex'] = {}
+    _lock = threading.Lock()
+    # === Private Attributes ===
+    # _size:
+    #     the number of calls of the indexed list in this index
+    _size: int
+
+    def __init__(self, calls: list[Call]) -> None:
+        """ Create an index of <calls>.
+        """
+        raise NotImplementedError
+
+    def extend(self, calls: list[Call]) -> None:
+        """ Add <calls>, which were appended to the indexed list, to this
+        index.
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def track(calls: list[Call]) -> None:
+        """ Keep the indexes for <calls> (e.g. all of the calls of the
+        dataset), instead of the calls tracked before. <calls> must only be
+        appended to from now on.
+        """
+        with CallListIndex._lock:
+            CallListIndex._tracked = calls
+            CallListIndex._tracked_ids = set()
+            CallListIndex._known = 0
+            CallListIndex._indexes = {}
+
+    @staticmethod
+    def refresh(calls: list[Call]) -> None:
+        """ Add the calls appended to <calls> to its indexes, if they are
+        the tracked calls.
+        """
+        with CallListIndex._lock:
+            if calls is CallListIndex._tracked:
+                for index in CallListIndex._indexes.values():
+                    index.extend(calls[index._size:])
+
+    @classmethod
+    def for_calls(cls, calls: list[Call]) \
+            -> tuple['CallListIndex', Optional[set[int]]]:
+        """ Return an index answering lookups on <calls>, and None if it is
+        an index of exactly <calls>, or the ids of <calls> to intersect its
+        results with if it is the index of the tracked calls, of which
+        <calls> are a part. The index of the tracked calls may hold calls
+        appended to them after <calls> was taken from them.
+
+        Raise cancel.Cancelled if the active token stops the job while the
+        index is made.
+        """
+        tracked = CallListIndex._tracked
+        if tracked is None:
+            return cls(calls), None
+        within = None
+        if calls is not tracked:
+            within = _part_of(calls, tracked)
+            if within is None:
+                return cls(calls), None
+        return cls._tracked_index(tracked, True), within
+
+    @classmethod
+    def existing(cls, calls: list[Call]) \
+            -> Optional[tuple['CallListIndex', Optional[set[int]]]]:
+        """ Return the index of the tracked calls and what to intersect its
+        results with, as for_calls, if it was made already and <calls> are
+        a part of the tracked calls. Otherwise, return None.
+        """
+        tracked = CallListIndex._tracked
+        if tracked is None or cls not in CallListIndex._indexes:
+            return None
+        within = None
+        if calls is not tracked:
+            within = _part_of(calls, tracked)
+            if within is None:
+                return None
+        index = cls._tracked_index(tracked, False)
+        return None if index is None else (index, within)
+
+    @classmethod
+    def _tracked_index(cls, tracked: list[Call], make: bool) \
+            -> Optional['CallListIndex']:
+        """ Return the index of the <tracked> calls, extended with the calls
+        appended to them, making it if there is none and <make> is True.
+        """
+        with CallListIndex._lock:
+            index = CallListIndex._indexes.get(cls)
+        if index is None:
+            if not make:
+                return None
+            # made without the lock, so that new calls are not held up
+            index = cls(tracked[:])
+        with CallListIndex._lock:
+            if tracked is not CallListIndex._tracked:
+                # other calls were tracked meanwhile
+                return index
+            index = CallListIndex._indexes.setdefault(cls, index)
+            index.extend(tracked[index._size:])
+        return index
+
+
+def _part_of(calls: list[Call], tracked: list[Call]) -> Optional[set[int]]:
+    """ Return the ids of <calls> if they are all among the <tracked> calls,
+    which are tracked by CallListIndex, otherwise None.
+    """
+    within = {id(call) for call in calls}
+    with CallListIndex._lock:
+        if tracked is not CallListIndex._tracked:
+            return None
+        CallListIndex._tracked_ids.update(
+            id(call) for call in tracked[CallListIndex._known:])
+        CallListIndex._known = len(tracked)
+        return within if within <= CallListIndex._tracked_ids else None
+
+
+class TimeIndex(CallListIndex):
+    """ The calls of a list sorted chronologically, partitioned by the
+    (month, year) keys used by CallHistory, so that the calls in a period
+    are found with a binary search in the partitions at its ends.
+
+    === Public Attributes ===
+    calls:
+        the indexed calls, in chronological order
+    """
+    calls: list[Call]
+    # === Private Attributes ===
+    # _times:
+    #     the time of each call of <calls>
+    # _months:
+    #     the first and one past the last position in <calls> of the calls of
+    #     each (month, year)
+    _times: list[datetime.datetime]
+    _months: dict[tuple[int, int], tuple[int, int]]
+
+    def __init__(self, calls: list[Call]) -> None:
+        """ Create an index of <calls>.
+
+        Raise cancel.Cancelled if the active token stops the job meanwhile.
+        """
+        token = cancel.current()
+        times = []
+        for i, call in enumerate(calls):
+            cancel.check(token, i)
+            times.append(call.time)
+        order = sorted(range(len(times)), key=times.__getitem__)
+        self.calls = [calls[i] for i in order]
+        self._times = [times[i] for i in order]
+        self._size = len(calls)
+        self._partition(token)
+
+    def extend(self, calls: list[Call]) -> None:
+        """ Add <calls>, which were appended to the indexed list, to this
+        index. Calls are usually appended in chronological order, and are
+        then added at the end; the others are inserted in order.
+        """
+        in_order = True
+        for call in calls:
+            if not self._times or call.time >= self._times[-1]:
+                self.calls.append(call)
+                self._times.append(call.time)
+                key = (call.time.month, call.time.year)
+                begin = self._months.get(key, (len(self.calls) - 1,))[0]
+                self._months[key] = (begin, len(self.calls))
+            else:
+                position = bisect_right(self._times, call.time)
+                self.calls.insert(position, call)
+                self._times.insert(position, call.time)
+                in_order = False
+        self._size += len(calls)
+        if not in_order:
+            self._partition(None)
+
+    def _partition(self, token: Optional[cancel.CancelToken]) -> None:
+        """ Find the first and one past the last position of the calls of
+        each (month, year) in <calls>, checking <token> meanwhile.
+        """
+        months = {}
+        for position, moment in enumerate(self._times):
+            cancel.check(token, position)
+            key = (moment.month, moment.year)
+            if key in months:
+                months[key] = (months[key][0], position + 1)
+            else:
+                months[key] = (position, position + 1)
+        self._months = months
+
+    def month(self, month: int, year: int) -> list[Call]:
+        """ Return the calls of <month> and <year>, in chronological order.
+        """
+        begin, end = self._months.get((month, year), (0, 0))
+        return self.calls[begin:end]
+
+    def position(self, moment: datetime.datetime) -> int:
+        """ Return the position in <calls> of the first call at or after
+        <moment>.
+        """
+        key = (moment.month, moment.year)
+        if key in self._months:
+            begin, end = self._months[key]
+            return bisect_left(self._times, moment, begin, end)
+        # No call that month: the answer is the boundary of a partition
+        return bisect_left(self._times, moment)
+
+    def between(self, start: datetime.datetime, end: datetime.datetime) \
+            -> list[Call]:
+        """ Return the calls from <start> (included) to <end> (excluded), in
+        chronological order.
+        """
+        if end <= start:
+            return []
+        return self.calls[self.position(start):self.position(end)]
+
+
+class TimeFilter(Filter):
+    """
+    A class for selecting only the calls made during a period of time.
+    """
+
+    @observe_filter
+    @traced
+    def apply(self, customers: list[Customer],
+              data: list[Call],
+              filter_string: str) \
+            -> list[Call]:
+        """ Return a list of all unique calls from <data> made during the
+        period specified by <filter_string>, in chronological order.
+
+        The <customers> list contains all customers from the input dataset.
+
+        The filter string is valid if and only if it is a month
+        ("YYYY-MM"), a day ("YYYY-MM-DD"), a minute ("YYYY-MM-DD HH:MM"),
+        a second ("YYYY-MM-DD HH:MM:SS"), or two of these separated by " to ",
+        meaning from the start of the first to the end of the second.
+        - If the filter string is invalid, return the original list <data>
+
+        Do not mutate any of the function arguments!
+        """
+        period = self._parse(filter_string)
+        if period is None:
+            return data
+        try:
+            index, within = TimeIndex.for_calls(data)
+        except cancel.Cancelled:
+            return cancel.partial(cancel.current(), [], data, 0)
+        start, end = period
+        if (start.day, start.hour, start.minute, start.second) == \
+                (1, 0, 0, 0) and end == _next_month(start):
+            calls = index.month(start.month, start.year)
+        else:
+            calls = index.between(start, end)
+        if within is None:
+            return calls
+        return [call for call in calls if id(call) in within]
+
+    def matcher(self, customers: list[Customer], filter_string: str) \
+            -> Optional[Callable[[Call], bool]]:
+        """ Return a function telling whether a call was made during the
+        period in <filter_string>, or None if it is invalid.
+        """
+        period = self._parse(filter_string)
+        if period is None:
+            return None
+        return lambda call: period[0] <= call.time < period[1]
+
+    def apply_sms(self, customers: list[Customer], messages: SMSStore,
+                  positions: Sequence[int], filter_string: str) \
+            -> Sequence[int]:
+        """ Return the positions from <positions> of the messages sent during
+        the period in <filter_string>.
+        """
+        period = self._parse(filter_string)
+        if period is None:
+            return positions
+        return messages.select_time(period[0], period[1], positions)
+
+    def _parse(self, filter_string: str) \
+            -> Optional[tuple[datetime.datetime, datetime.datetime]]:
+        """ Return the start (included) and the end (excluded) of the period
+        specified by <filter_string>, or None if <filter_string> is invalid.
+        """
+        bounds = filter_string.split(" to ")
+        if len(bounds) > 2:
+            return None
+        first = _parse_period(bounds[0])
+        last = _parse_period(bounds[-1])
+        if first is None or last is None or last[1] <= first[0]:
+            return None
+        return first[0], last[1]
+
+    def scans_calls(self) -> bool:
+        """ Return False: the calls are found with a TimeIndex
+        of the whole list.
+        """
+        return False
+
+    def __str__(self) -> str:
+        """ Return a description of this filter to be displayed in the UI menu
+        """
+        return "Filter calls made during a period: YYYY-MM, YYYY-MM-DD, " \
+               "YYYY-MM-DD HH:MM, or \"<start> to <end>\" " \
+               "(e.g., 2018-01-05 18:00 to 2018-01-05 23:59)"
+
+
+# The formats of the periods of a TimeFilter, with the length of each period
+_PERIODS = [("%Y-%m-%d %H:%M:%S", datetime.timedelta(seconds=1)),
+            ("%Y-%m-%d %H:%M", datetime.timedelta(minutes=1)),
+            ("%Y-%m-%d", datetime.timedelta(days=1)),
+            ("%Y-%m", None)]
+
+
+def _parse_period(text: str) \
+        -> Optional[tuple[datetime.datetime, datetime.datetime]]:
+    """ Return the start (included) and end (excluded) of the month, day,
+    minute or second written in <text>, or None if <text> is invalid.
+    """
+    for period_format, length in _PERIODS:
+        try:
+            start = datetime.datetime.strptime(text.strip(), period_format)
+        except ValueError:
+            continue
+        if length is None:
+            return start, _next_month(start)
+        return start, start + length
+    return None
+
+
+def _next_month(moment: datetime.datetime) -> datetime.datetime:
+    """ Return the first moment of the month after the one of <moment>.
+    """
+    if moment.month == 12:
+        return datetime.datetime(moment.year + 1, 1, 1)
+    return datetime.datetime(moment.year, moment.month + 1, 1)
+
+
+# Smallest number of numbers added to a NumberIndex that are merged with the
+# numbers indexed before
+MERGE_MIN = 4096
+
+
+class NumberIndex(CallListIndex):
+    """ The source and destination numbers of a list of calls, sorted so
+    that the calls to or from a number, or from numbers starting with a
+    prefix, are found with a binary search.
+
+    The numbers of the calls added later (see extend) are sorted apart from
+    the others, and merged with them once there are at least an eighth as
+    many (and at least MERGE_MIN), so that a few new calls do not sort all
+    of the numbers again.
+    """
+    # === Private Attributes ===
+    # _calls:
+    #     the indexed calls
+    # _levels:
+    #     the source and destination number of every call, sorted, with the
+    #     position in <_calls> of the call of each number: first for the
+    #     calls indexed when the numbers were last merged, then for the
+    #     calls added since, if any. The list is replaced, never changed,
+    #     so that lookups may run while calls are added.
+    _calls: list[Call]
+    _levels: list[tuple[list[str], list[int]]]
+
+    def __init__(self, calls: list[Call]) -> None:
+        """ Create an index of <calls>.
+
+        Raise cancel.Cancelled if the active token stops the job meanwhile.
+        """
+        self._calls = calls
+        self._size = len(calls)
+        token = cancel.current()
+        entries = []
+        for i, c in enumerate(calls):
+            cancel.check(token, i)
+            entries.append((c.src_number, i))
+            entries.append((c.dst_number, i))
+        entries.sort()
+        self._levels = [_split(entries)]
+
+    def extend(self, calls: list[Call]) -> None:
+        """ Add <calls>, which were appended to the indexed list, to this
+        index. The index must have been made with a list of its own (as
+        the index of the tracked calls is), which is extended with <calls>.
+        """
+        first = len(self._calls)
+        self._calls.extend(calls)
+        entries = []
+        for i, c in enumerate(calls, first):
+            entries.append((c.src_number, i))
+            entries.append((c.dst_number, i))
+        merged = self._levels[0]
+        for level in self._levels[1:]:
+            entries.extend(zip(level[0], level[1]))
+        if len(entries) >= max(MERGE_MIN, len(merged[0]) // 8):
+            entries.extend(zip(merged[0], merged[1]))
+            entries.sort()
+            self._levels = [_split(entries)]
+        else:
+            entries.sort()
+            self._levels = [merged, _split(entries)]
+        self._size += len(calls)
+
+    def count(self, number: str, prefix: bool = False) -> int:
+        """ Return the number of times <number> (or a number starting with
+        <number>, if <prefix> is True) is the source or destination of a call.
+        """
+        total = 0
+        for numbers, _ in self._levels:
+            begin, end = _number_range(numbers, number, prefix)
+            total += end - begin
+        return total
+
+    def lookup(self, number: str, prefix: bool = False) -> list[Call]:
+        """ Return the calls from or to <number> (or a number starting with
+        <number>, if <prefix> is True), in the order of the indexed list.
+        """
+        found = set()
+        for numbers, positions in self._levels:
+            begin, end = _number_range(numbers, number, prefix)
+            found.update(positions[begin:end])
+        return [self._calls[i] for i in sorted(found)]
+
+
+def _split(entries: list[tuple[str, int]]) -> tuple[list[str], list[int]]:
+    """ Return the numbers and the positions of the (number, position)
+    <entries>, as two lists.
+    """
+    return [entry[0] for entry in entries], [entry[1] for entry in entries]
+
+
+def _number_range(numbers: list[str], number: str, prefix: bool) \
+        -> tuple[int, int]:
+    """ Return the first and one past the last position in the sorted
+    <numbers> of <number>, or of the numbers starting with it if <prefix> is
+    True.
+    """
+    begin = bisect_left(numbers, number)
+    if not prefix:
+        return begin, bisect_right(numbers, number, begin)
+    if not number:
+        return 0, len(numbers)
+    following = number[:-1] + chr(ord(number[-1]) + 1)
+    return begin, bisect_left(numbers, following, begin)
+
+
+class NumberFilter(Filter):
+    """
+    A class for selecting only the calls to or from a phone number, or from
+    the numbers of an exchange.
+    """
+
+    @observe_filter
+    @traced
+    def apply(self, customers: list[Customer],
+              data: list[Call],
+              filter_string: str) \
+            -> list[Call]:
+        """ Return a list of all unique calls from <data> made or received
+        by the phone number in <filter_string>.
+
+        The <customers> list contains all customers from the input dataset.
+
+        The filter string is valid if and only if it is a phone number
+        ("xxx-xxxx"), or the start of one followed by "*" (e.g. "416-*"),
+        which selects the calls of all of the numbers starting with it.
+        - If the filter string is invalid, return the original list <data>
+
+        Do not mutate any of the function arguments!
+        """
+        number = self._parse(filter_string)
+        if number is None:
+            return data
+        try:
+            index, within = NumberIndex.for_calls(data)
+        except cancel.Cancelled:
+            return cancel.partial(cancel.current(), [], data, 0)
+        calls = index.lookup(number[0], number[1])
+        if within is None:
+            return calls
+        return [call for call in calls if id(call) in within]
+
+    def apply_sms(self, customers: list[Customer], messages: SMSStore,
+                  positions: Sequence[int], filter_string: str) \
+            -> Sequence[int]:
+        """ Return the positions from <positions> of the messages sent or
+        received by the number (or prefix) in <filter_string>.
+        """
+        number = self._parse(filter_string)
+        if number is None:
+            return positions
+        if number[1]:
+            return messages.select_numbers(NUMBERS.with_prefix(number[0]),
+                                           positions)
+        return messages.select_numbers([number[0]], positions)
+
+    def matcher(self, customers: list[Customer], filter_string: str) \
+            -> Optional[Callable[[Call], bool]]:
+        """ Return a function telling whether a call was made or received by
+        the number (or prefix) in <filter_string>, or None if it is invalid.
+        """
+        number = self._parse(filter_string)
+        if number is None:
+            return None
+        if number[1]:
+            return lambda call: call.src_number.startswith(number[0]) or \
+                call.dst_number.startswith(number[0])
+        return lambda call: number[0] in (call.src_number, call.dst_number)
+
+    def _parse(self, filter_string: str) -> Optional[tuple[str, bool]]:
+        """ Return the number or prefix in <filter_string> and whether it is
+        a prefix, or None if <filter_string> is invalid.
+        """
+        number = filter_string.strip()
+        prefix = number.endswith("*")
+        if prefix:
+            number = number[:-1]
+        if not number or any(c not in "0123456789-" for c in number):
+            return None
+        return number, prefix
+
+    def scans_calls(self) -> bool:
+        """ Return False: the calls are found with a NumberIndex
+        of the whole list.
+        """
+        return False
+
+    def __str__(self) -> str:
+        """ Return a description of this filter to be displayed in the UI menu
+        """
+        return "Filter calls made or received by a phone number " \
+               "(e.g., 416-5555), or by the numbers starting with a " \
+               "prefix (e.g., 416-*)"
+
+
+def select_sms(customers: list[Customer], messages: SMSStore,
+               chain: list[tuple[Filter, str]]) -> Sequence[int]:
+    """ Return the positions of the SMS messages of <messages> selected by
+    every filter of <chain>, a list of (filter, filter string) pairs.
+    """
+    positions = messages.positions()
+    for f, filter_string in chain:
+        positions = f.apply_sms(customers, messages, positions, filter_string)
+    return positions
+
+
 if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'time', 'datetime', 'call', 'customer'
+            'python_ta', 'typing', 'time', 'datetime', 'threading', 'bisect',
+            'cancel', 'call', 'customer', 'metrics', 'numbertable', 'sms',
+            'tracing'
         ],
         'max-nested-blocks': 4,
         'allowed-io': ['apply', '__str__'],
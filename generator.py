@@ -0,0 +1,307 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the DatasetGenerator class, which writes synthetic datasets
+in the same format as <dataset.json>, so that the application can be tried on
+much larger inputs than the one shipped with the assignment.
+
+Events are written as a stream, one at a time, in chronological order, with
+at least one event in every month, as required by process_event_history().
+Only the customers (and their phone numbers) are kept in memory.
+
+The same data can also be written in the JSON Lines format: one customer per
+line (with "type": "customer") first, followed by one event per line.
+"""
+import argparse
+import calendar
+import datetime
+import json
+import random
+import sys
+from typing import Iterator, Optional, TextIO, Union
+
+# Map lower-left and upper-right corners (long, lat), as used by the filters.
+MAP_LOWER = (-79.697878, 43.576959)
+MAP_UPPER = (-79.196382, 43.799568)
+
+# Contracts as they are named in the dataset.
+CONTRACT_TYPES = ('mtm', 'term', 'prepaid')
+
+
+class DatasetGenerator:
+    """ A seeded, deterministic generator of synthetic MewbileTech datasets.
+
+    === Public Attributes ===
+    seed:
+        seed for the random number generator; two generators with the same
+        settings and seed produce exactly the same output
+    num_customers:
+        number of customers to create
+    max_lines:
+        every customer owns between 1 and <max_lines> phone lines
+    contract_mix:
+        relative weight of each contract type ("mtm", "term", "prepaid")
+    sms_ratio:
+        fraction of the events that are SMS messages rather than calls
+    events_per_month:
+        number of events in each month of the dataset
+    months:
+        number of consecutive months covered by the dataset
+    start:
+        (month, year) of the first month of the dataset
+    duration_alpha:
+        shape of the Pareto distribution used for call durations; smaller
+        values give a heavier tail
+    min_duration:
+        scale (smallest typical value) of the call durations, in seconds
+    max_duration:
+        call durations are capped at this many seconds
+    num_hotspots:
+        number of busy areas inside the Toronto map
+    hotspot_weight:
+        fraction of the locations that are drawn around a hotspot, the rest
+        are uniformly distributed over the map
+    hotspot_spread:
+        standard deviation of the locations around a hotspot, in degrees
+
+    === Representation Invariants ===
+    - num_customers >= 1 and max_lines >= 1
+    - 0 <= sms_ratio <= 1 and 0 <= hotspot_weight <= 1
+    - events_per_month >= 1 and months >= 1
+    """
+    seed: int
+    num_customers: int
+    max_lines: int
+    contract_mix: dict[str, float]
+    sms_ratio: float
+    events_per_month: int
+    months: int
+    start: tuple[int, int]
+    duration_alpha: float
+    min_duration: int
+    max_duration: int
+    num_hotspots: int
+    hotspot_weight: float
+    hotspot_spread: float
+
+    def __init__(self, seed: int = 0, num_customers: int = 50,
+                 max_lines: int = 5,
+                 contract_mix: Optional[dict[str, float]] = None,
+                 sms_ratio: float = 0.5, events_per_month: int = 250,
+                 months: int = 8, start: tuple[int, int] = (1, 2018),
+                 duration_alpha: float = 1.5, min_duration: int = 30,
+                 max_duration: int = 3600, num_hotspots: int = 5,
+                 hotspot_weight: float = 0.7,
+                 hotspot_spread: float = 0.02) -> None:
+        """ Create a new generator with the given settings.
+        """
+        if num_customers < 1 or max_lines < 1 or events_per_month < 1 \
+                or months < 1:
+            raise ValueError("customers, lines, events and months must be "
+                             "positive")
+        if not 0 <= sms_ratio <= 1 or not 0 <= hotspot_weight <= 1:
+            raise ValueError("ratios must be between 0 and 1")
+        self.seed = seed
+        self.num_customers = num_customers
+        self.max_lines = max_lines
+        self.contract_mix = contract_mix if contract_mix is not None \
+            else {'mtm': 1, 'term': 1, 'prepaid': 1}
+        for contract in self.contract_mix:
+            if contract not in CONTRACT_TYPES:
+                raise ValueError("unknown contract type: " + contract)
+        self.sms_ratio = sms_ratio
+        self.events_per_month = events_per_month
+        self.months = months
+        self.start = start
+        self.duration_alpha = duration_alpha
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self.num_hotspots = num_hotspots
+        self.hotspot_weight = hotspot_weight
+        self.hotspot_spread = hotspot_spread
+
+    def generate_customers(self) -> list[dict]:
+        """ Return the customers of this dataset, in the same format as the
+        "customers" list of <dataset.json>.
+        """
+        rng = random.Random(self.seed)
+        contracts = list(self.contract_mix)
+        weights = [self.contract_mix[c] for c in contracts]
+        # Customer ids are 4 digits in the assignment, but we need more room
+        # for very large datasets.
+        id_space = max(9000, self.num_customers * 10)
+        ids = rng.sample(range(1000, 1000 + id_space), self.num_customers)
+
+        numbers = set()
+        customers = []
+        for cid in ids:
+            lines = []
+            for _ in range(rng.randint(1, self.max_lines)):
+                number = _random_number(rng)
+                while number in numbers:
+                    number = _random_number(rng)
+                numbers.add(number)
+                lines.append({'number': number,
+                              'contract': rng.choices(contracts, weights)[0]})
+            customers.append({'lines': lines, 'id': cid})
+        return customers
+
+    def generate_events(self, customers: list[dict]) -> Iterator[dict]:
+        """ Yield the events of this dataset in chronological order, in the
+        same format as the "events" list of <dataset.json>.
+
+        <customers> is the list returned by generate_customers().
+        """
+        # A separate stream, so the customers do not depend on the events.
+        rng = random.Random(self.seed + 1)
+        numbers = [line['number'] for cust in customers
+                   for line in cust['lines']]
+        if len(numbers) < 2:
+            raise ValueError("at least two phone lines are needed")
+        hotspots = [(rng.uniform(MAP_LOWER[0], MAP_UPPER[0]),
+                     rng.uniform(MAP_LOWER[1], MAP_UPPER[1]))
+                    for _ in range(self.num_hotspots)]
+
+        month, year = self.start
+        for _ in range(self.months):
+            first = datetime.datetime(year, month, 1)
+            seconds = calendar.monthrange(year, month)[1] * 24 * 60 * 60
+            for offset in _sorted_uniforms(rng, self.events_per_month):
+                time = first + datetime.timedelta(
+                    seconds=min(int(offset * seconds), seconds - 1))
+                yield self._make_event(rng, numbers, hotspots, time)
+            month += 1
+            if month > 12:
+                month, year = 1, year + 1
+
+    def write(self, out: TextIO, json_lines: bool = False) -> None:
+        """ Write this dataset to <out>, either in the format of
+        <dataset.json> or as JSON Lines if <json_lines> is True.
+        """
+        customers = self.generate_customers()
+        if json_lines:
+            for cust in customers:
+                out.write(json.dumps({'type': 'customer', 'id': cust['id'],
+                                      'lines': cust['lines']}) + '\n')
+            for event in self.generate_events(customers):
+                out.write(json.dumps(event) + '\n')
+            return
+
+        out.write('{"events": [')
+        separator = ''
+        for event in self.generate_events(customers):
+            out.write(separator + json.dumps(event))
+            separator = ', '
+        out.write('], "customers": ' + json.dumps(customers) + '}')
+
+    def _make_event(self, rng: random.Random, numbers: list[str],
+                    hotspots: list[tuple[float, float]],
+                    time: datetime.datetime) -> dict[str, Union[str, int]]:
+        """ Return a single random event that happened at <time>.
+        """
+        src, dst = rng.sample(numbers, 2)
+        event = {'type': 'sms' if rng.random() < self.sms_ratio else 'call',
+                 'src_number': src,
+                 'dst_number': dst,
+                 'time': time.strftime("%Y-%m-%d %H:%M:%S")}
+        if event['type'] == 'call':
+            duration = self.min_duration * rng.paretovariate(
+                self.duration_alpha)
+            event['duration'] = min(int(duration), self.max_duration)
+        event['src_loc'] = self._make_location(rng, hotspots)
+        event['dst_loc'] = self._make_location(rng, hotspots)
+        return event
+
+    def _make_location(self, rng: random.Random,
+                       hotspots: list[tuple[float, float]]) -> list[float]:
+        """ Return a random [longitude, latitude] pair inside the map.
+        """
+        if hotspots and rng.random() < self.hotspot_weight:
+            centre = rng.choice(hotspots)
+            long = rng.gauss(centre[0], self.hotspot_spread)
+            lat = rng.gauss(centre[1], self.hotspot_spread)
+            return [min(max(long, MAP_LOWER[0]), MAP_UPPER[0]),
+                    min(max(lat, MAP_LOWER[1]), MAP_UPPER[1])]
+        return [rng.uniform(MAP_LOWER[0], MAP_UPPER[0]),
+                rng.uniform(MAP_LOWER[1], MAP_UPPER[1])]
+
+
+def _random_number(rng: random.Random) -> str:
+    """ Return a random phone number in the "xxx-xxxx" format.
+    """
+    return f'{rng.randint(100, 999)}-{rng.randint(0, 9999):04d}'
+
+
+def _sorted_uniforms(rng: random.Random, n: int) -> Iterator[float]:
+    """ Yield <n> uniformly distributed values in [0, 1), in increasing order,
+    without keeping them all in memory.
+
+    The smallest of k uniform values in [t, 1) is t + (1 - t)(1 - U^(1/k)),
+    and the remaining k - 1 values are uniform in the rest of the interval.
+    """
+    t = 0.0
+    for k in range(n, 0, -1):
+        t += (1 - t) * (1 - rng.random() ** (1 / k))
+        yield t
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """ Write a synthetic dataset according to the command line <argv>.
+    """
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic MewbileTech dataset")
+    parser.add_argument('-o', '--output', default='-',
+                        help="output file, '-' for standard output")
+    parser.add_argument('--jsonl', action='store_true',
+                        help="write JSON Lines instead of a single document")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--customers', type=int, default=50)
+    parser.add_argument('--max-lines', type=int, default=5)
+    parser.add_argument('--contract-mix', default='1,1,1',
+                        help="weights for mtm,term,prepaid (e.g. 2,1,1)")
+    parser.add_argument('--sms-ratio', type=float, default=0.5)
+    parser.add_argument('--events-per-month', type=int, default=250)
+    parser.add_argument('--months', type=int, default=8)
+    parser.add_argument('--start', default='1,2018', help="month,year")
+    parser.add_argument('--duration-alpha', type=float, default=1.5)
+    parser.add_argument('--min-duration', type=int, default=30)
+    parser.add_argument('--max-duration', type=int, default=3600)
+    parser.add_argument('--hotspots', type=int, default=5)
+    parser.add_argument('--hotspot-weight', type=float, default=0.7)
+    parser.add_argument('--hotspot-spread', type=float, default=0.02)
+    args = parser.parse_args(argv)
+
+    weights = [float(w) for w in args.contract_mix.split(',')]
+    start = tuple(int(s) for s in args.start.split(','))
+    generator = DatasetGenerator(
+        seed=args.seed, num_customers=args.customers,
+        max_lines=args.max_lines,
+        contract_mix=dict(zip(CONTRACT_TYPES, weights)),
+        sms_ratio=args.sms_ratio, events_per_month=args.events_per_month,
+        months=args.months, start=(start[0], start[1]),
+        duration_alpha=args.duration_alpha, min_duration=args.min_duration,
+        max_duration=args.max_duration, num_hotspots=args.hotspots,
+        hotspot_weight=args.hotspot_weight,
+        hotspot_spread=args.hotspot_spread)
+
+    if args.output == '-':
+        generator.write(sys.stdout, args.jsonl)
+    else:
+        with open(args.output, 'w') as out:
+            generator.write(out, args.jsonl)
+
+
+if __name__ == '__main__':
+    main()
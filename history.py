@@ -0,0 +1,382 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the FilterHistory class, which keeps the filters applied
+since the last reset with their results, so that filters can be undone,
+redone and edited without applying the filters before them again.
+
+Every result is identified by a number: 0 is all of the calls, and the
+result of a step gets a new number when it is computed. Results are cached
+by (filter type, filter string, number of the input), so applying the same
+filter to the same calls again is a lookup. The cache holds at most
+<max_cached> calls; the least recently used results are evicted first, and
+are computed again from the nearest earlier result when they are needed.
+
+The results are applied through a StandingQuery, which brings them up to
+date with the calls that arrived since they were computed.
+"""
+from collections import OrderedDict
+from typing import Optional
+
+import cancel
+from call import Call
+from filter import Filter, ResetFilter
+from standing import StandingQuery
+
+# Default number of calls kept in cached results, over all results
+DEFAULT_MAX_CACHED = 5000000
+
+
+class _Result:
+    """ A cached result of a filter.
+
+    === Public Attributes ===
+    key:
+        the key of this result in the cache
+    number:
+        the number identifying this result
+    calls:
+        the calls selected by the filter
+    seen:
+        the number of calls of StandingQuery.calls <calls> is up to date
+        with
+    size:
+        the number of calls counted against the size of the cache
+    """
+    key: tuple[type, str, int]
+    number: int
+    calls: list[Call]
+    seen: int
+    size: int
+
+    def __init__(self, key: tuple[type, str, int], number: int,
+                 calls: list[Call], seen: int) -> None:
+        """ Create the result <number>, cached under <key>, selecting
+        <calls> from the first <seen> calls.
+        """
+        self.key = key
+        self.number = number
+        self.calls = calls
+        self.seen = seen
+        self.size = len(calls)
+
+
+class FilterHistory:
+    """ The filters applied since the last reset, with cached results, for
+    undo and redo.
+
+    === Public Attributes ===
+    standing:
+        applies the results, and keeps them up to date with new calls
+    max_cached:
+        the largest number of calls kept in cached results
+    """
+    standing: StandingQuery
+    max_cached: int
+    # === Private Attributes ===
+    # _steps:
+    #     each filter applied since the last reset, with its filter string and
+    #     the number of its result. The steps after the first <_position> were
+    #     undone, and can be redone.
+    # _position:
+    #     the number of steps applied
+    # _cache:
+    #     the cached results by (filter type, filter string, number of the
+    #     input), least recently used first
+    # _cached:
+    #     the sum of the sizes of the cached results
+    # _numbers:
+    #     the number of results created so far
+    _steps: list[tuple[Filter, str, int]]
+    _position: int
+    _cache: OrderedDict[tuple[type, str, int], _Result]
+    _cached: int
+    _numbers: int
+
+    def __init__(self, standing: StandingQuery,
+                 max_cached: int = DEFAULT_MAX_CACHED) -> None:
+        """ Create an empty history of the filters applied to <standing>,
+        caching at most <max_cached> calls.
+        """
+        self.standing = standing
+        self.max_cached = max_cached
+        self._steps = []
+        self._position = 0
+        self._cache = OrderedDict()
+        self._cached = 0
+        self._numbers = 0
+
+    def steps(self) -> list[tuple[Filter, str]]:
+        """ Return the filters applied, with their filter strings, in the
+        order they were applied.
+        """
+        return [(f, s) for f, s, _ in self._steps[:self._position]]
+
+    def can_undo(self) -> bool:
+        """ Return whether there is a filter to undo.
+        """
+        return self._position > 0
+
+    def can_redo(self) -> bool:
+        """ Return whether there is an undone filter to redo.
+        """
+        return self._position < len(self._steps)
+
+    def push(self, f: Filter, filter_string: str, calls: list[Call],
+             data: Optional[list[Call]] = None,
+             seen: Optional[int] = None) -> list[Call]:
+        """ Record that <f> was applied with <filter_string> to the results,
+        selecting <calls>, and return the new results. <data> and <seen> are
+        as in StandingQuery.register.
+
+        The filters undone before are forgotten. A ResetFilter forgets all
+        of the history.
+        """
+        if isinstance(f, ResetFilter):
+            self.standing.register(f, filter_string, calls)
+            self._steps = []
+            self._position = 0
+            self._cache.clear()
+            self._cached = 0
+            return self.standing.results
+        previous = self._current()
+        now = self.standing.register(f, filter_string, calls, data, seen)
+        result = self._store(f, filter_string, self._number(), calls, now)
+        self._append(f, filter_string, result, previous, now)
+        return self.standing.results
+
+    def lookup(self, f: Filter, filter_string: str) -> Optional[list[Call]]:
+        """ If <f> was applied with <filter_string> to the current results
+        before, apply its cached result and return the new results.
+        Otherwise, return None.
+        """
+        result = self._cache.get((type(f), filter_string, self._number()))
+        if result is None or not cancel.is_complete(result.calls):
+            return None
+        self._cache.move_to_end(result.key)
+        previous = self._current()
+        chain = self.steps() + [(f, filter_string)]
+        now = self.standing.restore(chain, result.calls, result.seen)
+        self._append(f, filter_string, result, previous, now)
+        return self.standing.results
+
+    def undo(self) -> Optional[list[Call]]:
+        """ Undo the last filter applied, and return the new results, or None
+        if there is no filter to undo.
+        """
+        if not self.can_undo():
+            return None
+        return self._move(self._position - 1, self._current())
+
+    def redo(self) -> Optional[list[Call]]:
+        """ Apply the last filter undone again, and return the new results,
+        or None if there is no filter to redo.
+        """
+        if not self.can_redo():
+            return None
+        return self._move(self._position + 1, self._current())
+
+    def input(self, index: int) -> tuple[list[Call], int]:
+        """ Return the calls the filter of step <index> (0 for the first
+        filter applied) is applied to, with the number of calls of
+        StandingQuery.calls they are up to date with. The calls must not be
+        changed.
+        """
+        return self._result(index)
+
+    def edit(self, index: int, filter_string: str,
+             calls: Optional[list[Call]] = None,
+             seen: int = 0) -> list[Call]:
+        """ Change the filter string of step <index> to <filter_string>, and
+        return the new results. The steps before it are not applied again.
+
+        If the filter of that step was already applied with <filter_string>
+        to the calls of input(index) (e.g. in the background), <calls> is
+        its result and <seen> the number returned by input(index).
+        Otherwise, it is applied now. The steps after it are applied again
+        to the new result when their result is needed.
+        """
+        f = self._steps[index][0]
+        if calls is None:
+            data, seen = self.input(index)
+            calls = f.apply(self.standing.customers, data, filter_string)
+        previous = self._current()
+        if index < self._position - 1:
+            # The current results were computed from the old step
+            previous = None
+        for i in range(index + 1, len(self._steps)):
+            later, later_string, _ = self._steps[i]
+            self._forget(self._cache.get((type(later), later_string,
+                                          self._number(i))))
+        result = self._store(f, filter_string, self._number(index), calls,
+                             seen)
+        self._steps[index] = (f, filter_string, result.number)
+        for i in range(index + 1, len(self._steps)):
+            later, later_string, _ = self._steps[i]
+            self._steps[i] = (later, later_string, self._new_number())
+        return self._move(self._position, previous)
+
+    def _move(self, position: int, previous: Optional[_Result]) \
+            -> list[Call]:
+        """ Apply the result of the first <position> steps instead of
+        <previous>, the result of the steps applied so far, and return the
+        new results.
+        """
+        if position == 0:
+            result = None
+            calls, seen = self.standing.calls, 0
+        else:
+            result = self._step_result(position)
+            calls, seen = result.calls, result.seen
+        chain = [(f, s) for f, s, _ in self._steps[:position]]
+        now = self.standing.restore(chain, calls, seen)
+        self._position = position
+        self._leave(previous, now)
+        if result is not None:
+            self._touch(result, now)
+        self._evict()
+        return self.standing.results
+
+    def _append(self, f: Filter, filter_string: str, result: _Result,
+                previous: Optional[_Result], now: int) -> None:
+        """ Add a step after the steps applied, applying <f> with
+        <filter_string> and selecting <result>, which replaced <previous>
+        as the results when there were <now> calls.
+        """
+        del self._steps[self._position:]
+        self._steps.append((f, filter_string, result.number))
+        self._position += 1
+        self._leave(previous, now)
+        self._touch(result, now)
+        self._evict()
+
+    def _result(self, position: int) -> tuple[list[Call], int]:
+        """ Return the result of the first <position> steps, with the number
+        of calls of StandingQuery.calls it is up to date with. The result
+        must not be changed.
+        """
+        if position == 0:
+            return self.standing.snapshot(all_calls=True)
+        if position == self._position:
+            return self.standing.snapshot()
+        result = self._step_result(position)
+        return result.calls, result.seen
+
+    def _step_result(self, position: int) -> _Result:
+        """ Return the cached result of the first <position> steps, applying
+        the filter of the last of these steps to the result of the others
+        if it is not cached.
+        """
+        f, filter_string, number = self._steps[position - 1]
+        result = self._cache.get((type(f), filter_string,
+                                  self._number(position - 1)))
+        if result is not None and result.number == number:
+            self._cache.move_to_end(result.key)
+            return result
+        data, seen = self._result(position - 1)
+        calls = f.apply(self.standing.customers, data, filter_string)
+        return self._store(f, filter_string, self._number(position - 1),
+                           calls, seen, number)
+
+    def _store(self, f: Filter, filter_string: str, source: int,
+               calls: list[Call], seen: int,
+               number: Optional[int] = None) -> _Result:
+        """ Cache <calls>, selected by <f> with <filter_string> from the
+        result <source> and up to date with the first <seen> calls, as the
+        result <number> (a new number by default), and return it.
+        """
+        key = (type(f), filter_string, source)
+        self._forget(self._cache.get(key))
+        result = _Result(key, self._new_number() if number is None
+                         else number, calls, seen)
+        self._cache[key] = result
+        self._cached += result.size
+        return result
+
+    def _touch(self, result: _Result, seen: int) -> None:
+        """ Record that the calls of <result> are up to date with the first
+        <seen> calls, as new calls may have been added to them.
+        """
+        result.seen = seen
+        if self._cache.get(result.key) is result:
+            self._cached += len(result.calls) - result.size
+        result.size = len(result.calls)
+
+    def _leave(self, result: Optional[_Result], seen: int) -> None:
+        """ Record that <result> is no longer the current results, and was up
+        to date with the first <seen> calls when it was replaced. A partial
+        result is forgotten, to be computed in full if it is needed again.
+        """
+        if result is None:
+            return
+        if cancel.is_complete(result.calls):
+            self._touch(result, seen)
+        else:
+            self._forget(result)
+
+    def _forget(self, result: Optional[_Result]) -> None:
+        """ Remove <result> from the cache, if it is there.
+        """
+        if result is not None and self._cache.get(result.key) is result:
+            del self._cache[result.key]
+            self._cached -= result.size
+
+    def _evict(self) -> None:
+        """ Remove the least recently used results, except the current one,
+        until the cache holds at most <max_cached> calls.
+        """
+        current = self._current()
+        for key in list(self._cache):
+            if self._cached <= self.max_cached:
+                return
+            if self._cache[key] is not current:
+                self._forget(self._cache[key])
+
+    def _current(self) -> Optional[_Result]:
+        """ Return the cached result of the steps applied, or None if there
+        are no steps applied or it was evicted.
+        """
+        if self._position == 0:
+            return None
+        f, filter_string, number = self._steps[self._position - 1]
+        result = self._cache.get((type(f), filter_string,
+                                  self._number(self._position - 1)))
+        return result if result is not None and result.number == number \
+            else None
+
+    def _number(self, position: Optional[int] = None) -> int:
+        """ Return the number of the result of the first <position> steps
+        (by default, of the steps applied).
+        """
+        if position is None:
+            position = self._position
+        return 0 if position == 0 else self._steps[position - 1][2]
+
+    def _new_number(self) -> int:
+        """ Return a number for a new result.
+        """
+        self._numbers += 1
+        return self._numbers
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'collections', 'cancel', 'call', 'filter',
+            'standing'
+        ],
+        'generated-members': 'pygame.*'
+    })
@@ -0,0 +1,222 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the FilterJob class, which applies a filter in a
+background thread so that the visualization keeps running meanwhile.
+
+The calls are filtered in chunks of CHUNK_SIZE calls, which tells how far
+the job has got. Filters answered by an index of the whole list, or by a
+database, are applied to the whole list at once instead, so that the index
+of all of the calls (see CallListIndex) answers it, and a query of the
+database is run only once.
+
+The job's cancel token is active while the filter runs, so cancelling the
+job stops the filter in the middle of a chunk, or of the whole list (see
+cancel.py). The result is only made available once the job is done.
+
+If the job is given a lock, e.g. the lock of a LiveTail billing new events,
+it holds it only while a reset reads all of the calls from the call
+histories, so that no batch is half billed meanwhile. Other filters run on
+a copy of the calls made when the job starts, without the lock, so that
+neither the billing of new events nor the visualization waits for them.
+"""
+import threading
+from contextlib import nullcontext
+from typing import Optional
+
+import cancel
+import tracing
+from call import Call
+from customer import Customer
+from filter import Filter, ResetFilter
+
+# Number of calls filtered at a time, between progress updates
+CHUNK_SIZE = 20000
+
+
+class FilterJob:
+    """ A filter being applied to a list of calls in the background.
+
+    === Public Attributes ===
+    f:
+        the filter being applied
+    filter_string:
+        the filter string given to <f>
+    data:
+        the calls being filtered
+    seen:
+        the number of calls of <data> that are filtered; calls appended to
+        <data> later are not
+    result:
+        the calls selected by the filter once the job is done, or None if it
+        is not done or was cancelled. If the budget of the job ran out, this
+        is a cancel.PartialResult.
+    token:
+        stops the filter when the job is cancelled or its budget runs out
+    """
+    f: Filter
+    filter_string: str
+    data: list[Call]
+    seen: int
+    result: Optional[list[Call]]
+    token: cancel.CancelToken
+    # === Private Attributes ===
+    # _customers:
+    #     all customers of the dataset
+    # _done:
+    #     the number of calls filtered so far
+    # _finished:
+    #     set when the job is done or has stopped after being cancelled
+    # _lock:
+    #     held while a reset reads the call histories, or None
+    _customers: list[Customer]
+    _done: int
+    _finished: threading.Event
+    _lock: Optional[threading.RLock]
+
+    def __init__(self, f: Filter, customers: list[Customer],
+                 data: list[Call], filter_string: str,
+                 budget: Optional[float] = None,
+                 lock: Optional[threading.RLock] = None) -> None:
+        """ Create a job applying <f> with <filter_string> to <data>, which
+        may run for <budget> seconds (no limit if None). If <lock> is given,
+        a reset holds it while it reads the call histories.
+        """
+        self.f = f
+        self.filter_string = filter_string
+        self.data = data
+        self.seen = len(data)
+        self.result = None
+        self._customers = customers
+        self._done = 0
+        self.token = cancel.CancelToken(budget)
+        self._finished = threading.Event()
+        self._lock = lock
+
+    def start(self) -> None:
+        """ Start applying the filter in a background thread.
+        """
+        threading.Thread(target=self._run, daemon=True,
+                         name='filter-job').start()
+
+    def cancel(self) -> None:
+        """ Stop the job as soon as possible. It will not have a result.
+        """
+        self.token.cancel()
+
+    def is_cancelled(self) -> bool:
+        """ Return whether the job was cancelled.
+        """
+        return self.token.reason() == 'cancelled'
+
+    def is_finished(self) -> bool:
+        """ Return whether the job is done, or has stopped after being
+        cancelled.
+        """
+        return self._finished.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """ Wait until the job is finished, for at most <timeout> seconds if
+        it is given, and return whether it is finished.
+        """
+        return self._finished.wait(timeout)
+
+    def progress(self) -> float:
+        """ Return the fraction of the calls filtered so far.
+        """
+        if self.seen == 0:
+            return 1.0 if self.is_finished() else 0.0
+        return min(1.0, self._done / self.seen)
+
+    def _run(self) -> None:
+        """ Apply the filter one chunk at a time, unless cancelled.
+        """
+        try:
+            with tracing.span('filter job', filter=type(self.f).__name__,
+                              calls=self.seen), cancel.activate(self.token):
+                result = self._apply()
+            self.result = None if self.is_cancelled() else result
+        finally:
+            self._finished.set()
+
+    def _apply(self) -> Optional[list[Call]]:
+        """ Return the calls selected by the filter, or a PartialResult if
+        the filter was stopped.
+        """
+        if not self.f.scans_calls() or self.seen <= CHUNK_SIZE:
+            # Indexed filters are applied to the whole list, which the
+            # index of all of the calls answers at once; a reset does not
+            # look at the calls, and small lists are quick
+            if isinstance(self.f, ResetFilter):
+                # all of the calls billed so far, whether or not they are in
+                # <data> yet
+                with self._lock if self._lock is not None else nullcontext():
+                    result = self.f.apply(self._customers, self.data,
+                                          self.filter_string)
+                self._done = self.seen
+                return result
+            if len(self.data) == self.seen:
+                result = self.f.apply(self._customers, self.data,
+                                      self.filter_string)
+            else:
+                result = self.f.apply(self._customers,
+                                      self.data[:self.seen],
+                                      self.filter_string)
+            self._done = self.seen
+            return self._drop_later_calls(result)
+        # Calls may be appended to <data> meanwhile (see StandingQuery)
+        data = self.data[:self.seen]
+        result = []
+        for start in range(0, self.seen, CHUNK_SIZE):
+            if self.token.is_stopped():
+                return cancel.partial(self.token, result, data, start)
+            chunk = data[start:start + CHUNK_SIZE]
+            with tracing.span('filter chunk', calls=len(chunk)):
+                selected = self.f.apply(self._customers, chunk,
+                                        self.filter_string)
+            if not cancel.is_complete(selected):
+                return cancel.partial(self.token, result + selected, data,
+                                      start + selected.scanned)
+            result.extend(selected)
+            self._done = start + len(chunk)
+        return result
+
+    def _drop_later_calls(self, result: list[Call]) -> list[Call]:
+        """ Return <result> without the calls appended to <data> after its
+        first <seen> calls while the filter ran, which an indexed filter
+        applied to the whole of <data> may have selected.
+        """
+        if len(self.data) == self.seen:
+            return result
+        later = {id(call) for call in self.data[self.seen:]}
+        kept = [call for call in result if id(call) not in later]
+        if len(kept) == len(result):
+            return result
+        if cancel.is_complete(result):
+            return kept
+        return cancel.PartialResult(kept, result.reason, result.scanned,
+                                    result.total)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'threading', 'contextlib', 'cancel',
+            'tracing', 'call', 'customer', 'filter'
+        ],
+        'disable': ['R0902'],
+        'generated-members': 'pygame.*'
+    })
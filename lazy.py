@@ -0,0 +1,68 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the LazyModule class, which stands in for a module that is
+only imported the first time one of its attributes is used.
+
+The GUI libraries (pygame and tkinter) are slow to import and initialize, so
+the modules that draw things refer to them through a LazyModule. Tools that
+only load, bill or filter calls then never pay for them.
+"""
+import importlib
+from types import ModuleType
+from typing import Any, Optional
+
+
+class LazyModule:
+    """ A module that is imported on first use.
+
+    === Public Attributes ===
+    name:
+        the full name of the module, e.g. "pygame"
+    """
+    name: str
+    # === Private Attributes ===
+    # _module:
+    #     the imported module, or None if it has not been needed yet
+    _module: Optional[ModuleType]
+
+    def __init__(self, name: str) -> None:
+        """ Create a stand-in for the module called <name>, without importing
+        it.
+        """
+        self.name = name
+        self._module = None
+
+    def is_loaded(self) -> bool:
+        """ Return whether the module has been imported through this object.
+        """
+        return self._module is not None
+
+    def __getattr__(self, attribute: str) -> Any:
+        """ Import the module if needed, and return its <attribute>.
+        """
+        if self._module is None:
+            self._module = importlib.import_module(self.name)
+        return getattr(self._module, attribute)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'importlib', 'types'
+        ],
+        'generated-members': 'pygame.*'
+    })
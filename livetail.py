@@ -0,0 +1,358 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the LiveTail class, which follows a JSON Lines event file
+as it grows (one event per line, in the format of the events of
+<dataset.json>, e.g. as written by generator.py --jsonl) and processes the new
+events while the application is running.
+
+Two background threads do the work, so the pygame loop is never blocked:
+a reader polls the file for new lines and parses them into batches, and a
+worker bills each batch with an EventProcessor and hands the new calls to a
+callback (e.g. StandingQuery.extend, which adds them to the calls on
+screen). The batches wait in a bounded queue: when the worker falls behind,
+the reader stops reading until there is room, instead of using more memory.
+
+The worker changes the call histories, bills and contracts of the customers
+while other threads may read them (e.g. a FilterJob, or the visualizer
+printing a bill). It holds the tail's lock while it bills a batch, so the
+readers that need a consistent view (a bill, or all of the calls for a
+reset) hold the same lock while they look at the customers.
+
+The lag (time from reading an event to billing it) and the throughput are
+available from stats(), and are recorded as metrics when enabled.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from typing import BinaryIO, Callable, Optional
+
+import metrics
+from application import EventProcessor
+from call import Call
+from reorder import ReorderBuffer
+
+# Seconds between checks for new lines once the end of the file is reached
+POLL_INTERVAL = 0.2
+
+# Default number of events in a batch, and of batches waiting to be billed
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_MAX_PENDING = 8
+
+# Seconds a partial batch waits for more lines before it is billed anyway
+BATCH_TIMEOUT = 0.5
+
+
+class LiveTail:
+    """ Follows a growing JSON Lines event file and bills its new events.
+
+    === Public Attributes ===
+    path:
+        the JSON Lines file that is followed
+    processor:
+        bills the events, and keeps the month of the last one
+    on_calls:
+        called with the new calls of each batch once they are billed
+    batch_size:
+        the largest number of events billed at a time
+    max_pending:
+        the largest number of batches waiting to be billed
+    reorder:
+        puts the events back in order before they are billed, or None if
+        the events of the file are in order
+    lock:
+        held while a batch is billed, and by the readers of the customers
+    """
+    path: str
+    processor: EventProcessor
+    on_calls: Optional[Callable[[list[Call]], object]]
+    batch_size: int
+    max_pending: int
+    reorder: Optional[ReorderBuffer]
+    lock: threading.RLock
+    # === Private Attributes ===
+    # _queue:
+    #     batches read but not billed yet, with the time they were read; None
+    #     tells the worker to stop
+    # _stop:
+    #     set to stop both threads
+    # _threads:
+    #     the reader and worker threads, once started
+    # _position:
+    #     offset in the file of the first byte not read yet
+    # _lock:
+    #     protects the statistics below
+    # _processed:
+    #     number of events billed
+    # _busy:
+    #     seconds spent billing
+    # _lag:
+    #     seconds between reading and billing the last batch
+    # _errors:
+    #     number of lines that are not valid events
+    _queue: queue.Queue
+    _stop: threading.Event
+    _threads: list[threading.Thread]
+    _position: int
+    _lock: threading.Lock
+    _processed: int
+    _busy: float
+    _lag: float
+    _errors: int
+
+    def __init__(self, path: str, processor: EventProcessor,
+                 on_calls: Optional[Callable[[list[Call]], object]] = None,
+                 batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_pending: int = DEFAULT_MAX_PENDING,
+                 from_start: bool = True,
+                 reorder: Optional[ReorderBuffer] = None,
+                 lock: Optional[threading.RLock] = None) -> None:
+        """ Create a tail of the file <path>, whose events are billed by
+        <processor> in batches of at most <batch_size> events, with at most
+        <max_pending> batches waiting.
+
+        If <from_start> is False, only the lines added after the tail is
+        started are processed. If <reorder> is given, the events go through
+        it before they are billed. If <lock> is given, it is held while the
+        events are billed, instead of a lock of the tail's own.
+        """
+        self.path = path
+        self.processor = processor
+        self.on_calls = on_calls
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.reorder = reorder
+        self.lock = lock if lock is not None else threading.RLock()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._stop = threading.Event()
+        self._threads = []
+        self._position = 0 if from_start or not os.path.exists(path) \
+            else os.path.getsize(path)
+        self._lock = threading.Lock()
+        self._processed = 0
+        self._busy = 0.0
+        self._lag = 0.0
+        self._errors = 0
+
+    def start(self) -> None:
+        """ Start following the file in the background.
+        """
+        self._threads = [threading.Thread(target=self._read, daemon=True,
+                                          name='livetail-reader'),
+                         threading.Thread(target=self._work, daemon=True,
+                                          name='livetail-worker')]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """ Stop following the file, once the batches already read (and the
+        events waiting to be put in order) are billed.
+        """
+        self._stop.set()
+        if self._threads:
+            self._threads[0].join()
+            self._queue.put(None)
+            self._threads[1].join()
+
+    def stats(self) -> dict[str, float]:
+        """ Return the number of events billed ("events"), the events billed
+        per second spent billing ("events_per_second"), the seconds between
+        reading and billing the last batch ("lag_seconds"), the batches
+        waiting ("pending_batches"), the bytes of the file not read yet
+        ("pending_bytes"), the number of invalid lines ("errors"), and the
+        number of events waiting to be put in order ("reordering") and that
+        arrived too late to be billed in order ("late").
+        """
+        with self._lock:
+            processed, busy, lag = self._processed, self._busy, self._lag
+            errors = self._errors
+        try:
+            pending_bytes = max(0, os.path.getsize(self.path)
+                                - self._position)
+        except OSError:
+            pending_bytes = 0
+        return {'events': processed,
+                'events_per_second': processed / busy if busy else 0.0,
+                'lag_seconds': lag,
+                'pending_batches': self._queue.qsize(),
+                'pending_bytes': pending_bytes,
+                'errors': errors,
+                'reordering': len(self.reorder) if self.reorder else 0,
+                'late': self.reorder.late_count if self.reorder else 0}
+
+    def _read(self) -> None:
+        """ Read the new lines of the file into batches until stopped.
+        """
+        batch = []
+        partial = b''
+        started = time.monotonic()
+        handle = None
+        try:
+            while not self._stop.is_set():
+                if handle is None:
+                    handle = _open(self.path, self._position)
+                    if handle is None:
+                        self._stop.wait(POLL_INTERVAL)
+                        continue
+                line = handle.readline()
+                if line.endswith(b'\n'):
+                    self._position = handle.tell()
+                    line, partial = partial + line, b''
+                    if line.strip():
+                        if not batch:
+                            started = time.monotonic()
+                        try:
+                            batch.append(json.loads(line))
+                        except ValueError:
+                            with self._lock:
+                                self._errors += 1
+                    if len(batch) >= self.batch_size:
+                        self._put(batch)
+                        batch = []
+                    continue
+                # At the end of the file, possibly in the middle of a line
+                partial += line
+                self._position = handle.tell()
+                if batch and time.monotonic() - started >= BATCH_TIMEOUT:
+                    self._put(batch)
+                    batch = []
+                if os.path.exists(self.path) and \
+                        os.path.getsize(self.path) < self._position:
+                    # The file was truncated or replaced: start over
+                    handle.close()
+                    handle, partial, self._position = None, b'', 0
+                    continue
+                self._stop.wait(POLL_INTERVAL)
+            if batch:
+                self._put(batch)
+        finally:
+            if handle is not None:
+                handle.close()
+
+    def _put(self, batch: list[dict]) -> None:
+        """ Queue <batch> for the worker, waiting while the queue is full.
+        """
+        item = (time.monotonic(), batch)
+        while True:
+            try:
+                self._queue.put(item, timeout=POLL_INTERVAL)
+                return
+            except queue.Full:
+                if self._stop.is_set() and not self._threads[1].is_alive():
+                    return
+
+    def _work(self) -> None:
+        """ Bill the queued batches until stopped.
+        """
+        while True:
+            item = self._queue.get()
+            if item is None:
+                if self.reorder is not None:
+                    with self.lock:
+                        self._bill(self.reorder.flush())
+                return
+            read_at, batch = item
+            start = time.monotonic()
+            errors = 0
+            if self.reorder is not None:
+                ready = []
+                for event in batch:
+                    try:
+                        ready.extend(self.reorder.push(event))
+                    except (KeyError, ValueError, TypeError):
+                        # an event without a valid time
+                        errors += 1
+            else:
+                ready = batch
+            with self.lock:
+                errors += self._bill(ready)
+            done = time.monotonic()
+            with self._lock:
+                self._processed += len(batch)
+                self._busy += done - start
+                self._lag = done - read_at
+                self._errors += errors
+            if metrics.ENABLED:
+                self._record(len(batch), done - start)
+
+    def _bill(self, events: list[dict]) -> int:
+        """ Bill <events>, hand their calls to <on_calls>, and return the
+        number of events that could not be billed.
+
+        The caller holds <lock>.
+        """
+        calls = []
+        errors = 0
+        for event in events:
+            try:
+                call = self.processor.process(event)
+            except (KeyError, ValueError, TypeError, AttributeError):
+                # a malformed event (calls of numbers without a customer are
+                # billed to the customers that have them)
+                errors += 1
+                continue
+            if call is not None:
+                calls.append(call)
+        if self.on_calls is not None and calls:
+            self.on_calls(calls)
+        return errors
+
+    def _record(self, events: int, elapsed: float) -> None:
+        """ Record the metrics of a batch of <events> billed in <elapsed>
+        seconds.
+        """
+        stats = self.stats()
+        metrics.REGISTRY.counter('livetail_events_total',
+                                 "Events billed from the live feed") \
+            .inc(events)
+        metrics.REGISTRY.histogram('livetail_batch_seconds',
+                                   "Time to bill a batch of the live feed") \
+            .observe(elapsed)
+        metrics.REGISTRY.gauge('livetail_lag_seconds',
+                               "Time between reading and billing the "
+                               "last batch").set(stats['lag_seconds'])
+        metrics.REGISTRY.gauge('livetail_events_per_second',
+                               "Live feed events billed per second spent "
+                               "billing").set(stats['events_per_second'])
+        metrics.REGISTRY.gauge('livetail_pending_batches',
+                               "Live feed batches waiting to be billed") \
+            .set(stats['pending_batches'])
+
+
+def _open(path: str, position: int) -> Optional[BinaryIO]:
+    """ Return the file <path> opened for reading at byte <position>, or None
+    if it does not exist yet.
+    """
+    try:
+        handle = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    handle.seek(position)
+    return handle
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'json', 'os', 'queue', 'threading',
+            'time', 'metrics', 'application', 'call', 'reorder'
+        ],
+        'allowed-io': ['_open'],
+        'disable': ['R0902', 'R0913'],
+        'generated-members': 'pygame.*'
+    })
@@ -0,0 +1,305 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the MemoryReport class, which samples the memory used by
+each subsystem of the application after each stage of loading a dataset, so
+that a memory regression can be traced to the stage that caused it.
+
+Every sample takes two measures:
+- tracemalloc gives the memory allocated by Python (current, and peak since
+  the previous sample) and the files that allocated the most of it;
+- the objects of each subsystem are found by type with gc.get_objects(), and
+  their sizes are added up with sys.getsizeof, along with the lists, dicts,
+  tuples, dates and floats they own. An object shared by two subsystems is
+  counted once, in the first one of SUBSYSTEMS: the phone number strings are
+  counted in "numbers", the locations shared by a call and its sprites in
+  "calls", and so on.
+The raw event log is not found by type, and is counted in "ingest" when it is
+given to sample(). Whatever tracemalloc sees that no subsystem owns is
+reported as "other".
+
+Run the report on a dataset with:
+
+    python memreport.py dataset.json
+
+or set the MEWBILE_MEMORY environment variable to a file name, for the
+application to write the report of its own stages there when it exits.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from types import FunctionType, ModuleType
+from typing import Any, Iterable, Optional
+
+from bill import Bill
+from call import Call, Drawable, loaded_sprites
+from callhistory import CallHistory
+from contract import Contract
+from customer import Customer
+from numbertable import NumberTable
+from phoneline import PhoneLine
+from sms import SMSStore
+
+ENABLED = bool(os.environ.get('MEWBILE_MEMORY'))
+
+# The subsystems, in the order in which shared objects are attributed to them
+SUBSYSTEMS = ('numbers', 'calls', 'drawables', 'histories', 'bills', 'lines',
+              'sms', 'ingest')
+
+# The types whose instances make up each subsystem
+_TYPES = {'numbers': (NumberTable,),
+          'calls': (Call,),
+          'drawables': (Drawable,),
+          'histories': (CallHistory,),
+          'bills': (Bill, Contract),
+          'lines': (Customer, PhoneLine),
+          'sms': (SMSStore,)}
+
+# Objects that belong to a subsystem, so they are not followed from another
+_OWNED = tuple(t for types in _TYPES.values() for t in types)
+
+# Objects that belong to no subsystem
+_IGNORED = (type, ModuleType, FunctionType)
+
+
+class MemoryReport:
+    """ The memory used by each subsystem after each stage of the pipeline.
+
+    === Public Attributes ===
+    stages:
+        one sample per stage, in order: the name of the stage, the memory
+        traced by tracemalloc and its peak since the previous sample (None if
+        tracemalloc is not tracing), the bytes and the number of objects of
+        each subsystem, and the files that allocated the most memory
+    top:
+        the number of allocating files listed in each sample
+    """
+    stages: list[dict[str, Any]]
+    top: int
+
+    def __init__(self, top: int = 5) -> None:
+        """ Create an empty report listing the <top> allocating files of each
+        stage.
+        """
+        self.stages = []
+        self.top = top
+
+    def sample(self, stage: str, log: Optional[Any] = None) \
+            -> dict[str, Any]:
+        """ Measure the memory used after <stage>, counting <log>, the raw
+        event log if it is still kept, as "ingest". Return the sample, which
+        is also added to the stages of this report.
+        """
+        gc.collect()
+        traced, peak, files = None, None, []
+        if tracemalloc.is_tracing():
+            # Before counting the objects, which allocates memory
+            traced, peak = tracemalloc.get_traced_memory()
+            statistics = tracemalloc.take_snapshot().statistics('filename')
+            files = [(_short(s.traceback[0].filename), s.size)
+                     for s in statistics[:self.top]]
+        sizes, counts = _measure(log)
+        if traced is not None:
+            sizes['other'] = max(0, traced - sum(sizes.values()))
+            tracemalloc.reset_peak()
+        result = {'stage': stage, 'traced': traced, 'peak': peak,
+                  'bytes': sizes, 'objects': counts, 'files': files}
+        self.stages.append(result)
+        return result
+
+    def format(self) -> str:
+        """ Return the report as text, one block per stage.
+        """
+        lines = []
+        for stage in self.stages:
+            header = stage['stage'] + ':'
+            if stage['traced'] is not None:
+                header += ' ' + _megabytes(stage['traced']) + ' traced, ' + \
+                    _megabytes(stage['peak']) + ' peak'
+            lines.append(header)
+            for name, size in stage['bytes'].items():
+                objects = ', '.join(str(count) + ' ' + kind for kind, count
+                                    in stage['objects'].get(name, {}).items())
+                lines.append('  {:<10} {:>10}  {}'.format(
+                    name, _megabytes(size), objects).rstrip())
+            for filename, size in stage['files']:
+                lines.append('  ' + _megabytes(size).rjust(21) + '  ' +
+                             filename)
+        if self.stages and self.stages[-1]['traced'] is not None:
+            lines.append('peak: ' + _megabytes(self.peak()) +
+                         ', steady state: ' +
+                         _megabytes(self.stages[-1]['traced']))
+        return '\n'.join(lines)
+
+    def peak(self) -> Optional[int]:
+        """ Return the most memory traced at any time during the stages of
+        this report, or None if tracemalloc was not tracing.
+        """
+        peaks = [s['peak'] for s in self.stages if s['peak'] is not None]
+        return max(peaks) if peaks else None
+
+    def write(self, path: str) -> None:
+        """ Write the stages of this report to <path> as JSON.
+        """
+        with open(path, 'w') as out:
+            json.dump(self.stages, out, indent=1)
+
+
+def _measure(log: Optional[Any]) \
+        -> tuple[dict[str, int], dict[str, dict[str, int]]]:
+    """ Return the bytes used by each subsystem, with <log> as "ingest", and
+    the number of objects of each type in each subsystem.
+    """
+    roots = {name: [] for name in SUBSYSTEMS}
+    kinds = {t: name for name, types in _TYPES.items() for t in types}
+    for obj in gc.get_objects():
+        if type(obj) not in kinds:
+            # Subclasses (e.g. of Contract) belong with their base class
+            kinds[type(obj)] = next((kinds[t] for t in type(obj).__mro__
+                                     if t in kinds), None)
+        if kinds[type(obj)] is not None:
+            roots[kinds[type(obj)]].append(obj)
+    counts = {}
+    for name in SUBSYSTEMS:
+        by_type = {}
+        for obj in roots[name]:
+            by_type[type(obj).__name__] = by_type.get(type(obj).__name__,
+                                                      0) + 1
+        if by_type:
+            counts[name] = by_type
+    # The lists of sprites of the calls belong to the drawables, and the
+    # bills of the lines to the bills
+    sprite_lists = [o for call in roots['calls']
+                    for o in gc.get_referents(call) if isinstance(o, list)]
+    roots['drawables'].extend(sprite_lists)
+    roots['bills'].extend(line.bills for line in roots['lines']
+                          if isinstance(line, PhoneLine))
+    if log is not None:
+        roots['ingest'].append(log)
+    seen = set()
+    sizes = {}
+    for name in SUBSYSTEMS:
+        if name == 'calls':
+            seen.update(id(o) for o in sprite_lists)
+        elif name == 'drawables':
+            seen.difference_update(id(o) for o in sprite_lists)
+        sizes[name] = _owned_size(roots[name], seen)
+    sizes['drawables'] += sum(s.get_width() * s.get_height()
+                              * s.get_bytesize() for s in loaded_sprites())
+    return sizes, counts
+
+
+def _owned_size(roots: Iterable[Any], seen: set[int]) -> int:
+    """ Return the total size of <roots> and of the objects reachable from
+    them that belong to no subsystem, without the objects in <seen>. The
+    objects counted are added to <seen>.
+    """
+    size = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _IGNORED):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        stack.extend(child for child in gc.get_referents(obj)
+                     if not isinstance(child, _OWNED))
+    return size
+
+
+def _short(filename: str) -> str:
+    """ Return the last two parts of the path <filename>, e.g. json/decoder.py.
+    """
+    return os.path.join(*filename.replace(os.sep, '/').split('/')[-2:])
+
+
+def _megabytes(size: int) -> str:
+    """ Return <size> bytes in megabytes, as text.
+    """
+    return '{:.1f} MB'.format(size / 1e6)
+
+
+def run(path: str, drawables: bool = True, trace: bool = True,
+        keep_log: bool = False) -> MemoryReport:
+    """ Load the dataset at <path> as the application does, and return the
+    memory report of each stage: importing the raw log, creating the
+    customers, processing the events and, if <drawables> is True, making
+    the sprites of all of the calls. If <trace> is True, the memory is also
+    traced with tracemalloc, which makes the stages several times slower.
+
+    The raw log is released as its events are processed, unless <keep_log>
+    is True, in which case it is kept until the end.
+    """
+    # Imported here, so that the application can import this module
+    from application import create_customers, import_data, \
+        process_event_history
+
+    report = MemoryReport()
+    started = trace and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        report.sample('start')
+        log = import_data(path)
+        report.sample('import', log)
+        customers = create_customers(log, not keep_log)
+        report.sample('customers', log)
+        process_event_history(log, customers, None, SMSStore(), not keep_log)
+        if not keep_log:
+            log = None
+        report.sample('events', log)
+        if drawables:
+            for customer in customers:
+                for call in customer.get_history()[0]:
+                    call.get_drawables()
+                    call.get_connection()
+            report.sample('drawables', log)
+    finally:
+        if started:
+            tracemalloc.stop()
+    return report
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """ Print the memory report of loading the dataset given on the command
+    line <argv>.
+    """
+    parser = argparse.ArgumentParser(
+        description="Report the memory used by each subsystem after each "
+                    "stage of loading a dataset")
+    parser.add_argument('dataset', nargs='?', default='dataset.json')
+    parser.add_argument('--no-drawables', action='store_true',
+                        help="do not make the sprites of the calls")
+    parser.add_argument('--no-trace', action='store_true',
+                        help="only count objects, without tracemalloc")
+    parser.add_argument('--keep-log', action='store_true',
+                        help="keep the raw log in memory, instead of "
+                             "releasing it as the events are processed")
+    parser.add_argument('-o', '--output',
+                        help="also write the report to this file as JSON")
+    args = parser.parse_args(argv)
+
+    report = run(args.dataset, not args.no_drawables, not args.no_trace,
+                 args.keep_log)
+    print(report.format())
+    if args.output:
+        report.write(args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,420 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains a small metrics registry with counters, gauges and latency
+histograms, used to measure the stages of the application (ingestion, month
+rollover, filters, billing and rendering).
+
+Metrics are disabled by default. Every instrumented stage checks the module
+level ENABLED flag before doing any work, so that instrumentation costs a
+single attribute lookup when it is turned off. Metrics are enabled either by
+calling enable(), or by setting the MEWBILE_METRICS environment variable.
+
+A snapshot of all metrics can be written to a JSON file with dump(), or
+exposed in the Prometheus text format with serve().
+"""
+import functools
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Optional
+
+# Upper bounds (in seconds) of the default latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ENABLED = bool(os.environ.get('MEWBILE_METRICS'))
+
+LabelKey = tuple[tuple[str, str], ...]
+
+
+def enable() -> None:
+    """ Start recording metrics.
+    """
+    global ENABLED
+    ENABLED = True
+
+
+def disable() -> None:
+    """ Stop recording metrics. The values recorded so far are kept.
+    """
+    global ENABLED
+    ENABLED = False
+
+
+class Metric:
+    """ A named metric, with one value for each combination of labels.
+
+    This is an abstract class. Only subclasses should be instantiated.
+
+    === Public Attributes ===
+    name:
+        name of this metric, in the Prometheus naming style
+    description:
+        a one-line explanation of what this metric measures
+    kind:
+        "counter", "gauge" or "histogram"
+    """
+    name: str
+    description: str
+    kind: str
+    # === Private Attributes ===
+    # _lock:
+    #     protects the values, metrics can be updated from several threads
+    _lock: threading.Lock
+
+    def __init__(self, name: str, description: str) -> None:
+        """ Create a new metric called <name>.
+        """
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """ Return the current values of this metric, one dictionary per
+        combination of labels.
+        """
+        raise NotImplementedError
+
+    def prometheus_lines(self) -> list[str]:
+        """ Return the samples of this metric in the Prometheus text format.
+        """
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """ A value that only ever goes up, such as a number of events.
+    """
+    kind = 'counter'
+    _values: dict[LabelKey, float]
+
+    def __init__(self, name: str, description: str) -> None:
+        """ Create a new counter called <name>, starting at 0.
+        """
+        Metric.__init__(self, name, description)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        """ Increase the counter for <labels> by <amount>.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels: str) -> float:
+        """ Return the current value of the counter for <labels>.
+        """
+        return self._values.get(_label_key(labels), 0)
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """ Return the current values of this counter.
+        """
+        with self._lock:
+            return [{'labels': dict(key), 'value': value}
+                    for key, value in self._values.items()]
+
+    def prometheus_lines(self) -> list[str]:
+        """ Return the samples of this counter in the Prometheus text format.
+        """
+        with self._lock:
+            return [self.name + _format_labels(key) + ' ' + _format(value)
+                    for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """ A value that can go up and down, such as a number of drawables.
+    """
+    kind = 'gauge'
+
+    def set(self, value: float, **labels: str) -> None:
+        """ Set the gauge for <labels> to <value>.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """ A distribution of observed values, such as latencies in seconds.
+
+    === Public Attributes ===
+    buckets:
+        upper bounds of the buckets, in increasing order
+    """
+    kind = 'histogram'
+    buckets: tuple[float, ...]
+    # === Private Attributes ===
+    # _values:
+    #     for each combination of labels, a list with the number of
+    #     observations in each bucket (the last one being +Inf), then the
+    #     sum and the count of all observations
+    _values: dict[LabelKey, list[float]]
+
+    def __init__(self, name: str, description: str,
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        """ Create a new, empty histogram called <name> with <buckets>.
+        """
+        Metric.__init__(self, name, description)
+        self.buckets = buckets
+        self._values = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        """ Record one observation of <value> for <labels>.
+        """
+        key = _label_key(labels)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = [0] * (len(self.buckets) + 3)
+                self._values[key] = counts
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def get(self, **labels: str) -> tuple[float, int]:
+        """ Return the sum and the count of the observations for <labels>.
+        """
+        counts = self._values.get(_label_key(labels))
+        if counts is None:
+            return 0, 0
+        return counts[-2], int(counts[-1])
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        """ Return the current values of this histogram.
+        """
+        with self._lock:
+            result = []
+            for key, counts in self._values.items():
+                bounds = [str(b) for b in self.buckets] + ['+Inf']
+                result.append({'labels': dict(key),
+                               'buckets': dict(zip(bounds, counts)),
+                               'sum': counts[-2],
+                               'count': counts[-1]})
+            return result
+
+    def prometheus_lines(self) -> list[str]:
+        """ Return the samples of this histogram in the Prometheus text
+        format, with cumulative buckets.
+        """
+        lines = []
+        with self._lock:
+            for key, counts in self._values.items():
+                total = 0
+                bounds = [_format(b) for b in self.buckets] + ['+Inf']
+                for bound, count in zip(bounds, counts):
+                    total += count
+                    lines.append(self.name + '_bucket'
+                                 + _format_labels(key + (('le', bound),))
+                                 + ' ' + _format(total))
+                lines.append(self.name + '_sum' + _format_labels(key) + ' '
+                             + _format(counts[-2]))
+                lines.append(self.name + '_count' + _format_labels(key) + ' '
+                             + _format(counts[-1]))
+        return lines
+
+
+class MetricsRegistry:
+    """ A collection of metrics, identified by their names.
+    """
+    # === Private Attributes ===
+    # _metrics:
+    #     the registered metrics, in registration order
+    _metrics: dict[str, Metric]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        """ Create an empty registry.
+        """
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, description: str = '') -> Counter:
+        """ Return the counter called <name>, creating it if needed.
+        """
+        return self._get(Counter, name, description)
+
+    def gauge(self, name: str, description: str = '') -> Gauge:
+        """ Return the gauge called <name>, creating it if needed.
+        """
+        return self._get(Gauge, name, description)
+
+    def histogram(self, name: str, description: str = '') -> Histogram:
+        """ Return the histogram called <name>, creating it if needed.
+        """
+        return self._get(Histogram, name, description)
+
+    def clear(self) -> None:
+        """ Remove all the metrics from this registry.
+        """
+        with self._lock:
+            self._metrics = {}
+
+    def snapshot(self) -> dict[str, dict[str, Any]]:
+        """ Return the current value of every metric in this registry.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: {'type': m.kind, 'help': m.description,
+                         'values': m.snapshot()} for m in metrics}
+
+    def dump(self, path: str) -> None:
+        """ Write a snapshot of every metric to the JSON file <path>.
+        """
+        with open(path, 'w') as out:
+            json.dump(self.snapshot(), out, indent=2)
+
+    def to_prometheus(self) -> str:
+        """ Return every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for m in metrics:
+            lines.append('# HELP ' + m.name + ' ' + m.description)
+            lines.append('# TYPE ' + m.name + ' ' + m.kind)
+            lines.extend(m.prometheus_lines())
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int = 9100, host: str = '127.0.0.1') \
+            -> Any:
+        """ Start serving the metrics in the Prometheus text format on
+        http://<host>:<port>/metrics, from a background thread.
+
+        Return the server, so that it can be stopped with shutdown().
+        """
+        # Imported here, so that modules that record metrics load quickly
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """ Answer every GET request with the current metrics.
+            """
+
+            def do_GET(self) -> None:
+                """ Send the metrics in the Prometheus text format.
+                """
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type',
+                                 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args: Any) -> None:
+                """ Do not log every scrape to the console.
+                """
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        return server
+
+    def _get(self, cls: type, name: str, description: str) -> Any:
+        """ Return the metric of type <cls> called <name>, creating it if
+        needed.
+        """
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, description)
+                self._metrics[name] = metric
+            elif type(metric) is not cls:
+                raise ValueError(name + " is already a " + metric.kind)
+            return metric
+
+
+# The registry used by the application
+REGISTRY = MetricsRegistry()
+
+
+def observe_filter(apply: Callable) -> Callable:
+    """ Decorate the apply() method of a Filter so that the size of its input
+    and output, and the time it takes, are recorded when metrics are enabled.
+    """
+
+    @functools.wraps(apply)
+    def wrapper(self: Any, customers: list, data: list,
+                filter_string: str) -> list:
+        """ Apply the filter, and record its metrics if enabled.
+        """
+        if not ENABLED:
+            return apply(self, customers, data, filter_string)
+        start = time.perf_counter()
+        result = apply(self, customers, data, filter_string)
+        elapsed = time.perf_counter() - start
+        name = type(self).__name__
+        REGISTRY.histogram('filter_seconds', "Time to apply a filter") \
+            .observe(elapsed, filter=name)
+        REGISTRY.counter('filter_input_calls_total',
+                         "Calls given to a filter").inc(len(data),
+                                                        filter=name)
+        REGISTRY.counter('filter_output_calls_total',
+                         "Calls returned by a filter").inc(len(result),
+                                                           filter=name)
+        REGISTRY.gauge('filter_last_input_calls',
+                       "Input size of the last filter applied") \
+            .set(len(data), filter=name)
+        REGISTRY.gauge('filter_last_output_calls',
+                       "Output size of the last filter applied") \
+            .set(len(result), filter=name)
+        return result
+
+    return wrapper
+
+
+def _label_key(labels: dict[str, str]) -> LabelKey:
+    """ Return a hashable key for the <labels> of a metric.
+    """
+    if not labels:
+        return ()
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey) -> str:
+    """ Return the labels <key> in the Prometheus format, e.g. {type="sms"}.
+    """
+    if not key:
+        return ''
+    return '{' + ','.join(k + '="' + v.replace('\\', '\\\\')
+                          .replace('"', '\\"') + '"'
+                          for k, v in key) + '}'
+
+
+def _format(value: Optional[float]) -> str:
+    """ Return <value> as a Prometheus sample value.
+    """
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'functools', 'json', 'os', 'threading',
+            'time', 'http.server'
+        ],
+        'allowed-io': ['dump'],
+        'disable': ['R0902', 'R0913'],
+        'generated-members': 'pygame.*'
+    })
@@ -0,0 +1,96 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the NumberTable class, which gives each distinct phone
+number a small integer id, and NUMBERS, the table shared by all of the
+phone lines, calls and SMS messages.
+
+Calls and phone lines keep the id of their numbers, so that phone lines are
+found and compared with integers. Their number strings are the ones kept in
+the table, so each distinct number is stored once however many calls use it.
+"""
+import threading
+from typing import Optional
+
+
+class NumberTable:
+    """ The phone numbers seen so far, each with a dense integer id: the
+    first number gets 0, the next one 1, and so on.
+    """
+    # === Private Attributes ===
+    # _numbers:
+    #     each number, by id
+    # _ids:
+    #     the id of each number
+    # _lock:
+    #     makes sure that a number gets a single id, as numbers may be added
+    #     from several threads (e.g. by a live feed)
+    _numbers: list[str]
+    _ids: dict[str, int]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        """ Create an empty table.
+        """
+        self._numbers = []
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """ Return the number of numbers in this table.
+        """
+        return len(self._numbers)
+
+    def intern(self, number: str) -> int:
+        """ Return the id of <number>, giving it a new id if it has none.
+        """
+        number_id = self._ids.get(number)
+        if number_id is None:
+            with self._lock:
+                number_id = self._ids.get(number)
+                if number_id is None:
+                    number_id = len(self._numbers)
+                    self._numbers.append(number)
+                    self._ids[number] = number_id
+        return number_id
+
+    def lookup(self, number: str) -> Optional[int]:
+        """ Return the id of <number>, or None if it has none.
+        """
+        return self._ids.get(number)
+
+    def number(self, number_id: int) -> str:
+        """ Return the number with the id <number_id>.
+        """
+        return self._numbers[number_id]
+
+    def with_prefix(self, prefix: str) -> list[str]:
+        """ Return the numbers starting with <prefix>.
+        """
+        return [n for n in list(self._numbers) if n.startswith(prefix)]
+
+
+# The ids of all of the phone numbers
+NUMBERS = NumberTable()
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'threading'
+        ],
+        'generated-members': 'pygame.*'
+    })
@@ -0,0 +1,482 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains process_event_history, which processes an event history
+like application.process_event_history, but bills the calls in several
+worker processes.
+
+The bill of a line depends only on the calls made from it and on the months
+in which new_month is called. The customers are split between the workers,
+with about as many lines each, and each call is sent to the workers owning
+its source and its destination numbers, in batches of typed columns
+(decoder.EventColumns). Whenever the month of the events changes, every
+worker is told to advance all of its customers to the new month at that
+point of its stream of calls, even if it has no call in that month: this is
+where the workers are kept in step, so that each customer sees the same
+new_month calls and billed calls, in the same order, as in a serial run.
+Each worker bills its calls with an EventProcessor, and at the end returns
+the bills and the contract of each of its lines, which replace those of the
+lines of the customers.
+
+Meanwhile, the main process makes the Call objects (shared by the two lines
+of a call, as in a serial run), records them and the SMS messages in the
+call histories, and calls the call listeners. This takes about as long as a
+serial run, so that the workers only take the billing off the main process.
+With histories=False (e.g. for a billing run), the main process only reads
+and sends the calls, and the processing gets faster with more cores:
+
+    python parallel.py big.json --workers 4
+"""
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from application import EventProcessor, event_fields, iter_events, \
+    process_event_history as process_serially, record_ingestion
+from call import Call
+from customer import Customer
+from decoder import EventColumns
+from phoneline import PhoneLine
+from reorder import ReorderBuffer
+from sms import SMSStore
+import cancel
+import metrics
+
+# Default number of worker processes
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Number of events routed to the workers at a time
+BATCH_SIZE = 10000
+
+# Seconds between checks that the workers are still running, while waiting
+# for their results
+POLL_INTERVAL = 0.5
+
+
+def partition(customers: list[Customer], workers: int) \
+        -> list[list[Customer]]:
+    """ Return <customers> split into <workers> groups with about as many
+    phone lines each.
+    """
+    groups = [[] for _ in range(workers)]
+    lines = [0] * workers
+    for customer in customers:
+        group = min(range(workers), key=lines.__getitem__)
+        groups[group].append(customer)
+        lines[group] += len(customer.get_phone_lines())
+    return groups
+
+
+def process_event_history(log: dict[str, Any],
+                          customer_list: list[Customer],
+                          call_listeners: Optional[
+                              list[Callable[[Call], None]]] = None,
+                          messages: Optional[SMSStore] = None,
+                          release: bool = False,
+                          reorder_buffer: Optional[ReorderBuffer] = None,
+                          workers: int = DEFAULT_WORKERS,
+                          histories: bool = True) -> None:
+    """ Process the events of <log> for the customers of <customer_list>
+    like application.process_event_history, with the same arguments, but
+    bill the calls in <workers> processes. The customers end with the same
+    bills, contracts and call histories.
+
+    If <histories> is False, only the bills and contracts are kept: no Call
+    is made in this process, the call histories are left as they are, and
+    <call_listeners> are not called.
+
+    With fewer than two workers (or customers), the events are processed by
+    application.process_event_history.
+
+    Raise ValueError if there are customer records among the events. Raise
+    cancel.Cancelled if the active cancel token stops the processing; the
+    events before it are processed and billed.
+    """
+    if workers < 2 or len(customer_list) < 2:
+        process_serially(log, customer_list, call_listeners, messages,
+                         release, reorder_buffer)
+        return
+    started = time.perf_counter()
+    context = multiprocessing.get_context()
+    results = context.Queue()
+    connections = []
+    processes = []
+    groups = partition(customer_list, workers)
+    for _ in groups:
+        receiving, sending = context.Pipe(duplex=False)
+        process = context.Process(target=_bill_group,
+                                  args=(receiving, results, len(processes)),
+                                  daemon=True)
+        process.start()
+        receiving.close()
+        connections.append(sending)
+        processes.append(process)
+
+    router = _Router(groups, connections, call_listeners, messages,
+                     histories)
+    events = log['events']
+    try:
+        for connection, group in zip(connections, groups):
+            connection.send([(customer.get_id(),
+                              [(line.number, line.contract, line.bills)
+                               for line in customer.get_phone_lines()])
+                             for customer in group])
+        if isinstance(events, EventColumns) and reorder_buffer is None:
+            try:
+                router.route_columns(events)
+            finally:
+                if release:
+                    events.remove_first(router.routed)
+        else:
+            for fields in _fields(iter_events(log, release,
+                                              reorder_buffer)):
+                router.route(*fields)
+    finally:
+        router.close()
+        try:
+            states = _collect(results, processes)
+        finally:
+            for process in processes:
+                process.join()
+        router.merge(states)
+
+    if metrics.ENABLED:
+        record_ingestion(router.event_counts, time.perf_counter() - started)
+
+
+def _collect(results: Any, processes: list) -> list[tuple[int, Any]]:
+    """ Return the states that the worker <processes> put on the queue
+    <results>, with the number of each worker.
+
+    Raise RuntimeError if a worker exits without putting its state, e.g.
+    because it was killed.
+    """
+    states = {}
+    exited = set()
+    while len(states) < len(processes):
+        try:
+            worker, state = results.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            # A worker's state is sent before it exits, so a worker that
+            # has exited for a whole interval without it will never send it
+            lost = {worker for worker, process in enumerate(processes)
+                    if worker not in states and not process.is_alive()}
+            if lost & exited:
+                worker = min(lost & exited)
+                raise RuntimeError(
+                    "worker " + str(worker) + " exited with code " +
+                    str(processes[worker].exitcode) + " without a result")
+            exited = lost
+            continue
+        states[worker] = state
+    return sorted(states.items())
+
+
+class _Router:
+    """ Sends the calls of an event history to the workers billing their
+    lines, and records them in the call histories.
+
+    === Public Attributes ===
+    routed:
+        the number of events routed so far
+    event_counts:
+        the number of events routed of each type, if metrics are enabled
+    """
+    routed: int
+    event_counts: dict[str, int]
+    # === Private Attributes ===
+    # _workers:
+    #     the worker billing each line, by its number
+    # _lines:
+    #     every line, by its number
+    # _connections:
+    #     the connection to each worker
+    # _pending:
+    #     the events routed since the last batches were sent
+    # _positions:
+    #     the positions in <_pending> of the calls of each worker
+    # _markers:
+    #     the months each worker must advance to, each with the number of
+    #     calls of its batch before which it must advance
+    # _month:
+    #     the month of the last event routed, or None
+    # _listeners:
+    #     functions called with each Call
+    # _messages:
+    #     where SMS messages are kept, or None
+    # _histories:
+    #     whether the calls and messages are recorded in the call histories
+    # _token:
+    #     the cancel token active when routing started, or None
+    _workers: dict[str, int]
+    _lines: dict[str, PhoneLine]
+    _connections: list
+    _pending: EventColumns
+    _positions: list[list[int]]
+    _markers: list[list[tuple[int, int, int]]]
+    _month: Optional[int]
+    _listeners: list[Callable[[Call], None]]
+    _messages: Optional[SMSStore]
+    _histories: bool
+    _token: Optional[cancel.CancelToken]
+
+    def __init__(self, groups: list[list[Customer]], connections: list,
+                 call_listeners: Optional[list[Callable[[Call], None]]],
+                 messages: Optional[SMSStore], histories: bool) -> None:
+        """ Create a router to the workers at the end of <connections>,
+        billing the customers of <groups>, which adds SMS messages to
+        <messages> if it is given.
+
+        If <histories> is True, the router also makes a Call for each call,
+        records the calls and messages in the call histories, and calls each
+        of <call_listeners> with each Call.
+        """
+        self.routed = 0
+        self.event_counts = {}
+        self._workers = {}
+        self._lines = {}
+        for worker, group in enumerate(groups):
+            for customer in group:
+                for line in customer.get_phone_lines():
+                    self._workers[line.number] = worker
+                    self._lines[line.number] = line
+        self._connections = connections
+        self._pending = EventColumns()
+        self._positions = [[] for _ in connections]
+        self._markers = [[] for _ in connections]
+        self._month = None
+        self._listeners = call_listeners if call_listeners else []
+        self._messages = messages
+        self._histories = histories
+        self._token = cancel.current()
+
+    def route(self, event_type: str, src_number: str, dst_number: str,
+              when: Any, duration: int, src_loc: Any, dst_loc: Any) -> None:
+        """ Route the event with these fields, in the order of the arguments
+        of EventProcessor.process_fields.
+
+        Raise cancel.Cancelled if the active cancel token stops the
+        processing before this event.
+        """
+        cancel.check(self._token, self.routed)
+        self._pending.append(event_type, src_number, dst_number, when,
+                             duration, src_loc, dst_loc)
+        self._assign(len(self._pending) - 1, event_type, src_number,
+                     dst_number, when, duration, src_loc, dst_loc)
+        if len(self._pending) >= BATCH_SIZE:
+            self._send()
+
+    def route_columns(self, columns: EventColumns) -> None:
+        """ Route the events of <columns>.
+
+        Raise cancel.Cancelled if the active cancel token stops the
+        processing; the events of the batches before it are routed.
+        """
+        for start in range(0, len(columns), BATCH_SIZE):
+            if self._token is not None and self._token.is_stopped():
+                raise cancel.Cancelled(self._token.reason(), start)
+            self._pending = columns.take(start, start + BATCH_SIZE)
+            for position, fields in enumerate(self._pending.rows()):
+                self._assign(position, *fields)
+            self._send()
+
+    def close(self) -> None:
+        """ Send the calls waiting to the workers, and tell them that there
+        are no more.
+        """
+        try:
+            self._send()
+        except OSError:
+            # A worker has exited, which _collect tells: the others are
+            # still told to stop
+            pass
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+
+    def merge(self, states: list[tuple[int, Any]]) -> None:
+        """ Replace the bills and contracts of the lines by those of the
+        workers, given as their <states>.
+
+        Raise RuntimeError if a worker failed.
+        """
+        for worker, state in states:
+            if isinstance(state, str):
+                raise RuntimeError("worker " + str(worker) + " failed:\n" +
+                                   state)
+            for number, contract, bills in state:
+                line = self._lines[number]
+                line.contract = contract
+                line.bills = bills
+
+    def _assign(self, position: int, event_type: str, src_number: str,
+                dst_number: str, when: Any, duration: int, src_loc: Any,
+                dst_loc: Any) -> None:
+        """ Assign the event with these fields, at <position> in <_pending>,
+        to the workers billing its lines, and record it.
+        """
+        self.routed += 1
+        if when.month != self._month:
+            self._month = when.month
+            for worker, positions in enumerate(self._positions):
+                self._markers[worker].append((len(positions), when.month,
+                                              when.year))
+        if event_type == "call":
+            src_worker = self._workers.get(src_number)
+            dst_worker = self._workers.get(dst_number)
+            if src_worker is not None:
+                self._positions[src_worker].append(position)
+            if dst_worker is not None and dst_worker != src_worker:
+                self._positions[dst_worker].append(position)
+        if self._histories or self._messages is not None or \
+                metrics.ENABLED:
+            self._record(event_type, src_number, dst_number, when, duration,
+                         src_loc, dst_loc)
+
+    def _send(self) -> None:
+        """ Send each worker its calls of <_pending>, and the months to
+        advance to between them.
+        """
+        for worker, connection in enumerate(self._connections):
+            if self._positions[worker] or self._markers[worker]:
+                connection.send((self._pending.select(
+                    self._positions[worker]), self._markers[worker]))
+                self._positions[worker] = []
+                self._markers[worker] = []
+        self._pending = EventColumns()
+
+    def _record(self, event_type: str, src_number: str, dst_number: str,
+                when: Any, duration: int, src_loc: Any, dst_loc: Any) \
+            -> None:
+        """ Record the event with these fields in the call histories, if
+        they are kept, and in <_messages>.
+        """
+        if metrics.ENABLED:
+            self.event_counts[event_type] = \
+                self.event_counts.get(event_type, 0) + 1
+        if event_type == "sms":
+            if self._messages is not None:
+                self._messages.add(src_number, dst_number, when, src_loc,
+                                   dst_loc)
+            if not self._histories:
+                return
+            line = self._lines.get(src_number)
+            if line is not None:
+                line.callhistory.register_outgoing_sms(when.month, when.year)
+            line = self._lines.get(dst_number)
+            if line is not None:
+                line.callhistory.register_incoming_sms(when.month, when.year)
+        if event_type != "call" or not self._histories:
+            return
+        call = Call(src_number, dst_number, when, duration, src_loc, dst_loc)
+        line = self._lines.get(src_number)
+        if line is not None:
+            line.callhistory.register_outgoing_call(call)
+        line = self._lines.get(dst_number)
+        if line is not None:
+            line.callhistory.register_incoming_call(call)
+        for listener in self._listeners:
+            listener(call)
+
+
+def _fields(events: Iterable[dict]) -> Iterator[tuple]:
+    """ Yield the fields of each of <events>, as returned by
+    application.event_fields.
+
+    Raise ValueError if one of <events> is a customer record.
+    """
+    for event_data in events:
+        if event_data["type"] == "customer":
+            raise ValueError("customer records cannot be processed in "
+                             "parallel")
+        yield event_fields(event_data)
+
+
+def _bill_group(connection: Any, results: Any, worker: int) -> None:
+    """ Bill the calls received from <connection> to the customers received
+    first, and put the number, contract and bills of each of their lines on
+    the queue <results>, with the number <worker>.
+
+    The calls come in batches (an EventColumns, with the months to advance
+    to between its calls), and end with None.
+    """
+    try:
+        customers = []
+        for cid, lines in connection.recv():
+            customer = Customer(cid)
+            for number, contract, bills in lines:
+                line = PhoneLine(number, contract)
+                line.bills = bills
+                customer.add_phone_line(line)
+            customers.append(customer)
+        processor = EventProcessor(customers, partial=True)
+        batch = connection.recv()
+        while batch is not None:
+            calls, markers = batch
+            marker = 0
+            for i, fields in enumerate(calls.rows()):
+                while marker < len(markers) and markers[marker][0] == i:
+                    processor.advance_month(markers[marker][1],
+                                            markers[marker][2])
+                    marker += 1
+                processor.process_fields(*fields)
+            for _, month, year in markers[marker:]:
+                processor.advance_month(month, year)
+            batch = connection.recv()
+        results.put((worker, [(line.number, line.contract, line.bills)
+                              for customer in customers
+                              for line in customer.get_phone_lines()]))
+    except Exception:
+        results.put((worker, traceback.format_exc()))
+        raise
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    """ Bill the dataset given on the command line <argv> with worker
+    processes, and print how long it took.
+    """
+    import argparse
+
+    from application import create_customers, import_data
+
+    parser = argparse.ArgumentParser(
+        description="Bill a dataset with several worker processes")
+    parser.add_argument('dataset', nargs='?', default='dataset.json')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--histories', action='store_true',
+                        help="also keep the call histories")
+    args = parser.parse_args(argv)
+
+    log = import_data(args.dataset)
+    customers = create_customers(log, release=True)
+    events = len(log['events'])
+    start = time.perf_counter()
+    process_event_history(log, customers, release=True, workers=args.workers,
+                          histories=args.histories)
+    seconds = time.perf_counter() - start
+    lines = sum(len(customer.get_phone_lines()) for customer in customers)
+    print('{} events, {} lines, {} workers: {:.2f} s, {:.0f} events/s'
+          .format(events, lines, args.workers, seconds,
+                  events / (seconds or 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
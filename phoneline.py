@@ -16,6 +16,7 @@ from call import Call
 from callhistory import CallHistory
 from bill import Bill
 from contract import Contract
+from numbertable import NUMBERS
 
 
 class PhoneLine:
@@ -24,6 +25,8 @@ class PhoneLine:
     === Public Attributes ===
     number:
          phone number
+    number_id:
+         id of the phone number in numbertable.NUMBERS
     contract:
          current contract for this phone, represented by a Contract instance
     bills:
@@ -37,7 +40,9 @@ class PhoneLine:
     - the <bills> dictionary contains as keys only those month+year combinations
     for dates that are encountered at least in one call from the input dataset.
     """
+    __slots__ = ('number', 'number_id', 'contract', 'bills', 'callhistory')
     number: str
+    number_id: int
     contract: Contract
     bills: dict[tuple[int, int], Bill]
     callhistory: CallHistory
@@ -45,7 +50,8 @@ class PhoneLine:
     def __init__(self, number: str, contract: Contract) -> None:
         """ Create a new PhoneLine with <number> and <contract>.
         """
-        self.number = number
+        self.number_id = NUMBERS.intern(number)
+        self.number = NUMBERS.number(self.number_id)
         self.contract = contract
         self.callhistory = CallHistory()
         self.bills = {}
@@ -146,7 +152,7 @@ if __name__ == '__main__':
     python_ta.check_all(config={
         'allowed-import-modules': [
             'python_ta', 'typing',
-            'call', 'callhistory', 'bill', 'contract'
+            'call', 'callhistory', 'bill', 'contract', 'numbertable'
         ],
         'generated-members': 'pygame.*'
     })
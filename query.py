@@ -0,0 +1,1038 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains a small query language for selecting calls, which combines
+the criteria of the individual filters with AND, OR and NOT, e.g.
+
+    duration > 60 AND (customer = 5555 OR NOT location IN (-79.6, 43.6,
+    -79.3, 43.7)) AND time >= "2018-01-05 18:00"
+
+The supported predicates are:
+    duration <op> <seconds>         <op> is one of <, <=, =, !=, >=, >
+    customer = <id>                 calls made or received by the customer
+    location IN (lowerLong, lowerLat, upperLong, upperLat)
+                                    source or destination in the rectangle
+    time <op> "<date>"              <date> is "YYYY-MM-DD[ HH:MM[:SS]]"
+    number = "<number>"             calls made or received by the number,
+                                    or by the numbers starting with it if it
+                                    ends with "*" (e.g. "416-*")
+
+A query is parsed once into a tree of predicates. Before it is run, a Plan
+is made: the selectivity of each part of the top-level conjunction is
+estimated (with an index when one is available, otherwise on a sample of the
+calls), the most selective indexed predicate produces the candidate calls,
+and all the other predicates are tested on each candidate in a single fused
+pass, most selective first.
+"""
+import datetime
+import re
+from array import array
+from typing import Any, Callable, Optional, Sequence
+
+import cancel
+from call import Call
+from customer import Customer
+from filter import Filter, NumberIndex, TimeIndex
+from metrics import observe_filter
+from numbertable import NUMBERS
+from sms import SMSStore
+from tracing import traced
+
+# Number of calls used to estimate the selectivity of a predicate without an
+# index
+SAMPLE_SIZE = 256
+
+# Formats accepted for the dates of time predicates
+TIME_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d")
+
+_TOKEN = re.compile(r'\s*(?:(-?\d+(?:\.\d*)?)|"([^"]*)"|\'([^\']*)\''
+                    r'|(<=|>=|!=|=|<|>|\(|\)|,)|([A-Za-z_]+))')
+
+_COMPARISONS = {'<': lambda a, b: a < b,
+                '<=': lambda a, b: a <= b,
+                '=': lambda a, b: a == b,
+                '!=': lambda a, b: a != b,
+                '>=': lambda a, b: a >= b,
+                '>': lambda a, b: a > b}
+
+
+class QueryError(ValueError):
+    """ A query that cannot be parsed.
+    """
+
+
+class SMSMessage:
+    """ An SMS message of an SMSStore, with the attributes of a Call that
+    predicates look at, except its duration.
+    """
+    src_id: int
+    dst_id: int
+    src_number: str
+    dst_number: str
+    time: datetime.datetime
+    src_loc: tuple[float, float]
+    dst_loc: tuple[float, float]
+
+    def __init__(self, messages: SMSStore, position: int) -> None:
+        """ Create a view of the message at <position> in <messages>.
+        """
+        self.src_id, self.dst_id, self.time, self.src_loc, self.dst_loc = \
+            messages.fields(position)
+        self.src_number = NUMBERS.number(self.src_id)
+        self.dst_number = NUMBERS.number(self.dst_id)
+
+
+class Node:
+    """ A node of a parsed query.
+
+    This is an abstract class. Only subclasses should be instantiated.
+    """
+
+    def bind(self, customers: list[Customer]) -> None:
+        """ Resolve the parts of this node that depend on the <customers>
+        of the dataset.
+        """
+
+    def matches(self, call: Call) -> bool:
+        """ Return whether <call> is selected by this node.
+        """
+        raise NotImplementedError
+
+    def matches_sms(self, message: SMSMessage) -> Optional[bool]:
+        """ Return whether <message> is selected by this node, or None if
+        this node does not apply to SMS messages (e.g. it is about
+        durations).
+        """
+        raise NotImplementedError
+
+
+class Predicate(Node):
+    """ A single criterion on a call.
+
+    This is an abstract class. Only subclasses should be instantiated.
+
+    === Public Attributes ===
+    kind:
+        the kind of criterion, used to find an index that can answer it
+    """
+    kind: str
+
+    def matches_sms(self, message: SMSMessage) -> Optional[bool]:
+        """ Return whether <message> is selected by this predicate, which
+        looks at the same attributes of messages as of calls.
+        """
+        return self.matches(message)
+
+
+class DurationPredicate(Predicate):
+    """ Select the calls whose duration compares to <seconds> with <op>.
+    <seconds> may be fractional, e.g. "duration < 100.5".
+    """
+    kind = 'duration'
+    op: str
+    seconds: float
+
+    def __init__(self, op: str, seconds: float) -> None:
+        """ Create a predicate "duration <op> <seconds>".
+        """
+        self.op = op
+        self.seconds = seconds
+        self._compare = _COMPARISONS[op]
+
+    def matches(self, call: Call) -> bool:
+        """ Return whether the duration of <call> compares with <op>.
+        """
+        return self._compare(call.duration, self.seconds)
+
+    def matches_sms(self, message: SMSMessage) -> Optional[bool]:
+        """ Return None: messages have no duration.
+        """
+        return None
+
+    def __str__(self) -> str:
+        """ Return this predicate as query text.
+        """
+        return 'duration ' + self.op + ' ' + str(self.seconds)
+
+
+class CustomerPredicate(Predicate):
+    """ Select the calls made or received by the customer <cid>.
+    """
+    kind = 'customer'
+    cid: int
+    number_ids: set[int]
+
+    def __init__(self, cid: int) -> None:
+        """ Create a predicate "customer = <cid>".
+        """
+        self.cid = cid
+        self.number_ids = set()
+
+    def bind(self, customers: list[Customer]) -> None:
+        """ Find the ids of the phone numbers of the customer in
+        <customers>.
+        """
+        self.number_ids = set()
+        for c in customers:
+            if c.get_id() == self.cid:
+                self.number_ids.update(line.number_id
+                                       for line in c.get_phone_lines())
+
+    def matches(self, call: Call) -> bool:
+        """ Return whether <call> was made or received by the customer.
+        """
+        return call.src_id in self.number_ids \
+            or call.dst_id in self.number_ids
+
+    def __str__(self) -> str:
+        """ Return this predicate as query text.
+        """
+        return 'customer = ' + str(self.cid)
+
+
+class NumberPredicate(Predicate):
+    """ Select the calls made or received by <number>, or by the numbers
+    starting with <number> if <prefix> is True.
+    """
+    kind = 'number'
+    number: str
+    prefix: bool
+
+    def __init__(self, number: str, prefix: bool) -> None:
+        """ Create a predicate "number = <number>", followed by "*" if
+        <prefix> is True.
+        """
+        self.number = number
+        self.prefix = prefix
+
+    def matches(self, call: Call) -> bool:
+        """ Return whether <call> was made or received by the number(s).
+        """
+        if self.prefix:
+            return call.src_number.startswith(self.number) or \
+                call.dst_number.startswith(self.number)
+        return self.number in (call.src_number, call.dst_number)
+
+    def __str__(self) -> str:
+        """ Return this predicate as query text.
+        """
+        return 'number = "' + self.number + ('*"' if self.prefix else '"')
+
+
+class LocationPredicate(Predicate):
+    """ Select the calls whose source or destination is in a rectangle,
+    boundary included.
+    """
+    kind = 'location'
+    bounds: tuple[float, float, float, float]
+
+    def __init__(self, bounds: tuple[float, float, float, float]) -> None:
+        """ Create a predicate "location IN <bounds>", where <bounds> are the
+        lowerLong, lowerLat, upperLong, upperLat of the rectangle.
+        """
+        self.bounds = bounds
+
+    def matches(self, call: Call) -> bool:
+        """ Return whether <call> starts or ends in the rectangle.
+        """
+        lo_long, lo_lat, hi_long, hi_lat = self.bounds
+        return (lo_long <= call.src_loc[0] <= hi_long
+                and lo_lat <= call.src_loc[1] <= hi_lat) \
+            or (lo_long <= call.dst_loc[0] <= hi_long
+                and lo_lat <= call.dst_loc[1] <= hi_lat)
+
+    def __str__(self) -> str:
+        """ Return this predicate as query text.
+        """
+        return 'location IN (' + ', '.join(str(b) for b in self.bounds) + ')'
+
+
+class TimePredicate(Predicate):
+    """ Select the calls whose time compares to <when> with <op>.
+    """
+    kind = 'time'
+    op: str
+    when: datetime.datetime
+
+    def __init__(self, op: str, when: datetime.datetime) -> None:
+        """ Create a predicate "time <op> <when>".
+        """
+        self.op = op
+        self.when = when
+        self._compare = _COMPARISONS[op]
+
+    def matches(self, call: Call) -> bool:
+        """ Return whether the time of <call> compares with <op>.
+        """
+        return self._compare(call.time, self.when)
+
+    def __str__(self) -> str:
+        """ Return this predicate as query text.
+        """
+        return 'time ' + self.op + ' "' + str(self.when) + '"'
+
+
+class And(Node):
+    """ Select the calls selected by all of the <children>.
+    """
+    children: list[Node]
+
+    def __init__(self, children: list[Node]) -> None:
+        """ Combine the <children> nodes.
+        """
+        self.children = children
+
+    def bind(self, customers: list[Customer]) -> None:
+        """ Bind every child to <customers>.
+        """
+        for child in self.children:
+            child.bind(customers)
+
+    def matches(self, call: Call) -> bool:
+        """ Return whether <call> is selected by every child.
+        """
+        for child in self.children:
+            if not child.matches(call):
+                return False
+        return True
+
+    def matches_sms(self, message: SMSMessage) -> Optional[bool]:
+        """ Return False if a child does not select <message>, otherwise
+        None if a child does not apply to messages, otherwise True.
+        """
+        result = True
+        for child in self.children:
+            selected = child.matches_sms(message)
+            if selected is False:
+                return False
+            if selected is None:
+                result = None
+        return result
+
+    def __str__(self) -> str:
+        """ Return this node as query text.
+        """
+        return '(' + ' AND '.join(str(c) for c in self.children) + ')'
+
+
+class Or(And):
+    """ Select the calls selected by any of the <children>.
+    """
+
+    def matches(self, call: Call) -> bool:
+        """ Return whether <call> is selected by any child.
+        """
+        for child in self.children:
+            if child.matches(call):
+                return True
+        return False
+
+    def matches_sms(self, message: SMSMessage) -> Optional[bool]:
+        """ Return True if a child selects <message>, otherwise None if a
+        child does not apply to messages, otherwise False.
+        """
+        result = False
+        for child in self.children:
+            selected = child.matches_sms(message)
+            if selected:
+                return True
+            if selected is None:
+                result = None
+        return result
+
+    def __str__(self) -> str:
+        """ Return this node as query text.
+        """
+        return '(' + ' OR '.join(str(c) for c in self.children) + ')'
+
+
+class Not(Node):
+    """ Select the calls not selected by <child>.
+    """
+    child: Node
+
+    def __init__(self, child: Node) -> None:
+        """ Negate the <child> node.
+        """
+        self.child = child
+
+    def bind(self, customers: list[Customer]) -> None:
+        """ Bind the child to <customers>.
+        """
+        self.child.bind(customers)
+
+    def matches(self, call: Call) -> bool:
+        """ Return whether <call> is not selected by the child.
+        """
+        return not self.child.matches(call)
+
+    def matches_sms(self, message: SMSMessage) -> Optional[bool]:
+        """ Return whether <message> is not selected by the child, or None
+        if the child does not apply to messages.
+        """
+        selected = self.child.matches_sms(message)
+        return None if selected is None else not selected
+
+    def __str__(self) -> str:
+        """ Return this node as query text.
+        """
+        return 'NOT ' + str(self.child)
+
+
+class CallIndex:
+    """ An index that finds the calls matching some kinds of predicates
+    without looking at every call.
+
+    This is an abstract class. Only subclasses should be instantiated.
+
+    === Public Attributes ===
+    kinds:
+        the kinds of predicates this index can answer
+    """
+    kinds: tuple[str, ...]
+
+    def exists(self) -> bool:
+        """ Return whether this index is ready to be looked up, rather than
+        having to be made for the query first.
+        """
+        return True
+
+    def estimate(self, predicate: Predicate) -> Optional[int]:
+        """ Return (an estimate of) the number of calls matching <predicate>,
+        or None if it is estimated from a sample of the calls instead.
+        """
+        raise NotImplementedError
+
+    def lookup(self, predicate: Predicate) -> list[Call]:
+        """ Return all the calls of the dataset matching <predicate>, each
+        once.
+        """
+        raise NotImplementedError
+
+
+class CustomerIndex(CallIndex):
+    """ Answer customer predicates from the call histories of the customers.
+    """
+    kinds = ('customer',)
+    _by_id: dict[int, Customer]
+
+    def __init__(self, customers: list[Customer]) -> None:
+        """ Create an index over the histories of <customers>.
+        """
+        self._by_id = {c.get_id(): c for c in customers}
+
+    def estimate(self, predicate: CustomerPredicate) -> int:
+        """ Return the number of calls in the history of the customer.
+        """
+        customer = self._by_id.get(predicate.cid)
+        if customer is None:
+            return 0
+        total = 0
+        for history in customer.get_call_history():
+            for calls in list(history.outgoing_calls.values()):
+                total += len(calls)
+            for calls in list(history.incoming_calls.values()):
+                total += len(calls)
+        return total
+
+    def lookup(self, predicate: CustomerPredicate) -> list[Call]:
+        """ Return the calls made or received by the customer.
+        """
+        customer = self._by_id.get(predicate.cid)
+        if customer is None:
+            return []
+        outgoing, incoming = customer.get_history()
+        return _unique(outgoing + incoming)
+
+
+class ChronologicalIndex(CallIndex):
+    """ Answer time predicates with a TimeIndex of the calls being queried,
+    or of the tracked calls they are a part of (see CallListIndex).
+
+    The index is only looked for the first time it is needed. The planner
+    only uses it if the index of the tracked calls was already made, and
+    estimates the calls matching a predicate from its sample.
+    """
+    kinds = ('time',)
+    _calls: list[Call]
+    _index: Optional[TimeIndex]
+    _within: Optional[set[int]]
+
+    def __init__(self, calls: list[Call]) -> None:
+        """ Create an index over <calls>.
+        """
+        self._calls = calls
+        self._index = None
+        self._within = None
+
+    def exists(self) -> bool:
+        """ Return whether the TimeIndex of the tracked calls was made, and
+        the calls being queried are a part of them.
+        """
+        if self._index is None:
+            found = TimeIndex.existing(self._calls)
+            if found is None:
+                return False
+            self._index, self._within = found
+        return True
+
+    def estimate(self, predicate: TimePredicate) -> None:
+        """ Return None: the calls matching <predicate> are estimated from a
+        sample.
+        """
+        return None
+
+    def lookup(self, predicate: TimePredicate) -> list[Call]:
+        """ Return the calls matching <predicate>, in chronological order.
+        """
+        begin, end = self._range(predicate)
+        calls = self._index.calls
+        if predicate.op == '!=':
+            calls = calls[:begin] + calls[end:]
+        else:
+            calls = calls[begin:end]
+        if self._within is None:
+            return calls
+        return [call for call in calls if id(call) in self._within]
+
+    def _range(self, predicate: TimePredicate) -> tuple[int, int]:
+        """ Return the first and one past the last position of the calls
+        matching <predicate> in the sorted calls, or of the calls not matching
+        it if the comparison of <predicate> is !=.
+        """
+        if self._index is None:
+            self._index, self._within = TimeIndex.for_calls(self._calls)
+        # Times are compared to the microsecond, so this is the first moment
+        # after <predicate.when>
+        after = predicate.when + datetime.timedelta(microseconds=1)
+        op = predicate.op
+        begin = 0
+        if op in ('=', '!=', '>='):
+            begin = self._index.position(predicate.when)
+        elif op == '>':
+            begin = self._index.position(after)
+        end = len(self._index.calls)
+        if op in ('=', '!=', '<='):
+            end = self._index.position(after)
+        elif op == '<':
+            end = self._index.position(predicate.when)
+        return begin, end
+
+
+class PhoneNumberIndex(CallIndex):
+    """ Answer number predicates with a NumberIndex of the calls being
+    queried, or of the tracked calls they are a part of (see
+    CallListIndex).
+
+    The index is only looked for the first time it is needed. The planner
+    only uses it if the index of the tracked calls was already made, and
+    estimates the calls matching a predicate from its sample.
+    """
+    kinds = ('number',)
+    _calls: list[Call]
+    _index: Optional[NumberIndex]
+    _within: Optional[set[int]]
+
+    def __init__(self, calls: list[Call]) -> None:
+        """ Create an index over <calls>.
+        """
+        self._calls = calls
+        self._index = None
+        self._within = None
+
+    def exists(self) -> bool:
+        """ Return whether the NumberIndex of the tracked calls was made, and
+        the calls being queried are a part of them.
+        """
+        if self._index is None:
+            found = NumberIndex.existing(self._calls)
+            if found is None:
+                return False
+            self._index, self._within = found
+        return True
+
+    def estimate(self, predicate: NumberPredicate) -> None:
+        """ Return None: the calls matching <predicate> are estimated from a
+        sample.
+        """
+        return None
+
+    def lookup(self, predicate: NumberPredicate) -> list[Call]:
+        """ Return the calls matching <predicate>.
+        """
+        if self._index is None:
+            self._index, self._within = NumberIndex.for_calls(self._calls)
+        calls = self._index.lookup(predicate.number, predicate.prefix)
+        if self._within is None:
+            return calls
+        return [call for call in calls if id(call) in self._within]
+
+
+class Plan:
+    """ The way a query is run on a list of calls.
+
+    === Public Attributes ===
+    index:
+        the index producing the candidate calls, or None to test every call
+    index_predicate:
+        the predicate answered by <index>, or None
+    residual:
+        the nodes tested on each candidate, in the order they are tested
+    estimates:
+        estimated fraction of the calls selected by each part of the query
+    """
+    index: Optional[CallIndex]
+    index_predicate: Optional[Predicate]
+    residual: list[Node]
+    estimates: dict[str, float]
+    # === Private Attributes ===
+    # _data:
+    #     the calls the query is run on
+    # _universe:
+    #     whether <_data> is known to contain every call of the dataset
+    _data: list[Call]
+    _universe: bool
+
+    def __init__(self, data: list[Call], universe: bool,
+                 index: Optional[CallIndex],
+                 index_predicate: Optional[Predicate],
+                 residual: list[Node], estimates: dict[str, float]) -> None:
+        """ Create a plan to run a query on <data>.
+        """
+        self._data = data
+        self._universe = universe
+        self.index = index
+        self.index_predicate = index_predicate
+        self.residual = residual
+        self.estimates = estimates
+
+    def execute(self) -> list[Call]:
+        """ Return the calls selected by the query.
+        """
+        if self.index is None:
+            candidates = self._data
+        else:
+            candidates = self.index.lookup(self.index_predicate)
+            if not self._universe:
+                allowed = {id(c) for c in self._data}
+                candidates = [c for c in candidates if id(c) in allowed]
+
+        token = cancel.current()
+        if token is None:
+            return self._test(candidates)
+        # Test the candidates a slice at a time, to stop when told to
+        selected = []
+        for start in range(0, len(candidates), cancel.CHECK_INTERVAL):
+            if token.is_stopped():
+                return cancel.partial(token, selected, self._data, start,
+                                      len(candidates))
+            selected.extend(self._test(
+                candidates[start:start + cancel.CHECK_INTERVAL]))
+        return selected
+
+    def _test(self, candidates: list[Call]) -> list[Call]:
+        """ Return the calls from <candidates> matching every residual node.
+        """
+        residual = self.residual
+        if not residual:
+            return list(candidates)
+        if len(residual) == 1:
+            matches = residual[0].matches
+            return [c for c in candidates if matches(c)]
+        return [c for c in candidates
+                if all(node.matches(c) for node in residual)]
+
+    def explain(self) -> str:
+        """ Return a description of this plan.
+        """
+        lines = []
+        if self.index is None:
+            lines.append('scan all calls')
+        else:
+            lines.append('index ' + type(self.index).__name__ + ' on '
+                         + str(self.index_predicate))
+        for node in self.residual:
+            lines.append('  then test ' + str(node) + ' (~%.0f%%)'
+                         % (100 * self.estimates.get(str(node), 1)))
+        return '\n'.join(lines)
+
+
+class Query:
+    """ A parsed query.
+
+    === Public Attributes ===
+    text:
+        the text of the query
+    root:
+        the parsed query
+    """
+    text: str
+    root: Node
+
+    def __init__(self, text: str) -> None:
+        """ Parse the query <text>. Raise QueryError if it is invalid.
+        """
+        self.text = text
+        self.root = _Parser(text).parse()
+
+    def plan(self, customers: list[Customer], data: list[Call],
+             indexes: Optional[list[CallIndex]] = None,
+             universe: bool = False) -> Plan:
+        """ Return a plan to run this query on <data>, using <indexes> (by
+        default, a CustomerIndex on <customers>).
+
+        If <universe> is True, <data> contains every call of the dataset, so
+        the results of an index do not need to be checked against <data>.
+        """
+        self.root.bind(customers)
+        if indexes is None:
+            indexes = [CustomerIndex(customers)]
+        conjuncts = self.root.children if isinstance(self.root, And) \
+            and not isinstance(self.root, Or) else [self.root]
+
+        sample = _sample(data)
+        estimates = {}
+        best = None
+        for node in conjuncts:
+            estimates[str(node)] = _sample_selectivity(node, sample)
+            if not isinstance(node, Predicate):
+                continue
+            for index in indexes:
+                # An index that is not made yet costs more to make than
+                # looking at every call
+                if node.kind not in index.kinds or not index.exists():
+                    continue
+                size = index.estimate(node)
+                if size is None:
+                    size = estimates[str(node)] * len(data)
+                else:
+                    estimates[str(node)] = size / max(len(data), 1)
+                if best is None or size < best[0]:
+                    best = (size, index, node)
+
+        # An index is only worth it if it avoids looking at most calls.
+        if best is not None and best[0] > len(data) / 2:
+            best = None
+        residual = [n for n in conjuncts if best is None or n is not best[2]]
+        residual.sort(key=lambda n: estimates[str(n)])
+        _order_children(residual, sample)
+        if best is None:
+            return Plan(data, universe, None, None, residual, estimates)
+        return Plan(data, universe, best[1], best[2], residual, estimates)
+
+    def run(self, customers: list[Customer], data: list[Call],
+            indexes: Optional[list[CallIndex]] = None,
+            universe: bool = False) -> list[Call]:
+        """ Return the calls from <data> selected by this query.
+        """
+        return self.plan(customers, data, indexes, universe).execute()
+
+
+class QueryFilter(Filter):
+    """ A filter selecting calls with a query (see the module description).
+
+    === Public Attributes ===
+    indexes:
+        indexes available to the planner, besides the histories of the
+        customers
+    """
+    indexes: list[CallIndex]
+
+    def __init__(self, indexes: Optional[list[CallIndex]] = None) -> None:
+        """ Create a new query filter, which can use <indexes>.
+        """
+        Filter.__init__(self)
+        self.indexes = indexes if indexes is not None else []
+
+    @observe_filter
+    @traced
+    def apply(self, customers: list[Customer],
+              data: list[Call],
+              filter_string: str) \
+            -> list[Call]:
+        """ Return the calls from <data> selected by the query in
+        <filter_string>, or <data> if the query is invalid.
+        """
+        try:
+            query = Query(filter_string)
+        except QueryError:
+            return data
+        try:
+            return query.run(customers, data,
+                             [CustomerIndex(customers),
+                              ChronologicalIndex(data),
+                              PhoneNumberIndex(data)] + self.indexes)
+        except cancel.Cancelled:
+            # stopped while an index was made or looked up
+            return cancel.partial(cancel.current(), [], data, 0)
+
+    def matcher(self, customers: list[Customer], filter_string: str) \
+            -> Optional[Callable[[Call], bool]]:
+        """ Return a function telling whether a call is selected by the
+        query in <filter_string>, or None if it is invalid.
+        """
+        try:
+            query = Query(filter_string)
+        except QueryError:
+            return None
+        query.root.bind(customers)
+        return query.root.matches
+
+    def apply_sms(self, customers: list[Customer], messages: SMSStore,
+                  positions: Sequence[int], filter_string: str) \
+            -> Sequence[int]:
+        """ Return the positions from <positions> of the messages selected
+        by the query in <filter_string>, or <positions> if it is invalid.
+
+        Predicates on durations do not apply to messages, like the duration
+        filter: a message is only left out if the query is false for it
+        whatever its duration would be.
+        """
+        try:
+            query = Query(filter_string)
+        except QueryError:
+            return positions
+        query.root.bind(customers)
+        root = query.root
+        return array('I', [i for i in positions if root.matches_sms(
+            SMSMessage(messages, i)) is not False])
+
+    def scans_calls(self) -> bool:
+        """ Return False: the candidate calls are found with
+        indexes of the whole list.
+        """
+        return False
+
+    def __str__(self) -> str:
+        """ Return a description of this filter to be displayed in the UI menu
+        """
+        return "Filter calls with a query, e.g. duration > 60 AND " \
+               "(customer = 5555 OR NOT location IN (-79.6, 43.6, -79.3, " \
+               "43.7))"
+
+
+class _Parser:
+    """ A recursive descent parser for queries.
+    """
+    _tokens: list[tuple[str, Any]]
+    _position: int
+
+    def __init__(self, text: str) -> None:
+        """ Split <text> into tokens.
+        """
+        self._tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = _TOKEN.match(text, position)
+            if match is None or match.end() == position:
+                raise QueryError("unexpected character at " + str(position))
+            number, dquoted, squoted, symbol, word = match.groups()
+            if number is not None:
+                self._tokens.append(('number', number))
+            elif dquoted is not None or squoted is not None:
+                self._tokens.append(('string', dquoted if dquoted is not None
+                                     else squoted))
+            elif symbol is not None:
+                self._tokens.append(('symbol', symbol))
+            else:
+                self._tokens.append(('word', word.lower()))
+            position = match.end()
+        self._position = 0
+
+    def parse(self) -> Node:
+        """ Return the parsed query.
+        """
+        node = self._or()
+        if self._position != len(self._tokens):
+            raise QueryError("unexpected " + str(self._peek()[1]))
+        return node
+
+    def _or(self) -> Node:
+        """ Parse: and_expr ('OR' and_expr)*
+        """
+        children = [self._and()]
+        while self._accept('word', 'or'):
+            children.append(self._and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def _and(self) -> Node:
+        """ Parse: not_expr ('AND' not_expr)*
+        """
+        children = [self._not()]
+        while self._accept('word', 'and'):
+            children.append(self._not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def _not(self) -> Node:
+        """ Parse: 'NOT' not_expr | '(' or_expr ')' | predicate
+        """
+        if self._accept('word', 'not'):
+            return Not(self._not())
+        if self._accept('symbol', '('):
+            node = self._or()
+            self._expect('symbol', ')')
+            return node
+        return self._predicate()
+
+    def _predicate(self) -> Predicate:
+        """ Parse a single predicate.
+        """
+        field = self._expect('word')
+        if field == 'duration':
+            op = self._expect('symbol')
+            return DurationPredicate(_check_op(op), self._number())
+        if field == 'customer':
+            self._expect('symbol', '=')
+            cid = self._number()
+            if not isinstance(cid, int):
+                raise QueryError("customer ids are whole numbers")
+            return CustomerPredicate(cid)
+        if field == 'location':
+            self._expect('word', 'in')
+            self._expect('symbol', '(')
+            bounds = [self._number()]
+            for _ in range(3):
+                self._expect('symbol', ',')
+                bounds.append(self._number())
+            self._expect('symbol', ')')
+            if not (bounds[0] <= bounds[2] and bounds[1] <= bounds[3]):
+                raise QueryError("the lower corner must come first")
+            return LocationPredicate((bounds[0], bounds[1],
+                                      bounds[2], bounds[3]))
+        if field == 'time':
+            op = _check_op(self._expect('symbol'))
+            return TimePredicate(op, parse_time(self._expect('string')))
+        if field == 'number':
+            self._expect('symbol', '=')
+            number = self._expect('string').strip()
+            prefix = number.endswith('*')
+            if prefix:
+                number = number[:-1]
+            if not number:
+                raise QueryError("empty number")
+            return NumberPredicate(number, prefix)
+        raise QueryError("unknown field " + field)
+
+    def _number(self) -> float:
+        """ Parse a number.
+        """
+        text = self._expect('number')
+        return float(text) if '.' in text else int(text)
+
+    def _peek(self) -> tuple[str, Any]:
+        """ Return the next token, without consuming it.
+        """
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return 'end', 'end of query'
+
+    def _accept(self, kind: str, value: Optional[str] = None) -> bool:
+        """ Consume the next token and return True if it is of <kind> (and
+        has <value>, if given), otherwise return False.
+        """
+        token = self._peek()
+        if token[0] == kind and (value is None or token[1] == value):
+            self._position += 1
+            return True
+        return False
+
+    def _expect(self, kind: str, value: Optional[str] = None) -> Any:
+        """ Consume and return the value of the next token, which must be of
+        <kind> (and have <value>, if given). Raise QueryError otherwise.
+        """
+        token = self._peek()
+        if not self._accept(kind, value):
+            raise QueryError("expected " + (value or kind) + " but found "
+                             + str(token[1]))
+        return token[1]
+
+
+def parse_time(text: str) -> datetime.datetime:
+    """ Return the date and time in <text>, in one of the TIME_FORMATS.
+    Raise QueryError if it is not a valid date.
+    """
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(text.strip(), time_format)
+        except ValueError:
+            pass
+    raise QueryError("invalid date " + text)
+
+
+def _check_op(op: str) -> str:
+    """ Return <op> if it is a comparison, otherwise raise QueryError.
+    """
+    if op not in _COMPARISONS:
+        raise QueryError("expected a comparison but found " + op)
+    return op
+
+
+def _sample(data: list[Call]) -> list[Call]:
+    """ Return up to SAMPLE_SIZE calls evenly spread over <data>.
+    """
+    if len(data) <= SAMPLE_SIZE:
+        return data
+    step = len(data) / SAMPLE_SIZE
+    return [data[int(i * step)] for i in range(SAMPLE_SIZE)]
+
+
+def _sample_selectivity(node: Node, sample: list[Call]) -> float:
+    """ Return the fraction of the calls in <sample> selected by <node>.
+    """
+    if not sample:
+        return 1.0
+    # Laplace smoothing, so that nothing is estimated to be impossible
+    return (sum(1 for c in sample if node.matches(c)) + 1) / (len(sample) + 2)
+
+
+def _order_children(nodes: list[Node], sample: list[Call]) -> None:
+    """ Reorder the children of the AND and OR nodes in <nodes>, so that the
+    children most likely to decide the result are tested first.
+    """
+    for node in nodes:
+        if isinstance(node, Not):
+            _order_children([node.child], sample)
+        elif isinstance(node, And):
+            _order_children(node.children, sample)
+            selectivity = {id(c): _sample_selectivity(c, sample)
+                           for c in node.children}
+            node.children.sort(key=lambda c: selectivity[id(c)],
+                               reverse=isinstance(node, Or))
+
+
+def _unique(calls: list[Call]) -> list[Call]:
+    """ Return <calls> without duplicates, in order.
+    """
+    seen = set()
+    result = []
+    for call in calls:
+        if id(call) not in seen:
+            seen.add(id(call))
+            result.append(call)
+    return result
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'datetime', 're', 'array', 'cancel',
+            'call', 'customer', 'filter', 'metrics', 'numbertable', 'sms',
+            'tracing'
+        ],
+        'disable': ['R0902', 'R0913'],
+        'generated-members': 'pygame.*'
+    })
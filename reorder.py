@@ -0,0 +1,172 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the ReorderBuffer class, which puts the events of a
+slightly disordered feed back in chronological order before they are
+billed.
+
+Events are processed in order: new_month() is called whenever the month of
+an event differs from the month of the previous one, so an event that
+arrives after events of a later month would start the months over and be
+billed to the wrong bill. A reorder buffer holds events in a min-heap by
+time, and releases them once the watermark (the latest time seen, minus the
+lateness allowed) has passed them. Events earlier than the watermark when
+they arrive can no longer be put in order: they are counted and kept in a
+side channel (<late>) instead of being billed.
+
+An event waits in the buffer for at most <lateness> seconds of event time,
+and at most <max_pending> events are buffered: when there are more, the
+earliest one is released early and the watermark moves up to it.
+"""
+import datetime
+import heapq
+from typing import Iterable, Iterator, Optional
+
+import metrics
+
+# Default number of seconds an event may arrive after later events
+DEFAULT_LATENESS = 60.0
+
+# Default largest number of events waiting in a buffer
+DEFAULT_MAX_PENDING = 100000
+
+
+class ReorderBuffer:
+    """ Releases the events given to it in chronological order, within a
+    bounded lateness.
+
+    === Public Attributes ===
+    lateness:
+        the number of seconds an event may arrive after a later event and
+        still be released in order
+    max_pending:
+        the largest number of events waiting in this buffer
+    late:
+        the events that arrived too late to be released in order, in the
+        order they arrived; they may be removed by the caller
+    late_count:
+        the number of events that arrived too late so far
+    """
+    lateness: float
+    max_pending: int
+    late: list[dict]
+    late_count: int
+    # === Private Attributes ===
+    # _heap:
+    #     the events waiting, with their time and the number of events given
+    #     before them (so events at the same time keep their order)
+    # _count:
+    #     the number of events given so far
+    # _latest:
+    #     the latest time of the events given so far, or None
+    # _watermark:
+    #     the time before which events are late, or None before the first
+    #     event
+    _heap: list[tuple[datetime.datetime, int, dict]]
+    _count: int
+    _latest: Optional[datetime.datetime]
+    _watermark: Optional[datetime.datetime]
+
+    def __init__(self, lateness: float = DEFAULT_LATENESS,
+                 max_pending: int = DEFAULT_MAX_PENDING) -> None:
+        """ Create an empty buffer releasing events <lateness> seconds of
+        event time after the latest event, and holding at most <max_pending>
+        events.
+        """
+        self.lateness = lateness
+        self.max_pending = max_pending
+        self.late = []
+        self.late_count = 0
+        self._heap = []
+        self._count = 0
+        self._latest = None
+        self._watermark = None
+
+    def __len__(self) -> int:
+        """ Return the number of events waiting in this buffer.
+        """
+        return len(self._heap)
+
+    def watermark(self) -> Optional[datetime.datetime]:
+        """ Return the time before which new events are late, or None if no
+        event was given yet.
+        """
+        return self._watermark
+
+    def push(self, event: dict) -> list[dict]:
+        """ Add <event>, in the format of the events of the input dataset,
+        and return the events that can now be released, in chronological
+        order. A late event is added to <late> instead.
+
+        Records without a time (e.g. customer records) are released at once.
+
+        Raise ValueError if the time of <event> is not valid.
+        """
+        if 'time' not in event:
+            return [event]
+        when = datetime.datetime.fromisoformat(event['time'])
+        if self._watermark is not None and when < self._watermark:
+            self.late.append(event)
+            self.late_count += 1
+            if metrics.ENABLED:
+                metrics.REGISTRY.counter(
+                    'late_events_total',
+                    "Events that arrived too late to be put in order").inc()
+            return []
+        heapq.heappush(self._heap, (when, self._count, event))
+        self._count += 1
+        if self._latest is None or when > self._latest:
+            self._latest = when
+        watermark = self._latest - datetime.timedelta(seconds=self.lateness)
+        if self._watermark is None or watermark > self._watermark:
+            self._watermark = watermark
+        released = []
+        while self._heap and (self._heap[0][0] <= self._watermark
+                              or len(self._heap) > self.max_pending):
+            when, _, ready = heapq.heappop(self._heap)
+            # An event released early moves the watermark up to it
+            self._watermark = max(self._watermark, when)
+            released.append(ready)
+        return released
+
+    def flush(self) -> list[dict]:
+        """ Release all of the events waiting, in chronological order, e.g.
+        at the end of the feed.
+        """
+        released = []
+        while self._heap:
+            when, _, ready = heapq.heappop(self._heap)
+            self._watermark = max(self._watermark, when)
+            released.append(ready)
+        return released
+
+
+def reorder(events: Iterable[dict], buffer: ReorderBuffer) -> Iterator[dict]:
+    """ Yield <events> in chronological order, going through <buffer>, which
+    is flushed at the end. The late events are left in buffer.late.
+    """
+    for event in events:
+        yield from buffer.push(event)
+    yield from buffer.flush()
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'datetime', 'heapq', 'metrics'
+        ],
+        'generated-members': 'pygame.*'
+    })
@@ -11,14 +11,57 @@ any changes, are expressly prohibited.
 All of the files in this directory and all subdirectories are:
 Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
 """
+import bz2
 import datetime
+from array import array
+import gzip
+import io
+import json
+import lzma
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
 import pytest
 
-from application import create_customers, process_event_history
+import cancel
+import datafile
+import decoder
+import memreport
+import metrics
+import shards
+import storage
+import tracing
+
+from aggregate import Aggregator, Rollup, outgoing_calls, top_k
+from application import EventProcessor, create_customers, \
+    generate_bills, import_data, process_event_history
+from call import Call
 from customer import Customer
 from contract import TermContract, MTMContract, PrepaidContract
 from phoneline import PhoneLine
-from filter import DurationFilter, CustomerFilter, ResetFilter
+from filter import CallListIndex, DurationFilter, CustomerFilter, Filter, \
+    ResetFilter, LocationFilter, NumberFilter, NumberIndex, TimeFilter, \
+    TimeIndex, select_sms
+from generator import DatasetGenerator
+import jobs
+from jobs import FilterJob
+from livetail import LiveTail
+from storage import CallStore, SQLCustomerFilter, SQLDurationFilter, \
+    SQLLocationFilter, SQLNumberFilter, SQLResetFilter, StoreIndex
+from server import QueryServer
+from numbertable import NUMBERS
+import parallel
+from sms import SMSStore
+from standing import StandingQuery
+import history
+from history import FilterHistory
+from query import ChronologicalIndex, CustomerIndex, Query, QueryError, \
+    QueryFilter, TimePredicate
+from reorder import ReorderBuffer
 
 """
 This is a sample test file with a limited set of cases, which are similar in
@@ -170,6 +213,79 @@ def test_events() -> None:
     assert len(history[0].outgoing_calls) == 1
 
 
+def test_month_rollover() -> None:
+    """ Test that the first call of a month is billed in that month, even
+    when it is the first event of the history.
+    """
+    def call(when: str, duration: int) -> dict:
+        """ Return a call from the MTM line of test_dict at <when>.
+        """
+        return {"type": "call", "src_number": "273-8255",
+                "dst_number": "416-0000", "time": when,
+                "duration": duration,
+                "src_loc": [-79.42848154284123, 43.641401675960374],
+                "dst_loc": [-79.52745693913239, 43.750338501653374]}
+
+    log = {'customers': test_dict['customers'],
+           'events': [call("2018-01-05 10:00:00", 60),
+                      call("2018-02-01 00:00:00", 120),
+                      call("2018-02-10 10:00:00", 60)]}
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    assert customers[0].generate_bill(1, 2018)[2][1]['billed_mins'] == 1
+    assert customers[0].generate_bill(2, 2018)[2][1]['billed_mins'] == 3
+
+
+def test_number_ids() -> None:
+    """ Test that phone numbers get shared integer ids, used to find the
+    lines of calls, while the public APIs still use number strings.
+    """
+    customers = create_customers(test_dict)
+    process_event_history(test_dict, customers)
+    customer = customers[0]
+    line = customer.get_phone_lines()[0]
+    assert NUMBERS.number(line.number_id) == line.get_number()
+    assert NUMBERS.lookup(line.get_number()) == line.number_id
+    assert all(isinstance(n, str) for n in customer.get_phone_numbers())
+
+    call = Call(line.number, "".join(["999", "-0000"]),
+                datetime.datetime(2018, 1, 2), 10, (-79.5, 43.6),
+                (-79.4, 43.7))
+    assert call.src_id == line.number_id and call.src_number is line.number
+    assert call.dst_id == NUMBERS.lookup("999-0000")
+    customer.new_month(1, 2018)
+    customer.make_call(call)
+    assert call in line.get_monthly_history(1, 2018)[0]
+
+    assert line.get_number() in customer and "999-0000" not in customer
+    assert customer.cancel_phone_line("999-0000") is None
+    mtm = [l for l in customer.get_phone_lines()
+           if isinstance(l.contract, MTMContract)][0]
+    assert customer.cancel_phone_line(mtm.get_number()) is not None
+    assert mtm.get_number() not in customer
+    assert len(customer.get_phone_numbers()) == 2
+
+
+def test_compact_objects() -> None:
+    """ Test that calls, lines, bills and contracts have no __dict__, and that
+    the sprites of a call are only made when they are used.
+    """
+    customers = create_customers(test_dict)
+    process_event_history(test_dict, customers)
+    line = customers[0].get_phone_lines()[0]
+    call = customers[0].get_history()[0][0]
+    for obj in [call, line, line.contract, line.callhistory,
+                line.bills[(1, 2018)]]:
+        assert not hasattr(obj, '__dict__')
+    assert isinstance(call.src_loc, tuple) and len(call.src_loc) == 2
+    assert call._drawables is None and call._connection is None
+    sprites = call.get_drawables()
+    assert sprites is call.get_drawables() and len(sprites) == 2
+    assert sprites[0].get_position() == call.src_loc
+    assert call.get_connection().get_linelimits() == (call.src_loc,
+                                                      call.dst_loc)
+
+
 def test_contract_start_dates() -> None:
     """ Test the start dates of the contracts.
 
@@ -228,5 +344,1174 @@ def test_filters() -> None:
             assert len(result) == expected_return_lengths[i][j]
 
 
+def test_generator() -> None:
+    """ Test that a generated dataset is deterministic, ordered
+    chronologically, has no gap month and can be processed by the application.
+    """
+    generator = DatasetGenerator(seed=7, num_customers=20,
+                                 events_per_month=30, months=14)
+    out = io.StringIO()
+    generator.write(out)
+    again = io.StringIO()
+    DatasetGenerator(seed=7, num_customers=20, events_per_month=30,
+                     months=14).write(again)
+    assert out.getvalue() == again.getvalue()
+
+    log = json.loads(out.getvalue())
+    assert len(log['customers']) == 20
+    assert len(log['events']) == 30 * 14
+    times = [e['time'] for e in log['events']]
+    assert times == sorted(times)
+    assert len({t[:7] for t in times}) == 14
+
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    assert len(customers[0].generate_bill(2, 2019)[2]) > 0
+
+    lines = io.StringIO()
+    generator.write(lines, json_lines=True)
+    records = [json.loads(r) for r in lines.getvalue().splitlines()]
+    assert records[:20] == [dict(type='customer', **c)
+                            for c in log['customers']]
+    assert records[20:] == log['events']
+
+
+def test_shards(tmp_path) -> None:
+    """ Test that the events of several shards are merged chronologically,
+    with the same results as the whole dataset in a single file.
+    """
+    out = io.StringIO()
+    DatasetGenerator(seed=3, num_customers=15, events_per_month=40,
+                     months=4).write(out)
+    log = json.loads(out.getvalue())
+    customers = create_customers(log)
+    process_event_history(log, customers)
+
+    # Customers first in the first shard, the events spread over the shards,
+    # the last one in the format of dataset.json
+    paths = [str(tmp_path / name) for name in ['a.jsonl', 'b.jsonl',
+                                               'c.json']]
+    parts = [log['events'][i::3] for i in range(3)]
+    with open(paths[0], 'w') as f:
+        for record in [dict(type='customer', **c) for c in log['customers']] \
+                + parts[0]:
+            f.write(json.dumps(record) + '\n')
+    with open(paths[1], 'w') as f:
+        f.write(''.join(json.dumps(e) + '\n' for e in parts[1]))
+    with open(paths[2], 'w') as f:
+        json.dump({'events': parts[2], 'customers': []}, f)
+
+    merged = shards.import_shards(paths)
+    assert len(merged['customers']) == 15
+    sharded = create_customers(merged)
+    process_event_history(merged, sharded, release=True)
+    for a, b in zip(customers, sharded):
+        assert a.generate_bill(4, 2018) == b.generate_bill(4, 2018)
+        assert [c.time for c in a.get_history()[0]] == \
+            [c.time for c in b.get_history()[0]]
+
+    # Customers from a separate file
+    customers_path = str(tmp_path / 'customers.json')
+    with open(customers_path, 'w') as f:
+        json.dump({'customers': log['customers']}, f)
+    merged = shards.import_shards(paths[1:], customers_path)
+    assert merged['customers'] == log['customers']
+    assert list(merged['events']) == sorted(parts[1] + parts[2],
+                                            key=lambda e: e['time'])
+
+    with open(paths[1], 'w') as f:
+        f.write(''.join(json.dumps(e) + '\n' for e in reversed(parts[1])))
+    with pytest.raises(ValueError):
+        list(shards.merge_events(paths))
+
+
+def test_compressed_datasets(tmp_path) -> None:
+    """ Test that datasets compressed with gzip, bz2 or xz are read as they
+    are decompressed, recognized by their first bytes or their extension.
+    """
+    text = json.dumps(test_dict)
+    JSON = decoder.get_decoder('json')
+    lines = ''.join(json.dumps(e) + '\n' for e in test_dict['events'])
+    for module, extension, kind in [(gzip, '.gz', 'gzip'),
+                                    (bz2, '.bz2', 'bz2'),
+                                    (lzma, '.xz', 'xz')]:
+        path = str(tmp_path / ('dataset.json' + extension))
+        with module.open(path, 'wt') as f:
+            f.write(text)
+        assert datafile.compression(path) == kind
+        assert import_data(path, JSON) == test_dict
+
+        # Recognized by its first bytes, whatever its name
+        renamed = str(tmp_path / ('copy-' + kind + '.json'))
+        os.rename(path, renamed)
+        assert import_data(renamed, JSON) == test_dict
+
+        path = str(tmp_path / ('events.jsonl' + extension))
+        with module.open(path, 'wt') as f:
+            f.write(lines)
+        assert shards.is_json_lines(path)
+        assert list(shards.read_events(path)) == test_dict['events']
+        assert datafile.measure(path)['events'] == len(test_dict['events'])
+        assert datafile.measure(path)['text_bytes'] == len(lines)
+
+    path = str(tmp_path / 'plain.json')
+    with open(path, 'w') as f:
+        f.write(text)
+    assert datafile.compression(path) is None
+    assert import_data(path, JSON) == test_dict
+
+
+def test_decoders(tmp_path, monkeypatch) -> None:
+    """ Test that every decoder gives the same customers, calls, bills and
+    messages, and that the fast decoder keeps the events in typed columns.
+    """
+    def ingest(path: str, name: str) -> tuple:
+        """ Return the state of the dataset <path> read by the decoder
+        <name>, once it is processed.
+        """
+        log = import_data(path, decoder.get_decoder(name))
+        customers = create_customers(log)
+        messages = SMSStore()
+        process_event_history(log, customers, messages=messages,
+                              release=True)
+        bills = [cust.generate_bill(month, 2018)
+                 for cust in customers for month in range(1, 13)]
+        calls = [(c.src_number, c.dst_number, c.time, c.duration, c.src_loc,
+                  c.dst_loc) for cust in customers
+                 for calls in cust.get_history() for c in calls]
+        return (bills, calls, [messages.get(i) for i in range(len(messages))],
+                len(log['events']))
+
+    assert {'json', 'fast'} <= set(decoder.available_decoders())
+    with open('dataset.json') as f:
+        text = f.read()
+    columns = decoder.get_decoder('fast').loads(text)['events']
+    assert isinstance(columns, decoder.EventColumns)
+    assert list(columns) == json.loads(text)['events']
+
+    # Events of another shape (here, with reordered keys) are read by the
+    # json module instead
+    reordered = tmp_path / 'reordered.json'
+    reordered.write_text(json.dumps(
+        {'customers': test_dict['customers'],
+         'events': [dict(sorted(e.items())) for e in test_dict['events']]}))
+    assert isinstance(import_data(str(reordered), decoder.get_decoder(
+        'fast'))['events'], list)
+
+    for path in ('dataset.json', str(reordered)):
+        expected = ingest(path, 'json')
+        assert expected[0] and expected[1] and expected[2]
+        assert expected[3] == 0
+        for name in decoder.available_decoders():
+            assert ingest(path, name) == expected
+
+    assert decoder.parse_time('2018-01-05 09:00:00') == \
+        decoder.parse_time('2018-1-5 9:00:00') == \
+        datetime.datetime(2018, 1, 5, 9)
+    with pytest.raises(ValueError):
+        decoder.parse_time('2018-13-05 09:00:00')
+    monkeypatch.setenv('MEWBILE_DECODER', 'json')
+    assert decoder.get_decoder().name == 'json'
+    with pytest.raises(ValueError):
+        decoder.get_decoder('xml')
+
+
+def test_parallel(monkeypatch) -> None:
+    """ Test that billing the calls in worker processes gives the same bills,
+    call histories and messages as in a single process, including in months
+    in which a worker has no call, and that a worker that dies is noticed.
+    """
+    def ingest(log: dict, workers: int, histories: bool = True) -> tuple:
+        """ Return the state of the customers of <log> once its events are
+        processed with <workers> workers.
+        """
+        customers = create_customers(log)
+        messages = SMSStore()
+        if workers:
+            parallel.process_event_history(log, customers, messages=messages,
+                                           workers=workers,
+                                           histories=histories)
+        else:
+            process_event_history(log, customers, messages=messages)
+        bills = [cust.generate_bill(month, year) for cust in customers
+                 for year in (2018, 2019) for month in range(1, 13)]
+        calls = [(c.src_number, c.dst_number, c.time, c.duration)
+                 for cust in customers
+                 for calls in cust.get_history() for c in calls]
+        return bills, calls, [messages.get(i) for i in range(len(messages))]
+
+    out = io.StringIO()
+    DatasetGenerator(seed=3, num_customers=12, events_per_month=4,
+                     months=14).write(out)
+    with open('dataset.json') as f:
+        text = f.read()
+    for loads in (json.loads, decoder.get_decoder('fast').loads):
+        for log_text in (text, out.getvalue()):
+            expected = ingest(loads(log_text), 0)
+            assert ingest(loads(log_text), 3) == expected
+            bills, calls, messages = ingest(loads(log_text), 3, False)
+            assert bills == expected[0] and messages == expected[2]
+            assert calls == []
+
+    customers = json.loads(text)['customers']
+    groups = parallel.partition(create_customers({'customers': customers}), 3)
+    assert len(groups) == 3 and all(groups)
+    log = {'customers': customers,
+           'events': [dict(type='customer', **customers[0])]}
+    with pytest.raises(ValueError):
+        parallel.process_event_history(log, create_customers(log), workers=2)
+
+    # A worker killed before sending its bills is not waited for forever
+    monkeypatch.setattr(parallel, '_bill_group', _exit_worker)
+    monkeypatch.setattr(parallel, 'POLL_INTERVAL', 0.1)
+    with pytest.raises(RuntimeError):
+        parallel.process_event_history(json.loads(text),
+                                       create_customers(json.loads(text)),
+                                       workers=2)
+
+
+def test_metrics() -> None:
+    """ Test that ingestion, filters and billing are recorded when metrics
+    are enabled, and exported in the Prometheus format.
+    """
+    metrics.REGISTRY.clear()
+    metrics.enable()
+    try:
+        customers = create_customers(test_dict)
+        process_event_history(test_dict, customers)
+        calls = customers[0].get_history()[0]
+        DurationFilter().apply(customers, calls, "L50")
+        customers[0].generate_bill(1, 2018)
+
+        events = metrics.REGISTRY.counter('ingested_events_total')
+        assert events.get(type='call') == 3
+        assert events.get(type='sms') == 3
+        assert metrics.REGISTRY.histogram('month_rollover_seconds').get()[1] \
+            == 1
+        assert metrics.REGISTRY.gauge('filter_last_output_calls') \
+            .get(filter='DurationFilter') == 1
+        assert metrics.REGISTRY.counter('bills_generated_total').get() == 1
+
+        server = metrics.REGISTRY.serve(port=0)
+        try:
+            url = 'http://127.0.0.1:%d/metrics' % server.server_address[1]
+            with urllib.request.urlopen(url) as response:
+                text = response.read().decode()
+        finally:
+            server.shutdown()
+        assert 'ingested_events_total{type="call"} 3' in text
+        assert 'filter_seconds_count{filter="DurationFilter"} 1' in text
+    finally:
+        metrics.disable()
+        metrics.REGISTRY.clear()
+
+    DurationFilter().apply(customers, calls, "L50")
+    assert metrics.REGISTRY.snapshot() == {}
+
+
+def test_tracing(tmp_path) -> None:
+    """ Test that spans are recorded around event processing and filters,
+    written as Chrome trace-event JSON, and that only the last ones are kept.
+    """
+    tracing.clear()
+    tracing.enable()
+    try:
+        customers = create_customers(test_dict)
+        process_event_history(test_dict, customers)
+        with tracing.span('outer', step=1):
+            CustomerFilter().apply(customers, customers[0].get_history()[0],
+                                   "5555")
+    finally:
+        tracing.disable()
+
+    path = tmp_path / 'trace.json'
+    tracing.write(str(path))
+    tracing.clear()
+    events = json.loads(path.read_text())['traceEvents']
+    spans = {e['name']: e for e in events if e['ph'] == 'X'}
+    assert {'process_event_history', 'new_month', 'outer',
+            'CustomerFilter.apply'} <= set(spans)
+    outer, inner = spans['outer'], spans['CustomerFilter.apply']
+    assert outer['ts'] <= inner['ts']
+    assert inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert outer['tid'] == inner['tid'] and outer['args'] == {'step': 1}
+
+    # Only the last spans are kept
+    tracing.clear(3)
+    tracing.enable()
+    try:
+        for step in range(5):
+            with tracing.span('frame', step=step):
+                pass
+    finally:
+        tracing.disable()
+    assert [e['args']['step'] for e in tracing.get_events()] == [2, 3, 4]
+    tracing.clear(tracing.MAX_EVENTS)
+
+
+def test_memory_report(tmp_path) -> None:
+    """ Test that the memory report samples every stage of loading a dataset,
+    and attributes the objects made by each stage to their subsystem.
+    """
+    path = tmp_path / 'dataset.json'
+    path.write_text(json.dumps(test_dict))
+    report = memreport.run(str(path))
+    stages = {s['stage']: s for s in report.stages}
+    assert list(stages) == ['start', 'import', 'customers', 'events',
+                            'drawables']
+    assert all(s['traced'] > 0 and s['peak'] >= s['traced']
+               for s in report.stages)
+    assert stages['start']['bytes']['ingest'] == 0
+    assert stages['import']['bytes']['ingest'] > 0
+    assert stages['events']['bytes']['calls'] > \
+        stages['customers']['bytes']['calls']
+
+    def count(stage: str, subsystem: str, kind: str) -> int:
+        """ Return the number of <kind> objects of <subsystem> at <stage>.
+        """
+        return stages[stage]['objects'].get(subsystem, {}).get(kind, 0)
+
+    calls = count('events', 'calls', 'Call') - count('start', 'calls', 'Call')
+    assert calls == len([e for e in test_dict['events']
+                         if e['type'] == 'call'])
+    assert count('drawables', 'drawables', 'Drawable') - \
+        count('events', 'drawables', 'Drawable') == 3 * calls
+    assert stages['drawables']['bytes']['drawables'] > \
+        stages['events']['bytes']['drawables']
+    assert 'drawables:' in report.format()
+
+    path = tmp_path / 'memory.json'
+    report.write(str(path))
+    assert json.loads(path.read_text())[-1]['stage'] == 'drawables'
+
+
+def test_release_log(tmp_path, monkeypatch) -> None:
+    """ Test that the raw log can be released as it is processed, with the
+    same results, and that it is then not in memory after ingestion.
+    """
+    log = json.loads(json.dumps(test_dict))
+    customers = create_customers(log, release=True)
+    assert log['customers'] == []
+    process_event_history(log, customers, release=True)
+    assert log['events'] == []
+    kept = create_customers(test_dict)
+    process_event_history(test_dict, kept)
+    assert customers[0].generate_bill(1, 2018) == \
+        kept[0].generate_bill(1, 2018)
+
+    # A cancelled ingestion leaves the events it did not process, in order
+    monkeypatch.setattr(cancel, 'CHECK_INTERVAL', 2)
+    log = json.loads(json.dumps(test_dict))
+    customers = create_customers(log, release=True)
+    token = cancel.CancelToken()
+    token.cancel()
+    with cancel.activate(token), pytest.raises(cancel.Cancelled):
+        process_event_history(log, customers, release=True)
+    assert log['events'] == test_dict['events'][2:]
+
+    path = tmp_path / 'dataset.json'
+    path.write_text(json.dumps(test_dict))
+    released = memreport.run(str(path), drawables=False).stages[-1]
+    kept = memreport.run(str(path), drawables=False, keep_log=True).stages[-1]
+    assert released['bytes']['ingest'] == 0 < kept['bytes']['ingest']
+    assert released['traced'] < kept['traced']
+
+
+def test_sqlite_store(tmp_path) -> None:
+    """ Test that the SQL filters select the same calls as the in-memory
+    filters, and that the store restores customers, bills and SMS messages.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=3, num_customers=15,
+                                                events_per_month=60)))
+    customers = create_customers(log)
+    messages = SMSStore()
+    process_event_history(log, customers, messages=messages)
+    calls = ResetFilter().apply(customers, [], "")
+
+    path = str(tmp_path / 'calls.db')
+    store = CallStore(path)
+    store.save(customers, messages)
+    cases = [(DurationFilter(), SQLDurationFilter(store),
+              ["L120", "G30", "G999", "L0", "X12", ""]),
+             (CustomerFilter(), SQLCustomerFilter(store),
+              [str(customers[1].get_id()), "1", "abc"]),
+             (LocationFilter(), SQLLocationFilter(store),
+              ["-79.6, 43.6, -79.3, 43.7", "-79.7, 43.6, -79.3, 43.7"]),
+             (ResetFilter(), SQLResetFilter(store), [""])]
+    for memory, sql, strings in cases:
+        for s in strings:
+            expected = memory.apply(customers, calls[::2], s)
+            actual = sql.apply(customers, calls[::2], s)
+            if isinstance(memory, ResetFilter):
+                expected = memory.apply(customers, calls, s)
+            assert sorted(map(id, actual)) == sorted(map(id, expected))
+    store.close()
+
+    loaded_messages = SMSStore()
+    loaded = CallStore(path).load(loaded_messages)
+    assert [c.get_id() for c in loaded] == [c.get_id() for c in customers]
+    assert len(messages) > 0 and len(loaded_messages) == len(messages)
+    for i in messages.positions():
+        assert loaded_messages.get(i) == messages.get(i)
+    for old, new in zip(customers, loaded):
+        assert old.get_phone_numbers() == new.get_phone_numbers()
+        for old_line, new_line in zip(old.get_phone_lines(),
+                                      new.get_phone_lines()):
+            for month in range(1, 9):
+                assert old_line.callhistory.get_monthly_sms(month, 2018) == \
+                    new_line.callhistory.get_monthly_sms(month, 2018)
+        for month in range(1, 9):
+            assert old.generate_bill(month, 2018) == \
+                new.generate_bill(month, 2018)
+        assert [len(h) for h in old.get_history()] == \
+            [len(h) for h in new.get_history()]
+
+
+def test_sqlite_live_calls() -> None:
+    """ Test that the calls added to a store after it was saved (e.g. from
+    the live feed) are selected by the SQL filters and by a reset.
+    """
+    customers = create_customers(test_dict)
+    process_event_history(test_dict, customers)
+    store = CallStore()
+    store.save(customers)
+    standing = StandingQuery(customers, store.all_calls())
+    numbers = customers[0].get_phone_numbers()
+    durations = SQLDurationFilter(store)
+    standing.apply(durations, "G10")
+    new = [Call(numbers[0], numbers[1], datetime.datetime(2018, 1, 9),
+                seconds, (-79.5, 43.6), (-79.4, 43.7))
+           for seconds in [5, 500]]
+    assert standing.extend(store.add(new)) == new[1:]
+
+    calls = standing.apply(SQLNumberFilter(store), numbers[0])
+    assert new[1] in calls
+    assert SQLCustomerFilter(store).apply(
+        customers, new, str(customers[0].get_id())) == new
+    assert SQLLocationFilter(store).apply(
+        customers, new, "-79.6, 43.5, -79.45, 43.65") == new
+    assert StoreIndex(store).lookup(Query("duration > 400").root) == [new[1]]
+    everything = standing.apply(SQLResetFilter(store), "")
+    assert everything[-2:] == new
+    assert len(everything) == len(store.all_calls())
+    store.close()
+
+
+def test_query_server(monkeypatch) -> None:
+    """ Test the filter, bill and history endpoints of the query server,
+    including pagination from a single run of the filters.
+    """
+    customers = create_customers(test_dict)
+    process_event_history(test_dict, customers)
+    server = QueryServer(customers, workers=2)
+    server.start()
+    base = 'http://127.0.0.1:%d' % server.port
+
+    def get(path: str) -> dict:
+        """ Return the JSON answer of the server to <path>.
+        """
+        with urllib.request.urlopen(base + path) as response:
+            return json.loads(response.read())
+
+    try:
+        page = get('/filter?filter=duration:G10&limit=1&offset=1')
+        assert page['total'] == 2 and len(page['calls']) == 1
+        assert page['calls'][0]['duration'] == 50
+        page = get('/filter?filter=customer:5555&filter=duration:L50')
+        assert [c['duration'] for c in page['calls']] == [10]
+
+        # The next pages of a chain are not filtered again
+        applied = []
+        apply = DurationFilter.apply
+
+        def counted(*args: object) -> list[Call]:
+            """ Apply the duration filter, and count it.
+            """
+            applied.append(args)
+            return apply(*args)
+
+        monkeypatch.setattr(DurationFilter, 'apply', counted)
+        pages = [get('/filter?filter=duration:G5&limit=1&offset=%d' % i)
+                 for i in range(3)]
+        assert [p['calls'][0] for p in pages] == \
+            get('/filter?filter=duration:G5')['calls']
+        assert len(applied) == 1
+
+        bill = get('/bill?customer=5555&month=1&year=2018')
+        assert bill['total'] == pytest.approx(
+            customers[0].generate_bill(1, 2018)[1])
+        history = get('/history?customer=5555&direction=incoming')
+        assert history['total'] == 3
+        months = get('/aggregate?by=month&statistic=count')
+        assert [(g['key'], g['count']) for g in months['groups']] == \
+            [([[1, 2018]], 3)]
+
+        with pytest.raises(urllib.error.HTTPError) as error:
+            get('/bill?customer=1111&month=1&year=2018')
+        assert error.value.code == 404
+    finally:
+        server.stop()
+
+
+def test_query() -> None:
+    """ Test that queries select the same calls as the filters they combine,
+    with or without an index.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=4, num_customers=20,
+                                                events_per_month=80)))
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    calls = ResetFilter().apply(customers, [], "")
+    cid = customers[2].get_id()
+    text = "duration > 60 AND (customer = %d OR NOT location IN " \
+           "(-79.6, 43.6, -79.3, 43.7))" % cid
+
+    by_customer = CustomerFilter().apply(customers, calls, str(cid))
+    outside = [c for c in calls if c not in LocationFilter().apply(
+        customers, calls, "-79.6, 43.6, -79.3, 43.7")]
+    either = {id(c) for c in by_customer + outside}
+    expected = [c for c in calls if c.duration > 60 and id(c) in either]
+    assert QueryFilter().apply(customers, calls, text) == expected
+
+    plan = Query("customer = %d AND duration <= 120" % cid).plan(
+        customers, calls)
+    assert isinstance(plan.index, CustomerIndex)
+    assert plan.execute() == [c for c in by_customer if c.duration <= 120]
+
+    store = CallStore()
+    store.save(customers)
+    indexed = QueryFilter([StoreIndex(store)])
+    for query in [text, "duration > 500", "NOT duration > 500",
+                  "location IN (-79.6, 43.6, -79.5, 43.65)"]:
+        assert sorted(map(id, indexed.apply(customers, calls[::3], query))) \
+            == sorted(map(id, QueryFilter().apply(customers, calls[::3],
+                                                  query)))
+    assert QueryFilter().apply(customers, calls, "duration >") is calls
+
+    # Fractional durations are compared as they are, not truncated
+    assert QueryFilter().apply(customers, calls, "duration < 100.5") == \
+        [c for c in calls if c.duration <= 100]
+    assert QueryFilter().apply(customers, calls, "duration = 100.5") == []
+    assert indexed.apply(customers, calls, "duration < 100.5") == \
+        [c for c in calls if c.duration <= 100]
+    with pytest.raises(QueryError):
+        Query("customer = %d.5" % cid)
+
+
+def test_time_filter() -> None:
+    """ Test that the time filter selects the calls of a month, a day or a
+    range, and that time predicates of queries use its index.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=5, num_customers=10,
+                                                events_per_month=50)))
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    calls = ResetFilter().apply(customers, [], "")
+
+    def between(start: str, end: str) -> list[int]:
+        """ Return the ids of the calls from <start> to before <end>.
+        """
+        start = datetime.datetime.fromisoformat(start)
+        end = datetime.datetime.fromisoformat(end)
+        return sorted(id(c) for c in calls if start <= c.time < end)
+
+    cases = [("2018-02", between("2018-02-01", "2018-03-01")),
+             ("2018-03-05", between("2018-03-05", "2018-03-06")),
+             ("2018-01-10 18:00 to 2018-04-02",
+              between("2018-01-10 18:00", "2018-04-03")),
+             ("2018-12 to 2019-01", between("2018-12-01", "2019-02-01"))]
+    for filter_string, expected in cases:
+        selected = TimeFilter().apply(customers, calls, filter_string)
+        assert sorted(map(id, selected)) == expected
+        assert [c.time for c in selected] == sorted(c.time for c in selected)
+    for invalid in ["", "2018-13", "2018-03 to 2018-01", "a to b to c"]:
+        assert TimeFilter().apply(customers, calls, invalid) is calls
+
+    when = calls[len(calls) // 2].time
+    for op in ['<', '<=', '=', '!=', '>=', '>']:
+        predicate = TimePredicate(op, when)
+        query = QueryFilter().apply(customers, calls, str(predicate))
+        assert sorted(map(id, query)) == \
+            sorted(id(c) for c in calls if predicate.matches(c))
+
+    # The planner only uses the index of the tracked calls once it is made
+    CallListIndex.track(calls)
+    late = TimePredicate('>', sorted(c.time for c in calls)[-5])
+    some = calls[::2]
+    plan = Query(str(late)).plan(customers, some, [ChronologicalIndex(some)])
+    assert plan.index is None and TimeIndex.existing(calls) is None
+    TimeFilter().apply(customers, calls, "2018-02")
+    plan = Query(str(late)).plan(customers, some, [ChronologicalIndex(some)])
+    assert isinstance(plan.index, ChronologicalIndex)
+    assert sorted(map(id, plan.execute())) == \
+        sorted(id(c) for c in some if late.matches(c))
+
+
+def test_number_filter() -> None:
+    """ Test that the number filters select the calls of a number or of a
+    prefix, in the order of the data.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=6, num_customers=25,
+                                                events_per_month=60)))
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    calls = ResetFilter().apply(customers, [], "")[::2]
+    number = calls[0].dst_number
+    store = CallStore()
+    store.save(customers)
+
+    for filter_string, prefix in [(number, number), (number[:4] + "*",
+                                                     number[:4]),
+                                  (number[:1] + "*", number[:1]),
+                                  ("000-0000", "000-0000")]:
+        expected = [c for c in calls if c.src_number.startswith(prefix)
+                    or c.dst_number.startswith(prefix)]
+        assert NumberFilter().apply(customers, calls, filter_string) \
+            == expected
+        assert SQLNumberFilter(store).apply(customers, calls,
+                                            filter_string) == expected
+        query = 'number = "%s" AND duration >= 0' % filter_string
+        assert QueryFilter().apply(customers, calls, query) == expected
+    for invalid in ["", "*", "416 5555", "abc*"]:
+        assert NumberFilter().apply(customers, calls, invalid) is calls
+
+
+def test_aggregate() -> None:
+    """ Test that the rollups updated during processing give the same groups
+    as a pass over the calls, and the top groups.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=7, num_customers=20,
+                                                events_per_month=80)))
+    customers = create_customers(log)
+    rollup = Rollup(customers)
+    process_event_history(log, customers, [rollup.add_call])
+    calls = list(outgoing_calls(customers))
+    assert len(calls) == len(ResetFilter().apply(customers, [], ""))
+
+    aggregator = Aggregator(customers)
+    for by in [('month',), ('line', 'month'), ('contract', 'month'),
+               ('customer',), ('number',), ('month', 'number')]:
+        expected = aggregator.group(calls, by)
+        actual = rollup.group(by=by)
+        assert {k: v.get_summary() for k, v in actual.items()} == \
+            {k: v.get_summary() for k, v in expected.items()}
+    with pytest.raises(ValueError):
+        rollup.group(by=('line', 'number'))
+    with pytest.raises(ValueError):
+        aggregator.group(calls, ('colour',))
+
+    march = rollup.group(by=('line',), months=[(3, 2018)])
+    top = top_k(march, 3)
+    totals = sorted((s.total for s in march.values()), reverse=True)
+    assert [s.total for _, s in top] == totals[:3]
+    line = top[0][0][0]
+    durations = sorted(c.duration for c in calls if c.src_number == line
+                       and c.time.month == 3 and c.time.year == 2018)
+    assert top[0][1].percentile(50) == durations[(len(durations) - 1) // 2]
+    assert top[0][1].percentile(100) == durations[-1]
+
+
+def test_standing_query() -> None:
+    """ Test that calls processed after filters were applied are added to
+    the results only if they pass every filter.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=8, num_customers=20,
+                                                events_per_month=80)))
+    customers = create_customers(log)
+    half = len(log['events']) // 2
+    process_event_history({'events': log['events'][:half]}, customers)
+    standing = StandingQuery(customers,
+                             ResetFilter().apply(customers, [], ""))
+    chain = [(DurationFilter(), "G30"), (QueryFilter(), "duration < 500"),
+             (LocationFilter(), "-79.7, 43.58, -79.3, 43.75"),
+             (TimeFilter(), "2018-01-15 to 2018-12"),
+             (NumberFilter(), "1*"), (NumberFilter(), "bad")]
+    for f, filter_string in chain:
+        standing.apply(f, filter_string)
+    before = len(standing.results)
+
+    process_event_history({'events': log['events'][half:]}, customers,
+                          [standing.add_call])
+    expected = ResetFilter().apply(customers, [], "")
+    for f, filter_string in chain:
+        expected = f.apply(customers, expected, filter_string)
+    assert sorted(map(id, standing.results)) == sorted(map(id, expected))
+    assert len(standing.results) > before
+
+    standing.apply(ResetFilter(), "")
+    standing.add_call(expected[0])
+    assert standing.results[-1] is expected[0]
+
+
+def test_tracked_time_index(monkeypatch) -> None:
+    """ Test that the TimeIndex of the calls of a standing query is made
+    once, extended with new calls (even out of order), and answers the time
+    filters applied to any of the results.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=8, num_customers=20,
+                                                events_per_month=80)))
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    ordered = TimeIndex(ResetFilter().apply(customers, [], "")).calls
+    half = len(ordered) // 2
+    month = str(ordered[half].time)[:7]
+    start = datetime.datetime.strptime(month, "%Y-%m")
+    end = datetime.datetime(start.year + start.month // 12,
+                            start.month % 12 + 1, 1)
+    late = Call(ordered[0].src_number, ordered[0].dst_number,
+                start + datetime.timedelta(hours=1), 100, ordered[0].src_loc,
+                ordered[0].dst_loc)
+    with_late = TimeIndex(ordered + [late]).calls
+
+    def expected(calls: list[Call]) -> list[Call]:
+        """ Return the calls from <calls> longer than 60 seconds made in the
+        month, in chronological order.
+        """
+        return [c for c in calls
+                if c.duration > 60 and start <= c.time < end]
+
+    made = []
+    original = TimeIndex.__init__
+
+    def counted(self: TimeIndex, calls: list[Call]) -> None:
+        """ Count the indexes made, then make one of <calls>.
+        """
+        made.append(len(calls))
+        original(self, calls)
+
+    monkeypatch.setattr(TimeIndex, '__init__', counted)
+    standing = StandingQuery(customers, list(ordered[:half]))
+    standing.apply(DurationFilter(), "G60")
+    assert TimeFilter().apply(customers, standing.results, month) == \
+        expected(ordered[:half])
+    standing.extend(ordered[half:])
+    assert TimeFilter().apply(customers, standing.results, month) == \
+        expected(ordered)
+    standing.extend([late])
+    result = TimeFilter().apply(customers, standing.results, month)
+    assert late in result and result == expected(with_late)
+    assert made == [half]
+
+
+def test_tracked_number_index(monkeypatch) -> None:
+    """ Test that the NumberIndex of the calls of a standing query is made
+    once and extended with new calls, whose numbers are merged with the
+    others once there are enough of them.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=8, num_customers=20,
+                                                events_per_month=80)))
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    calls = ResetFilter().apply(customers, [], "")
+    prefix = calls[0].src_number[:5] + "*"
+    monkeypatch.setattr('filter.MERGE_MIN', 16)
+    made = []
+    original = NumberIndex.__init__
+
+    def counted(self: NumberIndex, calls: list[Call]) -> None:
+        """ Count the indexes made, then make one of <calls>.
+        """
+        made.append(len(calls))
+        original(self, calls)
+
+    monkeypatch.setattr(NumberIndex, '__init__', counted)
+    standing = StandingQuery(customers, list(calls[:100]))
+    standing.apply(DurationFilter(), "G60")
+    matches = NumberFilter().matcher(customers, prefix)
+    for end in [100, 103, 110, 140, len(calls)]:
+        standing.extend(calls[len(standing.calls):end])
+        expected = [c for c in calls[:end] if c.duration > 60 and matches(c)]
+        assert NumberFilter().apply(customers, standing.results,
+                                    prefix) == expected
+        index = NumberIndex.for_calls(standing.calls)[0]
+        assert index.count(prefix[:-1], True) == sum(
+            c.src_number.startswith(prefix[:-1])
+            + c.dst_number.startswith(prefix[:-1]) for c in calls[:end])
+    assert made == [100]
+
+
+def test_filter_history() -> None:
+    """ Test that filters can be undone, redone, edited and repeated from
+    the cache, also when results were evicted or new calls arrived.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=12, num_customers=20,
+                                                events_per_month=80)))
+    customers = create_customers(log)
+    half = len(log['events']) // 2
+    process_event_history({'events': log['events'][:half]}, customers)
+    chain = [(DurationFilter(), "G30"), (TimeFilter(), "2018-01 to 2018-06"),
+             (NumberFilter(), "1*")]
+
+    def expected(steps: list[tuple[Filter, str]]) -> list[int]:
+        """ Return the ids of the calls selected by <steps> from all calls.
+        """
+        calls = ResetFilter().apply(customers, [], "")
+        for f, filter_string in steps:
+            calls = f.apply(customers, calls, filter_string)
+        return sorted(map(id, calls))
+
+    for max_cached in (history.DEFAULT_MAX_CACHED, 1):
+        standing = StandingQuery(customers,
+                                 ResetFilter().apply(customers, [], ""))
+        steps = FilterHistory(standing, max_cached)
+        for f, filter_string in chain:
+            steps.push(f, filter_string,
+                       f.apply(customers, standing.results, filter_string))
+        assert sorted(map(id, steps.undo())) == expected(chain[:2])
+        assert sorted(map(id, steps.undo())) == expected(chain[:1])
+        assert sorted(map(id, steps.redo())) == expected(chain[:2])
+        assert steps.can_redo() and steps.steps() == chain[:2]
+        assert steps.lookup(NumberFilter(), "2*") is None
+        if max_cached > 1:
+            assert sorted(map(id, steps.lookup(*chain[2]))) == \
+                expected(chain)
+            assert not steps.can_redo()
+        else:
+            steps.redo()
+        edited = [(DurationFilter(), "G60")] + chain[1:]
+        assert sorted(map(id, steps.edit(0, "G60"))) == expected(edited)
+        assert sorted(map(id, steps.undo())) == expected(edited[:2])
+        assert sorted(map(id, steps.undo())) == expected(edited[:1])
+        assert steps.undo() is standing.calls
+        assert steps.undo() is None
+
+    steps.redo()
+    process_event_history({'events': log['events'][half:]}, customers,
+                          [standing.add_call])
+    assert sorted(map(id, steps.redo())) == expected(edited[:2])
+    assert sorted(map(id, steps.undo())) == expected(edited[:1])
+
+
+def test_sms_store() -> None:
+    """ Test that SMS messages are counted per line and month, and selected
+    by the customer, location, time, number and query filters like calls.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=13, num_customers=20,
+                                                events_per_month=80)))
+    customers = create_customers(log)
+    messages = SMSStore()
+    process_event_history(log, customers, None, messages)
+    sent = [e for e in log['events'] if e['type'] == 'sms']
+    assert len(messages) == len(sent) > 0
+    assert messages.get(3)['time'] == sent[3]['time']
+
+    line = customers[0].get_phone_lines()[0]
+    month = datetime.datetime.strptime(sent[0]['time'], "%Y-%m-%d %H:%M:%S")
+    assert line.get_call_history().get_monthly_sms(month.month, month.year) \
+        == (sum(1 for e in sent if e['src_number'] == line.number
+                and e['time'].startswith(sent[0]['time'][:7])),
+            sum(1 for e in sent if e['dst_number'] == line.number
+                and e['time'].startswith(sent[0]['time'][:7])))
+    assert sum(l.get_call_history().get_monthly_sms()[1]
+               for c in customers for l in c.get_phone_lines()) == len(sent)
+
+    customer = customers[1]
+    chain = [(DurationFilter(), "G60"), (CustomerFilter(),
+                                         str(customer.get_id())),
+             (TimeFilter(), "2018-01-15 to 2018-06"),
+             (LocationFilter(), "-79.6, 43.6, -79.3, 43.7")]
+    numbers = customer.get_phone_numbers()
+
+    def inside(loc: list[float]) -> bool:
+        """ Return whether <loc>, as stored, is in the area of the filter.
+        """
+        x, y = array('f', loc)
+        return -79.6 <= x <= -79.3 and 43.6 <= y <= 43.7
+
+    expected = [i for i, e in enumerate(sent)
+                if (e['src_number'] in numbers or e['dst_number'] in numbers)
+                and '2018-01-15' <= e['time'] < '2018-07'
+                and (inside(e['src_loc']) or inside(e['dst_loc']))]
+    assert expected
+    assert list(select_sms(customers, messages, chain)) == expected
+    assert list(select_sms(customers, messages, chain[:1])) == \
+        list(range(len(sent)))
+
+    # The number and query filters select messages too
+    number = sent[0]['src_number']
+    by_number = [i for i, e in enumerate(sent)
+                 if number in (e['src_number'], e['dst_number'])]
+    assert list(select_sms(customers, messages,
+                           [(NumberFilter(), number)])) == by_number
+    prefix = [i for i, e in enumerate(sent)
+              if e['src_number'].startswith(number[:3])
+              or e['dst_number'].startswith(number[:3])]
+    assert list(select_sms(customers, messages,
+                           [(NumberFilter(), number[:3] + "-*")])) == prefix
+    query = 'duration > 60 AND customer = %d AND time >= "2018-01-15" ' \
+            'AND time < "2018-07-01" AND location IN (-79.6, 43.6, -79.3, ' \
+            '43.7)' % customer.get_id()
+    assert list(select_sms(customers, messages,
+                           [(QueryFilter(), query)])) == expected
+    assert list(select_sms(customers, messages, [(
+        QueryFilter(), 'number = "%s"' % number)])) == by_number
+
+
+def test_live_tail(tmp_path) -> None:
+    """ Test that events appended to a JSON Lines file, even a line at a
+    time, are billed in the background as if processed all at once, and
+    not while the lock of the tail is held.
+    """
+    out = io.StringIO()
+    DatasetGenerator(seed=9, num_customers=10, events_per_month=40,
+                     months=3).write(out, json_lines=True)
+    lines = out.getvalue().splitlines(keepends=True)
+    path = tmp_path / 'events.jsonl'
+    path.write_text(''.join(lines[:len(lines) // 2]))
+
+    customers = []
+    received = []
+    lock = threading.RLock()
+    tail = LiveTail(str(path), EventProcessor(customers), received.extend,
+                    batch_size=16, max_pending=2, lock=lock)
+    with lock:
+        # Nothing is billed while a reader holds the lock
+        tail.start()
+        time.sleep(0.3)
+        assert tail.stats()['events'] == 0 and not customers
+    with open(path, 'a') as f:
+        for line in lines[len(lines) // 2:]:
+            f.write(line[:10])
+            f.flush()
+            f.write(line[10:] if line.strip() else '')
+        f.write('not json\n')
+    try:
+        deadline = time.time() + 10
+        # every line is billed, or counted as an error
+        while tail.stats()['events'] + tail.stats()['errors'] <= len(lines) \
+                and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        tail.stop()
+    assert tail.stats()['errors'] == 1
+
+    log = json.loads(_generate(DatasetGenerator(seed=9, num_customers=10,
+                                                events_per_month=40,
+                                                months=3)))
+    expected = create_customers(log)
+    process_event_history(log, expected)
+    assert len(received) == len(ResetFilter().apply(expected, [], ""))
+    for old, new in zip(expected, customers):
+        for month in range(1, 4):
+            assert old.generate_bill(month, 2018) == \
+                new.generate_bill(month, 2018)
+
+
+def test_reorder_buffer() -> None:
+    """ Test that events out of order by less than the lateness are billed
+    as if they were in order, and that later events are set aside.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=4, num_customers=10,
+                                                events_per_month=40,
+                                                months=3)))
+    expected = create_customers(log)
+    process_event_history(log, expected)
+
+    events = log['events'][:]
+    for i in range(0, len(events) - 1, 2):
+        events[i], events[i + 1] = events[i + 1], events[i]
+    # A call of January arriving at the end of March
+    too_late = [e for e in events if e['type'] == 'call'][0]
+    events.remove(too_late)
+    events.append(too_late)
+    lateness = max((datetime.datetime.fromisoformat(b['time']) -
+                    datetime.datetime.fromisoformat(a['time'])).total_seconds()
+                   for a, b in zip(events, events[1:]))
+    buffer = ReorderBuffer(lateness)
+    customers = create_customers(log)
+    process_event_history({'events': events}, customers,
+                          reorder_buffer=buffer)
+    assert buffer.late == [too_late] and buffer.late_count == 1
+    assert len(buffer) == 0
+
+    kept = create_customers(log)
+    process_event_history({'events': [e for e in log['events']
+                                      if e is not too_late]}, kept)
+    for old, new in zip(kept, customers):
+        for month in range(1, 4):
+            assert old.generate_bill(month, 2018) == \
+                new.generate_bill(month, 2018)
+    assert any(old.generate_bill(1, 2018) != new.generate_bill(1, 2018)
+               for old, new in zip(expected, customers))
+
+    # At most max_pending events wait, however large the lateness
+    buffer = ReorderBuffer(lateness=3600, max_pending=2)
+    times = ["2018-01-01 00:00:0" + str(i) for i in range(4)]
+    assert buffer.push({'type': 'customer'}) == [{'type': 'customer'}]
+    assert buffer.push({'time': times[1]}) == []
+    assert buffer.push({'time': times[0]}) == []
+    assert buffer.push({'time': times[3]}) == [{'time': times[0]}]
+    assert buffer.push({'time': times[0]}) == [{'time': times[0]}]
+    assert buffer.push({'time': "2017-12-31 23:59:59"}) == []
+    assert buffer.late_count == 1
+    assert buffer.flush() == [{'time': times[1]}, {'time': times[3]}]
+
+
+def test_filter_job(monkeypatch) -> None:
+    """ Test that a filter job gives the result of the filter in chunks,
+    can be cancelled, and that calls added while it runs are not lost.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=10, num_customers=15,
+                                                events_per_month=60)))
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    calls = ResetFilter().apply(customers, [], "")
+    monkeypatch.setattr(jobs, 'CHUNK_SIZE', 50)
+
+    standing = StandingQuery(customers, list(calls[:-10]))
+    job = FilterJob(DurationFilter(), customers, standing.results, "G60")
+    job.start()
+    assert job.wait(10) and job.progress() == 1.0
+    standing.extend(calls[-10:])
+    standing.register(job.f, job.filter_string, job.result, job.data,
+                      job.seen)
+    assert standing.results == DurationFilter().apply(customers, calls,
+                                                      "G60")
+
+    # Indexed filters are applied to the whole list, whose index is reused
+    month = str(calls[0].time)[:7]
+    indexes = []
+    for _ in range(2):
+        job = FilterJob(TimeFilter(), customers, calls, month)
+        job.start()
+        assert job.wait(10)
+        assert job.result == TimeFilter().apply(customers, calls, month)
+        indexes.append(TimeIndex.for_calls(calls)[0])
+    assert indexes[0] is indexes[1]
+    data = list(calls[:-10])
+    job = FilterJob(TimeFilter(), customers, data, month)
+    data.extend(calls[-10:])
+    job.start()
+    assert job.wait(10) and job.result == TimeFilter().apply(
+        customers, calls[:-10], month)
+
+    release = threading.Event()
+
+    class SlowFilter(DurationFilter):
+        """ A duration filter that waits for <release> on each chunk.
+        """
+        def apply(self, customers: list[Customer], data: list[Call],
+                  filter_string: str) -> list[Call]:
+            """ Wait, then filter <data>.
+            """
+            release.wait(10)
+            return DurationFilter.apply(self, customers, data, filter_string)
+
+    job = FilterJob(SlowFilter(), customers, calls, "G60")
+    job.start()
+    job.cancel()
+    release.set()
+    assert job.wait(10) and job.is_cancelled() and job.result is None
+
+    # Only a reset waits for the lock, e.g. while a batch is billed
+    lock = threading.RLock()
+    with lock:
+        job = FilterJob(DurationFilter(), customers, calls, "G60",
+                        lock=lock)
+        job.start()
+        assert job.wait(10) and job.result == DurationFilter().apply(
+            customers, calls, "G60")
+        job = FilterJob(ResetFilter(), customers, [], "", lock=lock)
+        job.start()
+        assert not job.wait(0.2)
+    assert job.wait(10) and job.result == calls
+
+
+def test_cancellation(monkeypatch) -> None:
+    """ Test that filters, billing and ingestion stop early when their token
+    is cancelled or their budget runs out, and that the result is flagged.
+    """
+    log = json.loads(_generate(DatasetGenerator(seed=11, num_customers=15,
+                                                events_per_month=60)))
+    customers = create_customers(log)
+    process_event_history(log, customers)
+    calls = ResetFilter().apply(customers, [], "")
+    monkeypatch.setattr(cancel, 'CHECK_INTERVAL', 10)
+
+    assert cancel.is_complete(DurationFilter().apply(customers, calls, "G0"))
+    token = cancel.CancelToken()
+    token.cancel()
+    store = CallStore()
+    store.save(customers)
+    monkeypatch.setattr(storage, 'PROGRESS_STEPS', 10)
+    with cancel.activate(token), pytest.raises(cancel.Cancelled):
+        # SQLite interrupts the query
+        store.count('SELECT COUNT(*) FROM calls WHERE duration >= 0')
+    for f, filter_string in ((DurationFilter(), "G0"),
+                             (LocationFilter(), "-79.6, 43.6, -79.3, 43.7"),
+                             (CustomerFilter(),
+                              str(customers[0].get_id())),
+                             (QueryFilter(), "duration >= 0"),
+                             (TimeFilter(), "2018-01 to 2018-12"),
+                             (NumberFilter(), "4*"),
+                             (SQLDurationFilter(store), "G0"),
+                             (SQLLocationFilter(store),
+                              "-79.6, 43.6, -79.3, 43.7"),
+                             (QueryFilter([StoreIndex(store)]),
+                              "duration >= 0 AND customer = %d"
+                              % customers[0].get_id())):
+        with cancel.activate(token):
+            # a new list, so that no index of it is cached
+            result = f.apply(customers, list(calls), filter_string)
+        assert not cancel.is_complete(result)
+        assert result.reason == 'cancelled' and len(result) < len(calls)
+    store.close()
+
+    original = cancel.CancelToken(0, cancel.ORIGINAL)
+    with cancel.activate(original):
+        result = DurationFilter().apply(customers, calls, "G0")
+        assert result.reason == 'budget' and list(result) == calls
+        assert not cancel.is_complete(generate_bills(customers, 1, 2018))
+        with pytest.raises(cancel.Cancelled):
+            process_event_history(log, create_customers(log))
+    assert cancel.current() is None
+    assert len(generate_bills(customers, 1, 2018)) == len(customers)
+
+
+def _exit_worker(connection: object, results: object, worker: int) -> None:
+    """ Stand in for parallel._bill_group, exiting at once without a result
+    as if the worker was killed.
+    """
+    os._exit(3)
+
+
+def _generate(generator: DatasetGenerator) -> str:
+    """ Return the dataset written by <generator>.
+    """
+    out = io.StringIO()
+    generator.write(out)
+    return out.getvalue()
+
+
+# Modules used by tools that only load, bill or filter calls
+CORE_MODULES = ['customer', 'phoneline', 'contract', 'callhistory', 'filter']
+
+# Budget (in microseconds) for importing all of the CORE_MODULES
+CORE_IMPORT_BUDGET = 150000
+
+
+def test_core_import_time() -> None:
+    """ Test that the core modules import quickly, without loading the GUI
+    libraries.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         'import ' + ', '.join(CORE_MODULES)],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imported[fields[2].strip()] = (int(fields[1]),
+                                           not fields[2][1:].startswith(' '))
+    assert all(name.split('.')[0] not in ('pygame', 'tkinter')
+               for name in imported)
+    total = sum(cumulative for name, (cumulative, top) in imported.items()
+                if top and name in CORE_MODULES)
+    assert 0 < total < CORE_IMPORT_BUDGET
+
+
 if __name__ == '__main__':
     pytest.main(['sample_tests.py'])
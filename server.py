@@ -0,0 +1,565 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the QueryServer class, a local HTTP/JSON service which
+loads the dataset once and answers filter, bill and call history queries
+without the pygame window.
+
+Requests are served concurrently by an asyncio server. Filters and other
+CPU-heavy work run in a pool of worker threads, so that a slow filter does
+not hold up other requests. Lists of calls are paginated (<offset> and
+<limit> query parameters) and written to the client in chunks, so that the
+memory used by a response stays bounded.
+
+Endpoints (all GET, all answers are JSON):
+    /customers
+        the ids of all customers
+    /filter?filter=<kind>:<string>&filter=...&offset=0&limit=100&budget=1.5
+        the calls left after applying each filter in order, starting from all
+        calls; <kind> is customer, duration, location, number, time, query
+        or reset, and <string> is the filter string typed in the
+        application. If the filters take more than <budget> seconds, they
+        are stopped and the answer has "complete": false with the calls
+        selected so far. The calls selected by the last few filter chains
+        are kept, so the next pages of a chain are not filtered again
+    /bill?customer=<id>&month=<month>&year=<year>
+        the bill of a customer, as returned by Customer.generate_bill
+    /bills?month=<month>&year=<year>&budget=10
+        the bills of all customers, stopped after <budget> seconds as above
+    /sms?filter=<kind>:<string>&filter=...&offset=0&limit=100
+        the SMS messages selected by the customer, location and time filters
+        (other filters select all messages), in the format of the events of
+        the dataset
+    /history?customer=<id>&direction=outgoing|incoming&offset=0&limit=100
+        the calls made or received by a customer
+    /aggregate?by=line&by=month&month=3&year=2018&top=100&statistic=total
+        the count, total, mean and percentiles of the durations of each group
+        of calls (see aggregate.py), the <top> groups with the largest
+        <statistic> first; <month> and <year> restrict the calls to a month
+
+The server only listens on the loopback interface.
+"""
+import asyncio
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, Sequence
+from urllib.parse import parse_qs, urlsplit
+
+import cancel
+from aggregate import Rollup, top_k
+from application import generate_bills
+from call import Call
+from customer import Customer
+from filter import CallListIndex, Filter, ResetFilter, select_sms
+from sms import SMSStore
+import shards
+import storage
+
+# Default and largest number of calls returned in a single response
+DEFAULT_PAGE = 100
+MAX_PAGE = 10000
+
+# Number of calls serialized and written to the client at a time
+WRITE_BATCH = 500
+
+# Number of filter chains whose calls are kept for their next pages
+MAX_CACHED_CHAINS = 16
+
+HOST = '127.0.0.1'
+
+# Reason phrases of the HTTP statuses sent by the server
+_REASONS = {200: b'OK', 400: b'Bad Request', 404: b'Not Found',
+            405: b'Method Not Allowed'}
+
+
+class RequestError(Exception):
+    """ A request that cannot be answered, with the HTTP status to send.
+    """
+    status: int
+
+    def __init__(self, status: int, message: str) -> None:
+        """ Create a new error with HTTP <status> and <message>.
+        """
+        Exception.__init__(self, message)
+        self.status = status
+
+
+class QueryServer:
+    """ An HTTP/JSON server for the filters, bills and call histories of a
+    set of customers.
+
+    === Public Attributes ===
+    customers:
+        all customers of the dataset
+    store:
+        database answering the filters, or None for the in-memory filters
+    rollup:
+        per-month summaries answering aggregations, or None until the first
+        aggregation if none was given
+    messages:
+        the SMS messages of the dataset, or None if they were not kept
+    port:
+        the port the server listens on, once it is started
+    """
+    customers: list[Customer]
+    store: Optional[storage.CallStore]
+    rollup: Optional[Rollup]
+    messages: Optional[SMSStore]
+    port: int
+    # === Private Attributes ===
+    # _calls:
+    #     all calls of the dataset, as shown by the application after a reset
+    # _by_id:
+    #     the customer for each customer id
+    # _pool:
+    #     the worker threads that run filters
+    # _loop:
+    #     the event loop of the server, once it is started
+    # _server:
+    #     the asyncio server, once it is started
+    # _thread:
+    #     the thread running the event loop, if started with start()
+    # _chains:
+    #     the calls selected by the last filter chains, by their filter
+    #     parameters and budget, the least recently used first
+    # _lock:
+    #     protects <_chains>
+    # _rollup_lock:
+    #     held while <rollup> is created, so that it is created once
+    _calls: list[Call]
+    _by_id: dict[int, Customer]
+    _pool: ThreadPoolExecutor
+    _loop: Optional[asyncio.AbstractEventLoop]
+    _server: Optional[asyncio.AbstractServer]
+    _thread: Optional[threading.Thread]
+    _chains: OrderedDict[tuple, list[Call]]
+    _lock: threading.Lock
+    _rollup_lock: threading.Lock
+
+    def __init__(self, customers: list[Customer],
+                 store: Optional[storage.CallStore] = None,
+                 workers: Optional[int] = None,
+                 rollup: Optional[Rollup] = None,
+                 messages: Optional[SMSStore] = None) -> None:
+        """ Create a server for <customers>, with filters answered by <store>
+        (if given) in a pool of <workers> threads, aggregations by <rollup>
+        (if given), and the SMS <messages> (if given).
+        """
+        self.customers = customers
+        self.store = store
+        self.rollup = rollup
+        self.messages = messages
+        self.port = 0
+        self._calls = ResetFilter().apply(customers, [], "")
+        # the filtered calls are all part of these, so their indexes are
+        # made once and answer every request
+        CallListIndex.track(self._calls)
+        self._by_id = {c.get_id(): c for c in customers}
+        self._pool = ThreadPoolExecutor(max_workers=workers,
+                                        thread_name_prefix='query')
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._chains = OrderedDict()
+        self._lock = threading.Lock()
+        self._rollup_lock = threading.Lock()
+
+    async def serve(self, port: int = 0) -> None:
+        """ Listen on <port> (any free port if 0) until the server is
+        stopped.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._server = await asyncio.start_server(self._handle, HOST, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        async with self._server:
+            try:
+                await self._server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    def start(self, port: int = 0) -> None:
+        """ Start the server on <port> in a background thread, and return once
+        it is listening.
+        """
+        ready = threading.Event()
+
+        def run() -> None:
+            """ Run the event loop of the server.
+            """
+            async def main() -> None:
+                """ Start serving and signal that the server is ready.
+                """
+                task = asyncio.create_task(self.serve(port))
+                while self._server is None or not self._server.is_serving():
+                    await asyncio.sleep(0.001)
+                ready.set()
+                await task
+
+            asyncio.run(main())
+
+        self._thread = threading.Thread(target=run, daemon=True,
+                                        name='query-server')
+        self._thread.start()
+        ready.wait()
+
+    def stop(self) -> None:
+        """ Stop a server started with start().
+        """
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+        if self._thread is not None:
+            self._thread.join()
+        self._pool.shutdown()
+
+    async def _handle(self, reader: asyncio.StreamReader,
+                      writer: asyncio.StreamWriter) -> None:
+        """ Answer the HTTP requests of one client connection.
+        """
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                # skip the headers, requests do not have a body
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                parts = request.decode('latin-1').split()
+                keep_alive = len(parts) == 3 and parts[2] == 'HTTP/1.1'
+                await self._respond(parts, writer)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, parts: list[str],
+                       writer: asyncio.StreamWriter) -> None:
+        """ Write the answer to the request line <parts> to <writer>.
+        """
+        try:
+            if len(parts) < 2 or parts[0] != 'GET':
+                raise RequestError(405, "only GET requests are supported")
+            url = urlsplit(parts[1])
+            query = parse_qs(url.query)
+            handlers = {'/customers': self._customers,
+                        '/filter': self._filter,
+                        '/bill': self._bill,
+                        '/bills': self._bills,
+                        '/sms': self._sms,
+                        '/history': self._history,
+                        '/aggregate': self._aggregate}
+            if url.path not in handlers:
+                raise RequestError(404, "unknown endpoint " + url.path)
+            body = await handlers[url.path](query)
+        except RequestError as error:
+            await _write_json(writer, error.status, {'error': str(error)})
+            return
+
+        if isinstance(body, dict) and 'calls' in body:
+            await _write_calls(writer, body)
+        else:
+            await _write_json(writer, 200, body)
+
+    async def _customers(self, query: dict[str, list[str]]) -> Any:
+        """ Return the ids of all customers.
+        """
+        return {'customers': list(self._by_id)}
+
+    async def _filter(self, query: dict[str, list[str]]) -> Any:
+        """ Return a page of the calls selected by the filters in <query>.
+        """
+        chain = self._chain(query)
+        token = _token(query)
+        key = (tuple(query.get('filter', [])),
+               query.get('budget', [None])[0])
+
+        def run() -> list[Call]:
+            """ Apply the filters one after the other, until one of them is
+            stopped by <token>, unless the calls they select are kept.
+            """
+            with self._lock:
+                if key in self._chains:
+                    self._chains.move_to_end(key)
+                    return self._chains[key]
+            data = self._calls
+            with cancel.activate(token):
+                for f, filter_string in chain:
+                    data = f.apply(self.customers, data, filter_string)
+                    if not cancel.is_complete(data):
+                        break
+            with self._lock:
+                self._chains[key] = data
+                if len(self._chains) > MAX_CACHED_CHAINS:
+                    self._chains.popitem(last=False)
+            return data
+
+        calls = await self._run(run)
+        page = _page(calls, query)
+        page['complete'] = cancel.is_complete(calls)
+        return page
+
+    async def _sms(self, query: dict[str, list[str]]) -> Any:
+        """ Return a page of the SMS messages selected by the filters in
+        <query>.
+        """
+        if self.messages is None:
+            raise RequestError(404, "SMS messages are not available")
+        chain = self._chain(query)
+        messages = self.messages
+
+        def run() -> Sequence[int]:
+            """ Select the messages with the filters.
+            """
+            return select_sms(self.customers, messages, chain)
+
+        positions = await self._run(run)
+        page = _page(positions, query)
+        page['messages'] = [messages.get(i) for i in page.pop('calls')]
+        return page
+
+    def _chain(self, query: dict[str, list[str]]) -> list[tuple[Filter, str]]:
+        """ Return the filters in <query>, with their filter strings.
+        """
+        chain = []
+        for spec in query.get('filter', []):
+            kind, _, filter_string = spec.partition(':')
+            f = storage.get_filter(kind, self.store)
+            if f is None:
+                raise RequestError(400, "unknown filter " + kind)
+            chain.append((f, filter_string))
+        return chain
+
+    async def _bill(self, query: dict[str, list[str]]) -> Any:
+        """ Return the bill of the customer, month and year in <query>.
+        """
+        customer = self._customer(query)
+        month = _int_parameter(query, 'month')
+        year = _int_parameter(query, 'year')
+        cid, total, lines = await self._run(customer.generate_bill,
+                                            month, year)
+        return {'customer': cid, 'month': month, 'year': year,
+                'total': total, 'lines': lines}
+
+    async def _bills(self, query: dict[str, list[str]]) -> Any:
+        """ Return the bills of all customers for the month and year in
+        <query>.
+        """
+        month = _int_parameter(query, 'month')
+        year = _int_parameter(query, 'year')
+        token = _token(query)
+
+        def run() -> list:
+            """ Generate the bills, until stopped by <token>.
+            """
+            with cancel.activate(token):
+                return generate_bills(self.customers, month, year)
+
+        bills = await self._run(run)
+        return {'month': month, 'year': year,
+                'complete': cancel.is_complete(bills),
+                'bills': [{'customer': cid, 'total': total, 'lines': lines}
+                          for cid, total, lines in bills]}
+
+    async def _history(self, query: dict[str, list[str]]) -> Any:
+        """ Return a page of the calls made or received by the customer in
+        <query>.
+        """
+        customer = self._customer(query)
+        direction = query.get('direction', ['outgoing'])[0]
+        if direction not in ('outgoing', 'incoming'):
+            raise RequestError(400, "direction must be outgoing or incoming")
+        history = await self._run(customer.get_history)
+        calls = history[0] if direction == 'outgoing' else history[1]
+        return _page(calls, query)
+
+    async def _aggregate(self, query: dict[str, list[str]]) -> Any:
+        """ Return the largest groups of calls for the grouping in <query>.
+        """
+        by = tuple(query.get('by', ['month']))
+        months = None
+        if 'month' in query or 'year' in query:
+            months = [(_int_parameter(query, 'month'),
+                       _int_parameter(query, 'year'))]
+        top = _int_parameter(query, 'top', DEFAULT_PAGE)
+        statistic = query.get('statistic', ['total'])[0]
+        if statistic not in ('count', 'total', 'mean'):
+            raise RequestError(400, "statistic must be count, total or mean")
+
+        def run() -> list:
+            """ Group the calls and keep the <top> groups.
+            """
+            with self._rollup_lock:
+                if self.rollup is None:
+                    self.rollup = Rollup(self.customers, self._calls)
+            try:
+                groups = self.rollup.group(by=by, months=months)
+            except ValueError as error:
+                raise RequestError(400, str(error))
+            return top_k(groups, top, statistic)
+
+        groups = await self._run(run)
+        return {'by': list(by),
+                'groups': [dict(summary.get_summary(), key=list(key))
+                           for key, summary in groups]}
+
+    def _customer(self, query: dict[str, list[str]]) -> Customer:
+        """ Return the customer whose id is in <query>.
+        """
+        cid = _int_parameter(query, 'customer')
+        if cid not in self._by_id:
+            raise RequestError(404, "unknown customer " + str(cid))
+        return self._by_id[cid]
+
+    async def _run(self, func: Callable, *args: Any) -> Any:
+        """ Return the result of <func>(<args>), computed in the worker pool.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._pool, func, *args)
+
+
+def call_to_json(call: Call) -> dict[str, Any]:
+    """ Return <call> in the same format as the events of <dataset.json>.
+    """
+    return {'type': 'call',
+            'src_number': call.src_number,
+            'dst_number': call.dst_number,
+            'time': call.time.strftime("%Y-%m-%d %H:%M:%S"),
+            'duration': call.duration,
+            'src_loc': list(call.src_loc),
+            'dst_loc': list(call.dst_loc)}
+
+
+def _int_parameter(query: dict[str, list[str]], name: str,
+                   default: Optional[int] = None) -> int:
+    """ Return the integer parameter <name> of <query>, or <default> if it is
+    missing and <default> is not None.
+    """
+    if name not in query and default is not None:
+        return default
+    try:
+        return int(query[name][0])
+    except (KeyError, ValueError):
+        raise RequestError(400, "missing or invalid parameter " + name)
+
+
+def _token(query: dict[str, list[str]]) -> Optional[cancel.CancelToken]:
+    """ Return a token for the budget parameter of <query>, in seconds, or
+    None if there is none.
+    """
+    if 'budget' not in query:
+        return None
+    try:
+        budget = float(query['budget'][0])
+    except ValueError:
+        raise RequestError(400, "invalid parameter budget")
+    if budget <= 0:
+        raise RequestError(400, "budget must be positive")
+    return cancel.CancelToken(budget)
+
+
+def _page(calls: list[Call], query: dict[str, list[str]]) -> dict[str, Any]:
+    """ Return the page of <calls> selected by the offset and limit
+    parameters of <query>.
+    """
+    offset = _int_parameter(query, 'offset', 0)
+    limit = min(_int_parameter(query, 'limit', DEFAULT_PAGE), MAX_PAGE)
+    if offset < 0 or limit < 0:
+        raise RequestError(400, "offset and limit must not be negative")
+    return {'total': len(calls), 'offset': offset, 'limit': limit,
+            'calls': calls[offset:offset + limit]}
+
+
+async def _write_json(writer: asyncio.StreamWriter, status: int,
+                      body: Any) -> None:
+    """ Write an HTTP response with <status> and the JSON <body>.
+    """
+    data = json.dumps(body).encode()
+    writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n'
+                 b'Content-Length: %d\r\n\r\n'
+                 % (status, _REASONS.get(status, b'Error'), len(data)))
+    writer.write(data)
+    await writer.drain()
+
+
+async def _write_calls(writer: asyncio.StreamWriter,
+                       page: dict[str, Any]) -> None:
+    """ Write a successful HTTP response for a <page> of calls, serializing
+    and sending the calls in batches with the chunked transfer encoding.
+    """
+    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                 b'Transfer-Encoding: chunked\r\n\r\n')
+    calls = page['calls']
+    head = {k: v for k, v in page.items() if k != 'calls'}
+    _write_chunk(writer, json.dumps(head)[:-1] + ', "calls": [')
+    for start in range(0, len(calls), WRITE_BATCH):
+        batch = ', '.join(json.dumps(call_to_json(c))
+                          for c in calls[start:start + WRITE_BATCH])
+        _write_chunk(writer, (', ' if start else '') + batch)
+        await writer.drain()
+    _write_chunk(writer, ']}')
+    writer.write(b'0\r\n\r\n')
+    await writer.drain()
+
+
+def _write_chunk(writer: asyncio.StreamWriter, text: str) -> None:
+    """ Write <text> as one chunk of a chunked HTTP response.
+    """
+    data = text.encode()
+    writer.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+
+def main() -> None:
+    """ Load <dataset.json> and serve it until interrupted.
+    """
+    import argparse
+    from application import import_data, create_customers, \
+        process_event_history
+
+    parser = argparse.ArgumentParser(description="Serve the dataset locally")
+    parser.add_argument('--port', type=int, default=8148)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('shards', nargs='*',
+                        help="files of a dataset split into several files, "
+                             "instead of dataset.json")
+    parser.add_argument('--customers',
+                        help="file of the customers of the shards, if not "
+                             "the first shard")
+    args = parser.parse_args()
+
+    log = shards.import_shards(args.shards, args.customers) if args.shards \
+        else import_data()
+    customers = create_customers(log, release=True)
+    rollup = Rollup(customers)
+    messages = SMSStore()
+    process_event_history(log, customers, [rollup.add_call], messages,
+                          release=True)
+    del log
+    store = None
+    if storage.FILTER_BACKEND == 'sqlite':
+        store = storage.CallStore()
+        store.save(customers)
+    server = QueryServer(customers, store, args.workers, rollup, messages)
+    print("Serving on http://%s:%d" % (HOST, args.port))
+    try:
+        asyncio.run(server.serve(args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
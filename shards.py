@@ -0,0 +1,150 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the functions that read a dataset split into several
+files (shards), e.g. one file per day or per switch, as a single log for
+process_event_history.
+
+A shard is a JSON Lines file (as written by generator.py --jsonl, with the
+extension .jsonl) or a file in the format of <dataset.json>, whose events
+are in chronological order. The events of all of the shards are merged by
+time with a heap holding the next event of each shard: JSON Lines shards are
+read one line at a time, as the merged events are processed, so they take
+the memory of a single event each however large they are. Shards in the
+format of <dataset.json> cannot be read a piece at a time, and are loaded
+whole. Shards may be compressed (see datafile.py), and are read by the
+decoder of decoder.get_decoder().
+
+The customers are read from a separate file (with a "customers" list, or
+with customer records as JSON Lines), or else from the first shard. The
+customer records of the other shards are skipped.
+"""
+import heapq
+from typing import Any, Iterator, Optional
+
+from datafile import open_dataset, strip_extension
+from decoder import get_decoder
+
+# Extensions of the JSON Lines files; other files are in the format of
+# <dataset.json>
+JSON_LINES_EXTENSIONS = ('.jsonl', '.ndjson')
+
+
+def import_shards(paths: list[str], customers_path: Optional[str] = None,
+                  ordered: bool = True) -> dict[str, Any]:
+    """ Return the dataset split into the shards <paths>, in the format
+    returned by application.import_data, with the customers of
+    <customers_path> (by default, of the first shard).
+
+    The events are an iterator over the events of all of the shards, in
+    chronological order, which reads the shards as it is consumed: it can be
+    processed once, by process_event_history.
+
+    Raise ValueError if the events of a shard are not in chronological
+    order, when they are read, unless <ordered> is False (e.g. when the
+    events go through a reorder.ReorderBuffer).
+    """
+    return {'customers': read_customers(customers_path or paths[0]),
+            'events': merge_events(paths, ordered)}
+
+
+def read_customers(path: str) -> list[dict]:
+    """ Return the customer records of the file <path>, which is either in
+    the format of <dataset.json> or a JSON Lines file whose customer records
+    come before its events.
+    """
+    decoder = get_decoder()
+    with open_dataset(path) as f:
+        if not is_json_lines(path):
+            return decoder.load(f)['customers']
+        customers = []
+        for line in f:
+            if line.strip():
+                record = decoder.loads(line)
+                if record['type'] != 'customer':
+                    break
+                customers.append(record)
+        return customers
+
+
+def merge_events(paths: list[str], ordered: bool = True) \
+        -> Iterator[dict]:
+    """ Yield the events of the shards <paths> in chronological order. Events
+    at the same time are yielded in the order of their shards in <paths>.
+
+    If <ordered> is False, shards that are slightly out of order are merged
+    anyway, and so are their events.
+    """
+    # The times are in the format "%Y-%m-%d %H:%M:%S", so comparing them as
+    # strings compares them chronologically
+    return heapq.merge(*[read_events(path, ordered) for path in paths],
+                       key=_event_time)
+
+
+def read_events(path: str, ordered: bool = True) -> Iterator[dict]:
+    """ Yield the events of the shard <path>, without its customer records.
+
+    Raise ValueError if they are not in chronological order, unless
+    <ordered> is False.
+    """
+    previous = ''
+    for event in _records(path):
+        if event['type'] == 'customer':
+            continue
+        if ordered and event['time'] < previous:
+            raise ValueError(path + ": event at " + event['time'] +
+                             " after an event at " + previous)
+        previous = event['time']
+        yield event
+
+
+def is_json_lines(path: str) -> bool:
+    """ Return whether the file <path> is a JSON Lines file, going by its
+    extension (e.g. .jsonl, or .jsonl.gz if it is compressed).
+    """
+    return strip_extension(path).endswith(JSON_LINES_EXTENSIONS)
+
+
+def _records(path: str) -> Iterator[dict]:
+    """ Yield the records of the file <path>: the lines of a JSON Lines file,
+    one at a time, or the events of a file in the format of <dataset.json>.
+    """
+    decoder = get_decoder()
+    with open_dataset(path) as f:
+        if not is_json_lines(path):
+            yield from decoder.load(f)['events']
+            return
+        for line in f:
+            if line.strip():
+                yield decoder.loads(line)
+
+
+def _event_time(event: dict) -> str:
+    """ Return the time of <event>, as written in the dataset.
+    """
+    return event['time']
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'heapq', 'datafile', 'decoder'
+        ],
+        'allowed-io': [
+            'read_customers', '_records'
+        ],
+        'generated-members': 'pygame.*'
+    })
@@ -0,0 +1,177 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the SMSStore class, which keeps the SMS messages of an
+event history without making an object for each message.
+
+The messages are kept in typed arrays, one entry per message: the numbers
+are their ids in numbertable.NUMBERS (each distinct number is stored once),
+the times are seconds since 1970-01-01, and the locations are 32 bit
+floats. A message takes about 28 bytes, instead of several hundred for a
+Call and its datetime and location lists.
+
+Selections of messages are arrays of positions in the store, in increasing
+order. The customer, location and time filters select messages through
+Filter.apply_sms, with the same filter strings as for calls.
+"""
+import datetime
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Sequence
+
+from numbertable import NUMBERS
+
+# The time from which message times are counted, in seconds
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class SMSStore:
+    """ The SMS messages of an event history, in the order they were sent.
+    """
+    # === Private Attributes ===
+    # _src:
+    #     the id of the number that sent each message
+    # _dst:
+    #     the id of the number that received each message
+    # _times:
+    #     the time each message was sent, in seconds since EPOCH
+    # _locations:
+    #     the source longitude and latitude, then the destination longitude
+    #     and latitude of each message, 4 entries per message
+    # _sorted:
+    #     whether the messages were added in chronological order, so that
+    #     <_times> is sorted
+    _src: array
+    _dst: array
+    _times: array
+    _locations: array
+    _sorted: bool
+
+    def __init__(self) -> None:
+        """ Create an empty store.
+        """
+        self._src = array('I')
+        self._dst = array('I')
+        self._times = array('q')
+        self._locations = array('f')
+        self._sorted = True
+
+    def __len__(self) -> int:
+        """ Return the number of messages in this store.
+        """
+        return len(self._times)
+
+    def add(self, src_number: str, dst_number: str, when: datetime.datetime,
+            src_loc: Sequence[float], dst_loc: Sequence[float]) -> None:
+        """ Add a message sent from <src_number> at <src_loc> to <dst_number>
+        at <dst_loc> at the time <when>.
+        """
+        seconds = int((when - EPOCH).total_seconds())
+        if self._times and seconds < self._times[-1]:
+            self._sorted = False
+        self._src.append(NUMBERS.intern(src_number))
+        self._dst.append(NUMBERS.intern(dst_number))
+        self._locations.extend((src_loc[0], src_loc[1],
+                                dst_loc[0], dst_loc[1]))
+        # The time is added last: the messages counted by len() are complete,
+        # so positions() can be read while messages are added
+        self._times.append(seconds)
+
+    def get(self, position: int) -> dict:
+        """ Return the message at <position>, in the format of the events of
+        the input dataset.
+        """
+        j = 4 * position
+        when = EPOCH + datetime.timedelta(seconds=self._times[position])
+        return {'type': 'sms',
+                'src_number': NUMBERS.number(self._src[position]),
+                'dst_number': NUMBERS.number(self._dst[position]),
+                'time': when.strftime("%Y-%m-%d %H:%M:%S"),
+                'src_loc': [self._locations[j], self._locations[j + 1]],
+                'dst_loc': [self._locations[j + 2], self._locations[j + 3]]}
+
+    def fields(self, position: int) \
+            -> tuple[int, int, datetime.datetime, tuple[float, float],
+                     tuple[float, float]]:
+        """ Return the ids of the source and destination numbers, the time,
+        and the source and destination locations of the message at
+        <position>.
+        """
+        j = 4 * position
+        return (self._src[position], self._dst[position],
+                EPOCH + datetime.timedelta(seconds=self._times[position]),
+                (self._locations[j], self._locations[j + 1]),
+                (self._locations[j + 2], self._locations[j + 3]))
+
+    def positions(self) -> Sequence[int]:
+        """ Return the positions of all of the messages.
+        """
+        return range(len(self))
+
+    def select_numbers(self, numbers: Iterable[str],
+                       positions: Sequence[int]) -> array:
+        """ Return the positions from <positions> of the messages sent or
+        received by one of <numbers>.
+        """
+        ids = {NUMBERS.lookup(n) for n in numbers}
+        src, dst = self._src, self._dst
+        return array('I', [i for i in positions
+                           if src[i] in ids or dst[i] in ids])
+
+    def select_location(self, coordinates: Sequence[float],
+                        positions: Sequence[int]) -> array:
+        """ Return the positions from <positions> of the messages whose
+        source or destination is in the rectangle given by the lowerLong,
+        lowerLat, upperLong, upperLat <coordinates>, boundary included.
+        """
+        low_long, low_lat, high_long, high_lat = coordinates
+        locations = self._locations
+        selected = array('I')
+        for i in positions:
+            j = 4 * i
+            if (low_long <= locations[j] <= high_long
+                    and low_lat <= locations[j + 1] <= high_lat) or \
+                    (low_long <= locations[j + 2] <= high_long
+                     and low_lat <= locations[j + 3] <= high_lat):
+                selected.append(i)
+        return selected
+
+    def select_time(self, start: datetime.datetime, end: datetime.datetime,
+                    positions: Sequence[int]) -> array:
+        """ Return the positions from <positions> of the messages sent from
+        <start> (included) to <end> (excluded).
+        """
+        first = int((start - EPOCH).total_seconds())
+        last = int((end - EPOCH).total_seconds())
+        times = self._times
+        if not self._sorted:
+            return array('I', [i for i in positions
+                               if first <= times[i] < last])
+        # The times are sorted, and so are the positions
+        begin = bisect_left(times, first)
+        stop = bisect_left(times, last)
+        return array('I', positions[bisect_left(positions, begin):
+                                    bisect_left(positions, stop)])
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'datetime', 'array', 'bisect',
+            'numbertable'
+        ],
+        'generated-members': 'pygame.*'
+    })
@@ -0,0 +1,187 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the StandingQuery class, which keeps the result of the
+filters applied so far up to date as new calls are processed.
+
+Each filter applied through a StandingQuery is remembered. When new calls
+arrive (e.g. as a call listener of process_event_history), only the new
+calls are tested against the remembered filters, and those that pass all of
+them are appended to the result. The cost of new calls therefore depends on
+how many there are, not on the size of the history.
+
+The new calls are also added to all of the calls, so that results computed
+earlier (e.g. kept by a FilterHistory for undo) can be brought up to date
+with restore().
+
+All of the calls are tracked by the indexes of filter.py (see
+CallListIndex), which are extended with the new calls instead of being made
+again, and answer the filters applied to any of the results.
+"""
+import threading
+from typing import Callable, Optional
+
+from call import Call
+from customer import Customer
+from filter import CallListIndex, Filter, ResetFilter
+
+
+class StandingQuery:
+    """ The calls selected by a chain of filters, extended as new calls
+    arrive.
+
+    === Public Attributes ===
+    customers:
+        all customers of the dataset
+    calls:
+        all of the calls since the last reset, including the new calls
+    results:
+        the calls selected by the filters applied so far, in the order they
+        were selected and then received. New calls are appended to this list.
+    """
+    customers: list[Customer]
+    calls: list[Call]
+    results: list[Call]
+    # === Private Attributes ===
+    # _filters:
+    #     each filter applied since the last reset, with its filter string
+    #     and a function testing single calls against it (None if the filter
+    #     has to be applied to a list of calls)
+    # _lock:
+    #     protects <calls>, <results> and <_filters>, as new calls may come
+    #     from another thread
+    _filters: list[tuple[Filter, str, Optional[Callable[[Call], bool]]]]
+    _lock: threading.Lock
+
+    def __init__(self, customers: list[Customer], calls: list[Call]) -> None:
+        """ Create a standing query for <customers>, which selects all of
+        <calls> until a filter is applied.
+        """
+        self.customers = customers
+        self.calls = calls
+        self.results = calls
+        self._filters = []
+        self._lock = threading.Lock()
+        CallListIndex.track(calls)
+
+    def apply(self, f: Filter, filter_string: str) -> list[Call]:
+        """ Apply <f> with <filter_string> to the current results, remember
+        it for new calls, and return the new results.
+        """
+        calls = f.apply(self.customers, self.results, filter_string)
+        self.register(f, filter_string, calls)
+        return calls
+
+    def register(self, f: Filter, filter_string: str, calls: list[Call],
+                 data: Optional[list[Call]] = None,
+                 seen: Optional[int] = None) -> int:
+        """ Record that <f> was applied with <filter_string> to the results,
+        selecting <calls>, which become the new results. Return the number of
+        calls of <self.calls> the new results are up to date with.
+
+        If <f> was applied to the first <seen> calls of <data> and calls were
+        appended to <data> since (e.g. while the filter ran in the
+        background), they are tested against <f> and added to <calls>, so
+        that no new call is lost.
+
+        A ResetFilter forgets all of the filters applied before it, and
+        <calls> become all of the calls.
+        """
+        with self._lock:
+            if isinstance(f, ResetFilter):
+                self._filters = []
+                self.calls = calls
+                CallListIndex.track(calls)
+            else:
+                matches = f.matcher(self.customers, filter_string)
+                if data is not None and seen is not None \
+                        and len(data) > seen:
+                    missed = data[seen:]
+                    if matches is None:
+                        missed = f.apply(self.customers, missed,
+                                         filter_string)
+                    else:
+                        missed = [c for c in missed if matches(c)]
+                    calls.extend(missed)
+                self._filters.append((f, filter_string, matches))
+            self.results = calls
+            return len(self.calls)
+
+    def restore(self, chain: list[tuple[Filter, str]], calls: list[Call],
+                seen: int) -> int:
+        """ Replace the filters applied since the last reset by <chain>, a
+        list of (filter, filter string) pairs that selected <calls> from the
+        first <seen> calls of <self.calls>. <calls> become the new results.
+
+        The calls added since the first <seen> are tested against <chain>
+        and appended to <calls>. Return the number of calls of <self.calls>
+        the new results are up to date with.
+        """
+        with self._lock:
+            self._filters = [(f, filter_string,
+                              f.matcher(self.customers, filter_string))
+                             for f, filter_string in chain]
+            if calls is not self.calls:
+                calls.extend(self._select(self.calls[seen:]))
+            self.results = calls
+            return len(self.calls)
+
+    def snapshot(self, all_calls: bool = False) -> tuple[list[Call], int]:
+        """ Return a copy of the results (or of all of the calls, if
+        <all_calls> is True), with the number of calls of <self.calls> they
+        are up to date with.
+        """
+        with self._lock:
+            calls = self.calls if all_calls else self.results
+            return calls[:], len(self.calls)
+
+    def add_call(self, call: Call) -> None:
+        """ Append <call> to the results if every filter would select it.
+        """
+        self.extend([call])
+
+    def extend(self, calls: list[Call]) -> list[Call]:
+        """ Append the calls from <calls> selected by every filter to the
+        results, and return them.
+        """
+        with self._lock:
+            if self.results is not self.calls:
+                self.calls.extend(calls)
+            selected = self._select(calls)
+            self.results.extend(selected)
+            CallListIndex.refresh(self.calls)
+        return selected
+
+    def _select(self, calls: list[Call]) -> list[Call]:
+        """ Return the calls from <calls> selected by every filter.
+        """
+        for f, filter_string, matches in self._filters:
+            if not calls:
+                break
+            if matches is None:
+                calls = f.apply(self.customers, calls, filter_string)
+            else:
+                calls = [c for c in calls if matches(c)]
+        return calls
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'threading', 'call', 'customer', 'filter'
+        ],
+        'generated-members': 'pygame.*'
+    })
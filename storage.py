@@ -0,0 +1,756 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains the CallStore class, which keeps customers, phone lines,
+calls, bills and SMS messages (with the number of messages of each line and
+month) in a local SQLite database, so that they persist between runs of the
+application.
+
+Calls are indexed on their time, duration, source and destination numbers and
+customers, and their source and destination locations are kept in R*Tree
+virtual tables. The SQL filters at the bottom of this file use these indexes,
+so that the database engine, rather than the interpreter, selects the calls.
+They accept exactly the same filter strings as the filters in filter.py.
+
+The filters used by the application are selected by get_filter(), according
+to the FILTER_BACKEND setting ("memory" or "sqlite").
+
+While a cancel token is active (see cancel.py), the queries of the store are
+interrupted by SQLite as soon as the token stops the job, and the SQL filters
+return a partial result like the in-memory filters.
+"""
+import datetime
+import os
+import sqlite3
+import threading
+from typing import Optional
+
+import cancel
+from bill import Bill
+from call import Call
+from contract import Contract, MTMContract, TermContract, PrepaidContract, \
+    create_contract
+from customer import Customer
+from filter import Filter, CustomerFilter, DurationFilter, LocationFilter, \
+    NumberFilter, ResetFilter, TimeFilter
+from metrics import observe_filter
+from numbertable import NUMBERS
+from phoneline import PhoneLine
+from query import CallIndex, Predicate, DurationPredicate, \
+    CustomerPredicate, LocationPredicate, NumberPredicate, QueryFilter
+from sms import SMSStore
+from tracing import traced
+
+# Which filters get_filter() returns: "memory" or "sqlite"
+FILTER_BACKEND = os.environ.get('MEWBILE_FILTER_BACKEND', 'memory')
+
+# Format of the call times in the database; it sorts chronologically
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Number of SQLite virtual machine instructions between checks of the active
+# cancel token while a query runs
+PROGRESS_STEPS = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id INTEGER NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS lines (
+    number TEXT PRIMARY KEY,
+    customer_id INTEGER NOT NULL REFERENCES customers(id),
+    contract TEXT NOT NULL,
+    start_date TEXT,
+    end_date TEXT,
+    balance REAL,
+    month INTEGER,
+    year INTEGER
+);
+CREATE INDEX IF NOT EXISTS lines_customer ON lines(customer_id);
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    src_number TEXT NOT NULL,
+    dst_number TEXT NOT NULL,
+    src_customer INTEGER,
+    dst_customer INTEGER,
+    time TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    src_long REAL, src_lat REAL,
+    dst_long REAL, dst_lat REAL
+);
+CREATE INDEX IF NOT EXISTS calls_time ON calls(time);
+CREATE INDEX IF NOT EXISTS calls_duration ON calls(duration);
+CREATE INDEX IF NOT EXISTS calls_src_number ON calls(src_number);
+CREATE INDEX IF NOT EXISTS calls_dst_number ON calls(dst_number);
+CREATE INDEX IF NOT EXISTS calls_src_customer ON calls(src_customer);
+CREATE INDEX IF NOT EXISTS calls_dst_customer ON calls(dst_customer);
+CREATE VIRTUAL TABLE IF NOT EXISTS src_locations
+    USING rtree(id, min_long, max_long, min_lat, max_lat);
+CREATE VIRTUAL TABLE IF NOT EXISTS dst_locations
+    USING rtree(id, min_long, max_long, min_lat, max_lat);
+CREATE TABLE IF NOT EXISTS bills (
+    number TEXT NOT NULL,
+    month INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    type TEXT,
+    fixed REAL,
+    free_mins INTEGER,
+    billed_mins INTEGER,
+    min_rate REAL,
+    PRIMARY KEY (number, year, month)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    src_number TEXT NOT NULL,
+    dst_number TEXT NOT NULL,
+    time TEXT NOT NULL,
+    src_long REAL, src_lat REAL,
+    dst_long REAL, dst_lat REAL
+);
+CREATE TABLE IF NOT EXISTS sms_counts (
+    number TEXT NOT NULL,
+    month INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    sent INTEGER NOT NULL,
+    received INTEGER NOT NULL,
+    PRIMARY KEY (number, year, month)
+);
+"""
+
+
+class CallStore:
+    """ A SQLite database of customers, phone lines, calls and bills.
+
+    Each stored call gets an integer id. The Call objects that were saved,
+    loaded or added in this session are remembered, so that the results of a
+    query can be returned as the same Call objects that the application
+    displays.
+
+    === Public Attributes ===
+    path:
+        the database file, or ":memory:" for a temporary database
+    """
+    path: str
+    # === Private Attributes ===
+    # _db:
+    #     the connection to the database, shared by all threads
+    # _lock:
+    #     serializes the use of _db
+    # _calls:
+    #     the Call object for each call id, in id order
+    # _ids:
+    #     the call id for the id() of each Call object in _calls
+    # _owners:
+    #     the id of the customer of each phone number in the store
+    _db: sqlite3.Connection
+    _lock: threading.Lock
+    _calls: list[Call]
+    _ids: dict[int, int]
+    _owners: dict[str, int]
+
+    def __init__(self, path: str = ':memory:') -> None:
+        """ Open (or create) the database in the file <path>.
+        """
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._calls = []
+        self._ids = {}
+        self._owners = {}
+
+    def close(self) -> None:
+        """ Close the database.
+        """
+        self._db.close()
+
+    def save(self, customers: list[Customer],
+             messages: Optional[SMSStore] = None) -> None:
+        """ Replace the contents of the database with <customers>, their phone
+        lines, bills, calls and numbers of SMS messages, and the SMS
+        <messages> if they are given.
+        """
+        with self._lock, self._db:
+            self._owners = {}
+            for cust in customers:
+                for number in cust.get_phone_numbers():
+                    self._owners[number] = cust.get_id()
+            self._calls = []
+            self._ids = {}
+            for table in ['bills', 'src_locations', 'dst_locations', 'calls',
+                          'lines', 'customers', 'messages', 'sms_counts']:
+                self._db.execute('DELETE FROM ' + table)
+            self._db.executemany(
+                'INSERT INTO customers VALUES (?)',
+                [(cust.get_id(),) for cust in customers])
+            self._db.executemany(
+                'INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [_line_row(cust, line) for cust in customers
+                 for line in cust.get_phone_lines()])
+            self._db.executemany(
+                'INSERT INTO bills VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(line.number, month, year, bill.type, bill.fixed_cost,
+                  bill.free_min, bill.billed_min, bill.min_rate)
+                 for cust in customers for line in cust.get_phone_lines()
+                 for (month, year), bill in line.bills.items()])
+            # each call is in the outgoing history of exactly one customer
+            self._insert_calls([call for cust in customers
+                                for call in cust.get_history()[0]])
+            self._db.executemany(
+                'INSERT INTO sms_counts VALUES (?, ?, ?, ?, ?)',
+                [_sms_row(line, month, year) for cust in customers
+                 for line in cust.get_phone_lines()
+                 for month, year in set(line.callhistory.outgoing_sms) |
+                 set(line.callhistory.incoming_sms)])
+            if messages is not None:
+                self._db.executemany(
+                    'INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [_message_row(messages, i) for i in messages.positions()])
+
+    def load(self, messages: Optional[SMSStore] = None) -> list[Customer]:
+        """ Return the customers stored in the database, with their phone
+        lines, contracts, bills and call histories (with their numbers of
+        SMS messages) restored, and add the stored SMS messages to
+        <messages> if it is given.
+        """
+        with self._lock:
+            customers = {}
+            for (cid,) in self._db.execute(
+                    'SELECT id FROM customers ORDER BY rowid'):
+                customers[cid] = Customer(cid)
+
+            lines = {}
+            self._owners = {}
+            for row in self._db.execute('SELECT * FROM lines ORDER BY rowid'):
+                line = PhoneLine(row[0], _restore_contract(row))
+                lines[row[0]] = line
+                self._owners[row[0]] = row[1]
+                customers[row[1]].add_phone_line(line)
+
+            for row in self._db.execute(
+                    'SELECT * FROM bills ORDER BY year, month'):
+                bill = Bill()
+                bill.set_rates(row[3], row[7])
+                bill.add_fixed_cost(row[4])
+                bill.add_free_minutes(row[5])
+                bill.add_billed_minutes(row[6])
+                line = lines[row[0]]
+                line.bills[(row[1], row[2])] = bill
+                # the last bill is the one the contract is working on
+                line.contract.bill = bill
+
+            self._calls = []
+            self._ids = {}
+            for row in self._db.execute('SELECT * FROM calls ORDER BY id'):
+                call = Call(row[1], row[2],
+                            datetime.datetime.strptime(row[5], TIME_FORMAT),
+                            row[6], (row[7], row[8]), (row[9], row[10]))
+                self._ids[id(call)] = row[0]
+                self._calls.append(call)
+                if row[1] in lines:
+                    lines[row[1]].callhistory.register_outgoing_call(call)
+                if row[2] in lines:
+                    lines[row[2]].callhistory.register_incoming_call(call)
+
+            for row in self._db.execute('SELECT * FROM sms_counts'):
+                history = lines[row[0]].callhistory
+                if row[3]:
+                    history.outgoing_sms[(row[1], row[2])] = row[3]
+                if row[4]:
+                    history.incoming_sms[(row[1], row[2])] = row[4]
+            if messages is not None:
+                for row in self._db.execute(
+                        'SELECT * FROM messages ORDER BY rowid'):
+                    messages.add(row[0], row[1],
+                                 datetime.datetime.strptime(row[2],
+                                                            TIME_FORMAT),
+                                 (row[3], row[4]), (row[5], row[6]))
+        return list(customers.values())
+
+    def add(self, calls: list[Call]) -> list[Call]:
+        """ Add the new <calls> (e.g. billed from the live feed) to the
+        store, so that the SQL filters and a reset select them too, and
+        return them.
+        """
+        with self._lock, self._db:
+            self._insert_calls(calls)
+        return calls
+
+    def _insert_calls(self, calls: list[Call]) -> None:
+        """ Give ids to <calls>, following the calls already stored, and
+        insert them in the database.
+
+        The caller holds _lock, in a transaction of _db.
+        """
+        first = len(self._calls)
+        for call in calls:
+            self._ids[id(call)] = len(self._calls)
+            self._calls.append(call)
+        owners = self._owners
+        self._db.executemany(
+            'INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(i, c.src_number, c.dst_number, owners.get(c.src_number),
+              owners.get(c.dst_number), c.time.strftime(TIME_FORMAT),
+              c.duration, c.src_loc[0], c.src_loc[1], c.dst_loc[0],
+              c.dst_loc[1]) for i, c in enumerate(calls, first)])
+        self._db.executemany(
+            'INSERT INTO src_locations VALUES (?, ?, ?, ?, ?)',
+            [(i, c.src_loc[0], c.src_loc[0], c.src_loc[1], c.src_loc[1])
+             for i, c in enumerate(calls, first)])
+        self._db.executemany(
+            'INSERT INTO dst_locations VALUES (?, ?, ?, ?, ?)',
+            [(i, c.dst_loc[0], c.dst_loc[0], c.dst_loc[1], c.dst_loc[1])
+             for i, c in enumerate(calls, first)])
+
+    def select(self, data: list[Call], query: str,
+               parameters: tuple = ()) -> list[Call]:
+        """ Return the calls from <data> whose id is returned by the SQL
+        <query> with <parameters>, in the order of <data>, or a
+        PartialResult if the active cancel token stops the job.
+
+        Calls in <data> that were not saved, loaded or added by this store
+        are never selected.
+        """
+        token = cancel.current()
+        try:
+            matches = {row[0] for row in self._fetch(query, parameters)}
+        except cancel.Cancelled:
+            return cancel.partial(token, [], data, 0)
+        ids = self._ids
+        if token is None:
+            return [call for call in data if ids.get(id(call), -1) in matches]
+        selected = []
+        for i, call in enumerate(data):
+            if cancel.stopped(token, i):
+                return cancel.partial(token, selected, data, i)
+            if ids.get(id(call), -1) in matches:
+                selected.append(call)
+        return selected
+
+    def query(self, query: str, parameters: tuple = ()) -> list[Call]:
+        """ Return the calls whose id is returned by the SQL <query> with
+        <parameters>, in the order of the query.
+
+        Raise cancel.Cancelled if the active cancel token stops the job.
+        """
+        return [self._calls[row[0]] for row in self._fetch(query, parameters)]
+
+    def count(self, query: str, parameters: tuple = ()) -> int:
+        """ Return the number returned by the SQL <query> with <parameters>.
+
+        Raise cancel.Cancelled if the active cancel token stops the job.
+        """
+        return self._fetch(query, parameters)[0][0]
+
+    def _fetch(self, query: str, parameters: tuple) -> list[tuple]:
+        """ Return the rows returned by the SQL <query> with <parameters>.
+
+        If a cancel token is active, SQLite checks it every PROGRESS_STEPS
+        instructions, and the query is interrupted and cancel.Cancelled
+        raised as soon as it stops the job.
+        """
+        token = cancel.current()
+        with self._lock:
+            if token is None:
+                return self._db.execute(query, parameters).fetchall()
+            # a true value returned by the handler interrupts the query
+            self._db.set_progress_handler(token.is_stopped, PROGRESS_STEPS)
+            try:
+                return self._db.execute(query, parameters).fetchall()
+            except sqlite3.OperationalError:
+                if not token.is_stopped():
+                    raise
+                raise cancel.Cancelled(token.reason(), 0)
+            finally:
+                self._db.set_progress_handler(None, 0)
+
+    def all_calls(self) -> list[Call]:
+        """ Return all the calls in this store, in id order.
+        """
+        with self._lock:
+            return list(self._calls)
+
+
+class SQLResetFilter(ResetFilter):
+    """ A ResetFilter which returns all of the calls of a CallStore.
+
+    === Public Attributes ===
+    store:
+        the database the calls are selected from
+    """
+    store: CallStore
+
+    def __init__(self, store: CallStore) -> None:
+        """ Create a new filter on the calls in <store>.
+        """
+        ResetFilter.__init__(self)
+        self.store = store
+
+    @observe_filter
+    @traced
+    def apply(self, customers: list[Customer],
+              data: list[Call],
+              filter_string: str) \
+            -> list[Call]:
+        """ Return all the calls in the store. The <customers>, <data> and
+        <filter_string> arguments are ignored.
+        """
+        return self.store.all_calls()
+
+
+class SQLCustomerFilter(CustomerFilter):
+    """ A CustomerFilter answered by the customer indexes of a CallStore.
+
+    === Public Attributes ===
+    store:
+        the database the calls are selected from
+    """
+    store: CallStore
+
+    def __init__(self, store: CallStore) -> None:
+        """ Create a new filter on the calls in <store>.
+        """
+        CustomerFilter.__init__(self)
+        self.store = store
+
+    @observe_filter
+    @traced
+    def apply(self, customers: list[Customer],
+              data: list[Call],
+              filter_string: str) \
+            -> list[Call]:
+        """ Return the calls from <data> made or received by the customer with
+        the id in <filter_string>, or <data> if the filter string is invalid
+        or the customer does not exist.
+        """
+        try:
+            cust_id = int(filter_string)
+        except ValueError:
+            return data
+        if not any(c.get_id() == cust_id for c in customers):
+            return data
+        return self.store.select(
+            data, 'SELECT id FROM calls WHERE src_customer = ? '
+                  'UNION SELECT id FROM calls WHERE dst_customer = ?',
+            (cust_id, cust_id))
+
+    def scans_calls(self) -> bool:
+        """ Return False: the calls are selected by a query of the store.
+        """
+        return False
+
+
+class SQLDurationFilter(DurationFilter):
+    """ A DurationFilter answered by the duration index of a CallStore.
+
+    === Public Attributes ===
+    store:
+        the database the calls are selected from
+    """
+    store: CallStore
+
+    def __init__(self, store: CallStore) -> None:
+        """ Create a new filter on the calls in <store>.
+        """
+        DurationFilter.__init__(self)
+        self.store = store
+
+    @observe_filter
+    @traced
+    def apply(self, customers: list[Customer],
+              data: list[Call],
+              filter_string: str) \
+            -> list[Call]:
+        """ Return the calls from <data> shorter ("Lxxx") or longer ("Gxxx")
+        than the duration in <filter_string>, or <data> if the filter string
+        is invalid.
+        """
+        condition = self._parse(filter_string)
+        if condition is None:
+            return data
+        operator = '<' if condition[0] == 'L' else '>'
+        return self.store.select(
+            data, 'SELECT id FROM calls WHERE duration ' + operator + ' ?',
+            (condition[1],))
+
+    def scans_calls(self) -> bool:
+        """ Return False: the calls are selected by a query of the store.
+        """
+        return False
+
+
+class SQLNumberFilter(NumberFilter):
+    """ A NumberFilter answered by the number indexes of a CallStore.
+
+    === Public Attributes ===
+    store:
+        the database the calls are selected from
+    """
+    store: CallStore
+
+    def __init__(self, store: CallStore) -> None:
+        """ Create a new filter on the calls in <store>.
+        """
+        NumberFilter.__init__(self)
+        self.store = store
+
+    @observe_filter
+    @traced
+    def apply(self, customers: list[Customer],
+              data: list[Call],
+              filter_string: str) \
+            -> list[Call]:
+        """ Return the calls from <data> made or received by the number (or
+        numbers starting with the prefix) in <filter_string>, or <data> if the
+        filter string is invalid.
+        """
+        number = self._parse(filter_string)
+        if number is None:
+            return data
+        query, parameters = _number_sql(number[0], number[1])
+        return self.store.select(data, query, parameters)
+
+    def scans_calls(self) -> bool:
+        """ Return False: the calls are selected by a query of the store.
+        """
+        return False
+
+
+class SQLLocationFilter(LocationFilter):
+    """ A LocationFilter answered by the R*Tree location indexes of a
+    CallStore.
+
+    === Public Attributes ===
+    store:
+        the database the calls are selected from
+    """
+    store: CallStore
+
+    def __init__(self, store: CallStore) -> None:
+        """ Create a new filter on the calls in <store>.
+        """
+        LocationFilter.__init__(self)
+        self.store = store
+
+    @observe_filter
+    @traced
+    def apply(self, customers: list[Customer],
+              data: list[Call],
+              filter_string: str) \
+            -> list[Call]:
+        """ Return the calls from <data> whose source or destination is in
+        the rectangle in <filter_string> (boundary included), or <data> if the
+        filter string is invalid.
+        """
+        coordinates = self._parse(filter_string)
+        if coordinates is None:
+            return data
+        # R*Tree coordinates are 32-bit floats, rounded outwards, so the
+        # exact test is repeated on the candidates to respect the boundary.
+        inside = ' WHERE max_long >= ? AND min_long <= ? ' \
+                 'AND max_lat >= ? AND min_lat <= ?'
+        bounds = (coordinates[0], coordinates[2],
+                  coordinates[1], coordinates[3])
+        candidates = self.store.select(
+            data, 'SELECT id FROM src_locations' + inside
+                  + ' UNION SELECT id FROM dst_locations' + inside,
+            bounds + bounds)
+        if not cancel.is_complete(candidates):
+            return cancel.partial(cancel.current(),
+                                  self._select(list(candidates), coordinates),
+                                  data, candidates.scanned)
+        return self._select(candidates, coordinates)
+
+    def scans_calls(self) -> bool:
+        """ Return False: the calls are selected by a query of the store.
+        """
+        return False
+
+
+class StoreIndex(CallIndex):
+    """ Answer duration, customer and location predicates of queries with the
+    indexes of a CallStore.
+
+    === Public Attributes ===
+    store:
+        the database the calls are selected from
+    """
+    kinds = ('duration', 'customer', 'location', 'number')
+    store: CallStore
+
+    def __init__(self, store: CallStore) -> None:
+        """ Create an index over the calls in <store>.
+        """
+        self.store = store
+
+    def estimate(self, predicate: Predicate) -> int:
+        """ Return the number of calls in the store matching <predicate>.
+        """
+        sql, parameters = self._sql(predicate)
+        return self.store.count('SELECT COUNT(*) FROM (' + sql + ')',
+                                parameters)
+
+    def lookup(self, predicate: Predicate) -> list[Call]:
+        """ Return the calls in the store matching <predicate>.
+        """
+        sql, parameters = self._sql(predicate)
+        calls = self.store.query(sql, parameters)
+        if isinstance(predicate, LocationPredicate):
+            # the R*Tree is approximate, see SQLLocationFilter
+            calls = [c for c in calls if predicate.matches(c)]
+        return calls
+
+    def _sql(self, predicate: Predicate) -> tuple[str, tuple]:
+        """ Return the SQL query selecting the ids of the calls matching
+        <predicate>, and its parameters.
+        """
+        if isinstance(predicate, DurationPredicate):
+            operator = '<>' if predicate.op == '!=' else predicate.op
+            return 'SELECT id FROM calls WHERE duration ' + operator + ' ?', \
+                (predicate.seconds,)
+        if isinstance(predicate, NumberPredicate):
+            return _number_sql(predicate.number, predicate.prefix)
+        if isinstance(predicate, CustomerPredicate):
+            return 'SELECT id FROM calls WHERE src_customer = ? ' \
+                   'UNION SELECT id FROM calls WHERE dst_customer = ?', \
+                (predicate.cid, predicate.cid)
+        inside = ' WHERE max_long >= ? AND min_long <= ? ' \
+                 'AND max_lat >= ? AND min_lat <= ?'
+        bounds = (predicate.bounds[0], predicate.bounds[2],
+                  predicate.bounds[1], predicate.bounds[3])
+        return 'SELECT id FROM src_locations' + inside \
+            + ' UNION SELECT id FROM dst_locations' + inside, bounds + bounds
+
+
+def _number_sql(number: str, prefix: bool) -> tuple[str, tuple]:
+    """ Return the SQL query selecting the ids of the calls made or received
+    by <number> (or the numbers starting with it, if <prefix> is True), and
+    its parameters.
+
+    Prefixes are looked up as a range of numbers, which uses the indexes on
+    the numbers where LIKE would not.
+    """
+    if not prefix:
+        return 'SELECT id FROM calls WHERE src_number = ? ' \
+               'UNION SELECT id FROM calls WHERE dst_number = ?', \
+            (number, number)
+    following = number[:-1] + chr(ord(number[-1]) + 1)
+    return 'SELECT id FROM calls WHERE src_number >= ? AND src_number < ? ' \
+           'UNION SELECT id FROM calls ' \
+           'WHERE dst_number >= ? AND dst_number < ?', \
+        (number, following, number, following)
+
+
+def get_filter(kind: str, store: Optional[CallStore] = None) \
+        -> Optional[Filter]:
+    """ Return a new filter of <kind> ("customer", "duration", "location",
+    "number", "reset", "time" or "query"), or None if <kind> is unknown.
+
+    SQL filters on <store> are returned if FILTER_BACKEND is "sqlite" and a
+    <store> is given, otherwise the in-memory filters from filter.py.
+    """
+    if FILTER_BACKEND == 'sqlite' and store is not None:
+        filters = {'customer': SQLCustomerFilter,
+                   'duration': SQLDurationFilter,
+                   'location': SQLLocationFilter,
+                   'number': SQLNumberFilter,
+                   'reset': SQLResetFilter}
+        if kind in filters:
+            return filters[kind](store)
+        if kind == 'query':
+            return QueryFilter([StoreIndex(store)])
+        if kind == 'time':
+            # the calls are in memory, and sorted in memory
+            return TimeFilter()
+        return None
+    filters = {'customer': CustomerFilter,
+               'duration': DurationFilter,
+               'location': LocationFilter,
+               'number': NumberFilter,
+               'reset': ResetFilter,
+               'time': TimeFilter,
+               'query': QueryFilter}
+    if kind in filters:
+        return filters[kind]()
+    return None
+
+
+def _sms_row(line: PhoneLine, month: int, year: int) -> tuple:
+    """ Return the row of the sms_counts table for <line> in <month> and
+    <year>.
+    """
+    history = line.callhistory
+    return (line.number, month, year,
+            history.outgoing_sms.get((month, year), 0),
+            history.incoming_sms.get((month, year), 0))
+
+
+def _message_row(messages: SMSStore, position: int) -> tuple:
+    """ Return the row of the messages table for the message at <position>
+    in <messages>.
+    """
+    src, dst, when, src_loc, dst_loc = messages.fields(position)
+    return (NUMBERS.number(src), NUMBERS.number(dst),
+            when.strftime(TIME_FORMAT), src_loc[0], src_loc[1], dst_loc[0],
+            dst_loc[1])
+
+
+def _line_row(customer: Customer, line: PhoneLine) -> tuple:
+    """ Return the row of the lines table for <line>, owned by <customer>.
+    """
+    contract = line.contract
+    end = None
+    balance = None
+    if isinstance(contract, TermContract):
+        kind = 'term'
+        end = contract.end
+    elif isinstance(contract, PrepaidContract):
+        kind = 'prepaid'
+        balance = contract.balance
+    elif isinstance(contract, MTMContract):
+        kind = 'mtm'
+    else:
+        kind = ''
+    return (line.number, customer.get_id(), kind,
+            contract.start.isoformat() if contract.start else None,
+            end.isoformat() if end else None, balance,
+            getattr(contract, 'month', None), getattr(contract, 'year', None))
+
+
+def _restore_contract(row: tuple) -> Optional[Contract]:
+    """ Return the contract described by a <row> of the lines table.
+    """
+    contract = create_contract(row[2])
+    if contract is None:
+        return None
+    contract.start = datetime.date.fromisoformat(row[3]) if row[3] else None
+    if isinstance(contract, TermContract):
+        contract.end = datetime.date.fromisoformat(row[4]) if row[4] else None
+    if isinstance(contract, PrepaidContract):
+        contract.balance = row[5]
+    contract.month = row[6]
+    contract.year = row[7]
+    return contract
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'datetime', 'os', 'sqlite3', 'threading',
+            'cancel', 'bill', 'call', 'contract', 'customer', 'filter',
+            'metrics', 'numbertable', 'phoneline', 'query', 'sms', 'tracing'
+        ],
+        'disable': ['R0902', 'R0913'],
+        'generated-members': 'pygame.*'
+    })
@@ -0,0 +1,177 @@
+"""
+CSC148, Winter 2022
+Assignment 1
+
+This code is provided solely for the personal and private use of
+students taking the CSC148 course at the University of Toronto.
+Copying for purposes other than this use is expressly prohibited.
+All forms of distribution of this code, whether as given or with
+any changes, are expressly prohibited.
+
+All of the files in this directory and all subdirectories are:
+Copyright (c) 2022 Bogdan Simion, Diane Horton, Jacqueline Smith
+
+=== Module Description ===
+
+This file contains an opt-in tracer, which records nested spans (a name, a
+start time, a duration and the thread that ran it) around the stages of the
+application, and writes them in the Chrome trace-event JSON format. The
+output can be opened in chrome://tracing or https://ui.perfetto.dev to see
+where the time of a single slow interaction goes.
+
+Tracing is disabled by default, in which case span() returns a shared
+do-nothing context manager. It is enabled by calling enable(), or by setting
+the MEWBILE_TRACE environment variable to the file the trace should be
+written to when the application exits.
+
+Only the last MAX_EVENTS spans are kept (MEWBILE_TRACE_MAX_EVENTS, 200000 by
+default), so that tracing a long session, where every frame rendered is a
+span, does not use more and more memory: the earliest spans are dropped.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, Callable, Optional
+
+ENABLED = bool(os.environ.get('MEWBILE_TRACE'))
+
+# Returned by span() when tracing is disabled
+_NULL_SPAN = nullcontext()
+
+# Largest number of trace events kept
+MAX_EVENTS = int(os.environ.get('MEWBILE_TRACE_MAX_EVENTS', 200000))
+
+# The last MAX_EVENTS recorded trace events, in the order in which the spans
+# finished
+_events: deque[dict[str, Any]] = deque(maxlen=MAX_EVENTS)
+
+
+def enable() -> None:
+    """ Start recording spans.
+    """
+    global ENABLED
+    ENABLED = True
+
+
+def disable() -> None:
+    """ Stop recording spans. The spans recorded so far are kept.
+    """
+    global ENABLED
+    ENABLED = False
+
+
+def clear(max_events: Optional[int] = None) -> None:
+    """ Forget all the spans recorded so far, and keep at most <max_events>
+    spans from now on if it is given.
+    """
+    global _events
+    if max_events is None:
+        _events.clear()
+    else:
+        _events = deque(maxlen=max_events)
+
+
+def get_events() -> list[dict[str, Any]]:
+    """ Return a copy of the trace events recorded so far.
+    """
+    return list(_events)
+
+
+class Span:
+    """ A timed section of code, used as a context manager. Spans opened
+    inside another span (in the same thread) are shown nested in the trace.
+
+    === Public Attributes ===
+    name:
+        name of this span, as shown in the trace viewer
+    args:
+        extra information shown with this span, e.g. the size of a list
+    """
+    name: str
+    args: dict[str, Any]
+    # === Private Attributes ===
+    # _start:
+    #     time at which this span was entered, in seconds
+    _start: float
+
+    def __init__(self, name: str, args: dict[str, Any]) -> None:
+        """ Create a new span called <name>, with extra <args>.
+        """
+        self.name = name
+        self.args = args
+        self._start = 0.0
+
+    def __enter__(self) -> 'Span':
+        """ Start timing this span.
+        """
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        """ Stop timing this span and record it.
+        """
+        end = time.perf_counter()
+        _events.append({'name': self.name,
+                        'ph': 'X',
+                        'ts': self._start * 1e6,
+                        'dur': (end - self._start) * 1e6,
+                        'pid': os.getpid(),
+                        'tid': threading.get_ident(),
+                        'args': self.args})
+
+
+def span(name: str, **args: Any) -> Any:
+    """ Return a context manager that records a span called <name> with the
+    extra <args>, or does nothing if tracing is disabled.
+    """
+    if not ENABLED:
+        return _NULL_SPAN
+    return Span(name, args)
+
+
+def traced(func: Callable) -> Callable:
+    """ Decorate a function or method so that every call to it is recorded as
+    a span named after it (e.g. "DurationFilter.apply").
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        """ Call the function inside a span, if tracing is enabled.
+        """
+        if not ENABLED:
+            return func(*args, **kwargs)
+        with Span(name, {}):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def write(path: Optional[str] = None) -> None:
+    """ Write the spans recorded so far to <path> (by default, the file named
+    by the MEWBILE_TRACE environment variable) as Chrome trace-event JSON.
+    """
+    if path is None:
+        path = os.environ['MEWBILE_TRACE']
+    events = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+               'tid': t.ident, 'args': {'name': t.name}}
+              for t in threading.enumerate()]
+    events.extend(_events)
+    with open(path, 'w') as out:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, out)
+
+
+if __name__ == '__main__':
+    import python_ta
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'functools', 'json', 'os', 'threading',
+            'time', 'collections', 'contextlib'
+        ],
+        'allowed-io': ['write'],
+        'generated-members': 'pygame.*'
+    })
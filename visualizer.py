@@ -21,19 +21,33 @@ It also contains the Map class, which is responsible for converting between
 longitude/latitude coordinates and pixel coordinates on the pygame window.
 
 DO NOT CHANGE ANY CODE IN THIS FILE, unless instructed in the handout.
+
+pygame and tkinter are only imported when a Visualizer is created, so that
+importing this module (e.g. for get_filter) does not load the GUI libraries.
 """
-import math
+from __future__ import annotations
+
 import os
 import threading
 import time
-from tkinter import *
 from typing import Optional, Union, Callable, Any
 
-import pygame
-
+import cancel
+import metrics
+import tracing
 from call import Drawable, Call
 from customer import Customer
-from filter import Filter, DurationFilter, CustomerFilter, LocationFilter, ResetFilter
+from filter import Filter, ResetFilter, select_sms
+from history import FilterHistory
+from jobs import FilterJob
+from lazy import LazyModule
+import storage
+from sms import SMSStore
+from standing import StandingQuery
+from storage import CallStore
+
+pygame = LazyModule('pygame')
+tkinter = LazyModule('tkinter')
 
 # ----------------------------------------------------------------------------
 # NOTE: You do not need to understand any of the visualization details from
@@ -52,21 +66,31 @@ MAP_MAX = (-79.196382, 43.576959)
 # Window size
 SCREEN_SIZE = (1000, 700)
 
-# Thread settings for Task 5
-NUM_THREADS = 1
+# Seconds a filter may run before it is stopped with a partial result, or
+# None for no limit
+FILTER_BUDGET = float(os.environ['MEWBILE_FILTER_BUDGET']) \
+    if os.environ.get('MEWBILE_FILTER_BUDGET') else None
 
 
-def get_filter(unicode: str) -> Optional[Filter]:
-    """Returns the filter class to use"""
+def get_filter(unicode: str, store: Optional[CallStore] = None) \
+        -> Optional[Filter]:
+    """Returns the filter class to use, answered by <store> if the SQLite
+    filter backend is configured"""
     unicode = unicode.lower()
     if unicode == "d":
-        return DurationFilter()
+        return storage.get_filter('duration', store)
     elif unicode == "l":
-        return LocationFilter()
+        return storage.get_filter('location', store)
     elif unicode == "c":
-        return CustomerFilter()
+        return storage.get_filter('customer', store)
     elif unicode == "r":
-        return ResetFilter()
+        return storage.get_filter('reset', store)
+    elif unicode == "n":
+        return storage.get_filter('number', store)
+    elif unicode == "t":
+        return storage.get_filter('time', store)
+    elif unicode == "q":
+        return storage.get_filter('query', store)
     return None
 
 
@@ -75,6 +99,17 @@ class Visualizer:
 
     === Public attributes ===
     r: the Tk object for the main window
+    store: the database answering the filters, or None
+    standing: the filters applied so far, kept up to date as new calls
+        arrive. If it is None, it is created from the calls shown when the
+        first filter is applied.
+    messages: the SMS messages of the dataset, counted with the filters
+        applied, or None
+    lock: held while a bill is printed or a reset reads the call
+        histories; whatever bills new events meanwhile (e.g. a LiveTail)
+        holds it while it changes them. It is only taken away from the
+        window's thread, so that the window never waits for a batch of new
+        events to be billed.
     """
     # === Private attributes ===
     # _screen: the pygame window that is shown to the user.
@@ -82,18 +117,53 @@ class Visualizer:
     #   on the pygame window.
     # _map: the Map object responsible for converting between longitude/latitude
     #   coordinates and the pixels of the visualization window.
+    # _dialog: the window where filter strings are typed, once a filter has
+    #   been selected
+    # _filter: the filter selected in the dialog, or None
+    # _job: the filter running in the background, or None
+    # _history: the filters applied to <standing>, for undo and redo
+    # _editing: the step of <_history> edited by the dialog, or None if the
+    #   dialog applies a new filter
+    # _job_step: the step of <_history> edited by <_job>, or None if it
+    #   applies a new filter
+    # _job_seen: the number of calls the input of <_job> is up to date
+    #   with, when it edits a step
     _uiscreen: pygame.Surface
     _screen: pygame.Surface
     _mouse_down: bool
     _map: 'Map'
     _quit: bool
-    r: Tk
-
-    def __init__(self) -> None:
-        """Initialize this visualization.
+    _dialog: Optional[FilterDialog]
+    _filter: Optional[Filter]
+    _job: Optional[FilterJob]
+    _history: Optional[FilterHistory]
+    _editing: Optional[int]
+    _job_step: Optional[int]
+    _job_seen: int
+    r: tkinter.Tk
+    store: Optional[CallStore]
+    standing: Optional[StandingQuery]
+    messages: Optional[SMSStore]
+    lock: threading.RLock
+
+    def __init__(self, store: Optional[CallStore] = None) -> None:
+        """Initialize this visualization, with filters answered by <store>
+        if it is given.
         """
-        self.r = Tk()
-        Label(self.r, text="Welcome to MewbileTech phone management system") \
+        self.store = store
+        self.standing = None
+        self.messages = None
+        self.lock = threading.RLock()
+        self._dialog = None
+        self._filter = None
+        self._job = None
+        self._history = None
+        self._editing = None
+        self._job_step = None
+        self._job_seen = 0
+        self.r = tkinter.Tk()
+        tkinter.Label(self.r,
+                      text="Welcome to MewbileTech phone management system") \
             .grid(row=0, column=0)
         self.r.title("MewbileTech management system")
         pygame.init()
@@ -115,9 +185,19 @@ class Visualizer:
                             (SCREEN_SIZE[0] + 10, 200))
         self._uiscreen.blit(font.render("R: reset filter", True, WHITE),
                             (SCREEN_SIZE[0] + 10, 250))
-
-        self._uiscreen.blit(font.render("M: monthly bill", True, WHITE),
+        self._uiscreen.blit(font.render("T: time", True, WHITE),
+                            (SCREEN_SIZE[0] + 10, 300))
+        self._uiscreen.blit(font.render("N: phone number", True, WHITE),
+                            (SCREEN_SIZE[0] + 10, 350))
+        self._uiscreen.blit(font.render("Q: query", True, WHITE),
+                            (SCREEN_SIZE[0] + 10, 400))
+
+        self._uiscreen.blit(font.render("U: undo, Y: redo", True, WHITE),
+                            (SCREEN_SIZE[0] + 10, 450))
+        self._uiscreen.blit(font.render("E: edit last filter", True, WHITE),
                             (SCREEN_SIZE[0] + 10, 500))
+        self._uiscreen.blit(font.render("M: monthly bill", True, WHITE),
+                            (SCREEN_SIZE[0] + 10, 550))
         self._uiscreen.blit(font.render("X: quit application", True, WHITE),
                             (SCREEN_SIZE[0] + 10, 650))
 
@@ -130,9 +210,11 @@ class Visualizer:
         self.render_drawables([])
         self._quit = False
 
+    @tracing.traced
     def render_drawables(self, drawables: list[Drawable]) -> None:
         """Render the <drawables> to the screen
         """
+        start = time.perf_counter()
         # Draw the background map onto the screen
         self._screen.fill(WHITE)
         self._screen.blit(self._map.get_current_view(), (0, 0))
@@ -143,6 +225,14 @@ class Visualizer:
         # Show the new image
         pygame.display.flip()
 
+        if metrics.ENABLED:
+            metrics.REGISTRY.histogram('frame_seconds',
+                                       "Time to render one frame") \
+                .observe(time.perf_counter() - start)
+            metrics.REGISTRY.gauge('drawables_drawn',
+                                   "Drawables rendered in the last frame") \
+                .set(len(drawables))
+
     def has_quit(self) -> bool:
         """Returns if the program has received the quit command
         """
@@ -177,67 +267,21 @@ class Visualizer:
         <customers> list contains all customers from the input data.
         Return a new list of Calls, according to user input actions.
         """
-        new_drawables = drawables
+        new_drawables = self._poll_filter(customers, drawables)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 self._quit = True
             elif event.type == pygame.KEYDOWN and event.unicode.lower() == 'x':
                 self._quit = True
             elif event.type == pygame.KEYDOWN:
-                f = get_filter(event.unicode)
+                f = get_filter(event.unicode, self.store)
 
                 if f is not None:
-                    def result_wrapper(fun: Callable[[list[Customer],
-                                                      list[Call],
-                                                      str], list[Call]],
-                                       customers: list[Customer],
-                                       data: list[Call],
-                                       filter_string: str,
-                                       res: list) -> None:
-                        """A final wrapper to return the result of the operation
-                        """
-                        res.append(fun(customers, data, filter_string))
-
-                    def threading_wrapper(customers: list[Customer],
-                                          data: list[Call],
-                                          filter_string: str) -> list[Call]:
-                        """A wrapper for the application of filters with
-                        threading
-                        """
-                        chk_cls = math.ceil(
-                            (len(data) + NUM_THREADS - 1) / NUM_THREADS)
-                        print("Num_threads:", NUM_THREADS)
-                        print("Chunk_calls:", chk_cls)
-                        threads = []
-                        results = []
-                        for i in range(NUM_THREADS):
-                            res = []
-                            results.append(res)
-                            t = threading.Thread(target=result_wrapper,
-                                                 args=(f.apply,
-                                                       customers,
-                                                       data[i * chk_cls:
-                                                            (i + 1) * chk_cls],
-                                                       filter_string,
-                                                       res))
-                            t.daemon = True
-                            t.start()
-                            threads.append(t)
-                            # f.apply(customers, data, filter_string)
-                        # Wait to finish
-                        for t in threads:
-                            t.join()
-
-                        # Now reconstruct the data
-                        new_data = []
-                        for res in results:
-                            new_data.extend(res[0])
-                        return new_data
-
-                    new_drawables = self.entry_window(str(f),
-                                                      customers,
-                                                      drawables,
-                                                      threading_wrapper)
+                    self._editing = None
+                    self._open_dialog(f)
+                elif event.unicode.lower() in ('u', 'y', 'e'):
+                    new_drawables = self._step_history(
+                        event.unicode.lower(), customers, new_drawables)
 
                 # Perform the billing for a selected customer:
                 if event.unicode == "m":
@@ -285,7 +329,12 @@ class Visualizer:
                         if date is None or date == ([], []):
                             raise ValueError
 
-                        customer[0].print_bill(date[0], date[1])
+                        # printed in the background, as it waits for the
+                        # batch of new events being billed, if any
+                        threading.Thread(target=self._print_bill,
+                                         args=(customer[0], date[0], date[1]),
+                                         daemon=True,
+                                         name='print-bill').start()
 
                     except ValueError:
                         print("ERROR: bad formatting for input string")
@@ -300,6 +349,134 @@ class Visualizer:
                 self.set_event_button_motion()
         return new_drawables
 
+    def _open_dialog(self, f: Filter) -> None:
+        """ Show the filter dialog for the filter <f>.
+        """
+        if self._dialog is None:
+            self._dialog = FilterDialog(self.r, self._cancel_filter)
+        self._filter = f
+        self._dialog.show(str(f), not isinstance(f, ResetFilter))
+
+    def _cancel_filter(self) -> None:
+        """ Cancel the filter running in the background, if any.
+        """
+        if self._job is not None:
+            self._job.cancel()
+
+    def _print_bill(self, customer: Customer, month: int, year: int) -> None:
+        """ Print the bill of <customer> for <month> and <year>, holding the
+        lock so that it is not changed meanwhile.
+        """
+        with self.lock:
+            customer.print_bill(month, year)
+
+    def _get_history(self, customers: list[Customer],
+                     drawables: list[Call]) -> FilterHistory:
+        """ Return the history of the filters applied to <drawables>, the
+        calls shown.
+        """
+        if self.standing is None:
+            self.standing = StandingQuery(customers, drawables)
+        if self._history is None or self._history.standing is not \
+                self.standing:
+            self._history = FilterHistory(self.standing)
+        return self._history
+
+    def _step_history(self, key: str, customers: list[Customer],
+                      drawables: list[Call]) -> list[Call]:
+        """ Undo ("u") or redo ("y") a filter, or open the dialog to edit
+        the last filter applied ("e"), and return the calls to show.
+        """
+        if key != 'e':
+            self._cancel_filter()
+        history = self._get_history(customers, drawables)
+        if key == 'e':
+            if history.can_undo():
+                self._editing = len(history.steps()) - 1
+                self._open_dialog(history.steps()[-1][0])
+            return drawables
+        result = history.undo() if key == 'u' else history.redo()
+        if result is None:
+            return drawables
+        print("FILTERS:", " > ".join("%s(%s)" % (type(f).__name__, s)
+                                     for f, s in history.steps()),
+              "-", len(result), "calls" + self._count_sms(customers))
+        return result
+
+    def _count_sms(self, customers: list[Customer]) -> str:
+        """ Return the number of SMS messages selected by the filters
+        applied, to be printed after the number of calls.
+
+        The messages added so far are counted without the lock (see
+        SMSStore.add), while new ones may be added.
+        """
+        if self.messages is None or self._history is None:
+            return ""
+        return ", %d SMS messages" % len(select_sms(
+            customers, self.messages, self._history.steps()))
+
+    def _poll_filter(self, customers: list[Customer],
+                     drawables: list[Call]) -> list[Call]:
+        """ Process the events of the filter dialog, start the filter it
+        asks for on <drawables>, and return the calls to show: the result of
+        the running filter if it has just finished, otherwise <drawables>.
+        """
+        self.r.update()
+        if self._dialog is None:
+            return drawables
+
+        filter_string = self._dialog.take_request()
+        if filter_string is not None and self._filter is not None:
+            self._cancel_filter()
+            history = self._get_history(customers, drawables)
+            data = drawables
+            self._job_step = self._editing
+            if self._editing is not None:
+                data, self._job_seen = history.input(self._editing)
+            else:
+                cached = history.lookup(self._filter, filter_string)
+                if cached is not None:
+                    print("FILTER APPLIED (cached):", len(cached),
+                          "calls" + self._count_sms(customers))
+                    self._dialog.hide()
+                    return cached
+            self._job = FilterJob(self._filter, customers, data,
+                                  filter_string, FILTER_BUDGET, self.lock)
+            self._job.start()
+            self._dialog.set_status("Filtering...", True)
+
+        job = self._job
+        if job is None:
+            return drawables
+        if not job.is_finished():
+            self._dialog.set_status(
+                "Filtering... %d%%" % (100 * job.progress()), True)
+            return drawables
+
+        self._job = None
+        if job.result is None:
+            self._dialog.set_status("Cancelled", False)
+            return drawables
+        history = self._get_history(customers, drawables)
+        if self._job_step is not None:
+            result = history.edit(self._job_step, job.filter_string,
+                                  job.result, self._job_seen)
+        else:
+            result = history.push(job.f, job.filter_string, job.result,
+                                  job.data, job.seen)
+        if not cancel.is_complete(job.result):
+            # Keep the dialog open, to tell that the result is incomplete
+            self._dialog.set_status(
+                "Out of time after %d of %d calls: showing %d calls"
+                % (job.result.scanned, job.result.total, len(job.result)),
+                False)
+            return result
+        print("FILTER APPLIED:", len(result),
+              "calls" + self._count_sms(customers))
+        self._dialog.set_status("", False)
+        self._dialog.hide()
+        return result
+
     def entry_window(self, field: str,
                      customers: list[Customer],
                      drawables: Union[list[Customer],
@@ -313,11 +490,11 @@ class Visualizer:
         applies the <callback> function onto the <drawables>
         """
         new_drawables = []
-        m = Tk()
+        m = tkinter.Tk()
         m.title("Filter")
-        Label(m, text=field).grid(row=0)
+        tkinter.Label(m, text=field).grid(row=0)
 
-        el = Entry(m)
+        el = tkinter.Entry(m)
         # No textbox for filter string if it's a Reset filter
         if field != "Reset all of the filters applied so far, if any":
             el.grid(row=0, column=1)
@@ -330,23 +507,123 @@ class Visualizer:
             nonlocal new_drawables
             nonlocal m
             t1 = time.time()
-            new_drawables = callback(customers, drawables, input_string)
+            with tracing.span('entry_window callback', field=field):
+                new_drawables = callback(customers, drawables, input_string)
             t2 = time.time()
             print("Time elapsed:  " + str(t2 - t1))
             m.destroy()
 
-        Button(m, text="Apply Filter",
-               command=lambda:
-               callback_wrapper(el.get()
-                                if field != "Reset all of the filters applied "
-                                            "so far, if any"
-                                else "")).grid(row=1, column=0,
-                                               sticky=W, pady=5)
-        m.mainloop()
+        tkinter.Button(m, text="Apply Filter",
+                       command=lambda:
+                       callback_wrapper(el.get()
+                                        if field != "Reset all of the filters "
+                                                    "applied so far, if any"
+                                        else "")).grid(row=1, column=0,
+                                                       sticky=tkinter.W,
+                                                       pady=5)
+        with tracing.span('entry_window mainloop', field=field):
+            m.mainloop()
         print("FILTER APPLIED")
         return new_drawables
 
 
+class FilterDialog:
+    """ The window where the filter string of the selected filter is typed.
+
+    The window is created once and shown again each time a filter is
+    selected. It never runs its own event loop: the Tk events are processed
+    by the update() of the main window, once per frame.
+
+    === Public attributes ===
+    window: the dialog window
+    """
+    # === Private attributes ===
+    # _prompt: shows the description of the selected filter
+    # _entry: where the filter string is typed
+    # _status: shows the progress of the running filter
+    # _cancel: the button cancelling the running filter
+    # _on_cancel: called when the running filter is cancelled
+    # _request: the filter string to apply, once the filter is applied
+    window: tkinter.Toplevel
+    _prompt: tkinter.Label
+    _entry: tkinter.Entry
+    _status: tkinter.Label
+    _cancel: tkinter.Button
+    _on_cancel: Callable[[], None]
+    _request: Optional[str]
+
+    def __init__(self, root: tkinter.Tk,
+                 on_cancel: Callable[[], None]) -> None:
+        """ Create the dialog (hidden) as a window of <root>. <on_cancel> is
+        called when the user cancels the running filter.
+        """
+        self.window = tkinter.Toplevel(root)
+        self.window.title("Filter")
+        self.window.protocol("WM_DELETE_WINDOW", self.hide)
+        self._prompt = tkinter.Label(self.window, wraplength=400,
+                                     justify=tkinter.LEFT)
+        self._prompt.grid(row=0, column=0, columnspan=2, sticky=tkinter.W)
+        self._entry = tkinter.Entry(self.window, width=40)
+        self._entry.bind('<Return>', lambda event: self._apply())
+        tkinter.Button(self.window, text="Apply Filter",
+                       command=self._apply).grid(row=2, column=0,
+                                                 sticky=tkinter.W, pady=5)
+        self._cancel = tkinter.Button(self.window, text="Cancel",
+                                      command=self._cancel_filter,
+                                      state=tkinter.DISABLED)
+        self._cancel.grid(row=2, column=1, sticky=tkinter.W, pady=5)
+        self._status = tkinter.Label(self.window, text="")
+        self._status.grid(row=3, column=0, columnspan=2, sticky=tkinter.W)
+        self._on_cancel = on_cancel
+        self._request = None
+        self.window.withdraw()
+
+    def show(self, description: str, needs_input: bool) -> None:
+        """ Show the dialog for a filter with <description>, with a box for
+        the filter string if <needs_input>.
+        """
+        self._prompt.configure(text=description)
+        self._entry.delete(0, tkinter.END)
+        if needs_input:
+            self._entry.grid(row=1, column=0, columnspan=2, sticky=tkinter.W)
+            self._entry.focus_set()
+        else:
+            self._entry.grid_remove()
+        self.window.deiconify()
+        self.window.lift()
+
+    def hide(self) -> None:
+        """ Hide the dialog, without cancelling the running filter.
+        """
+        self.window.withdraw()
+
+    def set_status(self, text: str, running: bool) -> None:
+        """ Show <text> as the status of the filter, which can be cancelled
+        if it is <running>.
+        """
+        self._status.configure(text=text)
+        self._cancel.configure(
+            state=tkinter.NORMAL if running else tkinter.DISABLED)
+
+    def take_request(self) -> Optional[str]:
+        """ Return the filter string the user applied since the last call,
+        or None if the filter was not applied.
+        """
+        request, self._request = self._request, None
+        return request
+
+    def _apply(self) -> None:
+        """ Record that the user applied the filter string in the entry.
+        """
+        self._request = self._entry.get()
+
+    def _cancel_filter(self) -> None:
+        """ Cancel the running filter.
+        """
+        self._on_cancel()
+        self.set_status("Cancelling...", False)
+
+
 class Map:
     """ Window panning and zooming interface.
 
@@ -470,11 +747,13 @@ if __name__ == '__main__':
         'allowed-import-modules': [
             'doctest', 'python_ta', 'typing',
             'tkinter', 'os', 'pygame',
-            'threading', 'math', 'time',
-            'customer', 'call', 'filter',
+            'time', 'threading', 'jobs', 'cancel',
+            'customer', 'call', 'filter', 'metrics', 'tracing', 'lazy',
+            'storage', 'standing', 'history', 'sms'
         ],
         'allowed-io': [
-            'entry_window', 'callback_wrapper', 'threading_wrapper',
+            'entry_window', 'callback_wrapper', '_poll_filter',
+            '_step_history', '_print_bill',
             '__init__', 'handle_window_events'
         ],
         'disable': ['R0915', 'W0613', 'W0401', 'R0201'],